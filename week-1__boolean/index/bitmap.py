@@ -0,0 +1,174 @@
+#!/usr/bin/python3.4
+# -*- coding: utf-8 -*-
+
+import logging
+from bisect import bisect_left
+
+logging.basicConfig(
+    format='%(levelname)s %(asctime)s : %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p',
+    level=logging.DEBUG)
+logger = logging.getLogger('bitmap')
+
+
+class RoaringBitmap:
+    # сжатое битовое множество doc_id в духе Roaring Bitmap
+    # все множество делится на блоки по 2^16 значений (ключ блока - старшие 16 бит doc_id), в каждом блоке хранится:
+    # * отсортированный список младших 16 бит - для разреженных блоков (не больше array_limit элементов)
+    # * число python, двоичное представление которого - битовая маска блока - для плотных блоков
+    # пустые блоки не хранятся вовсе, поэтому строка матрицы занимает память пропорционально числу единиц в ней
+    array_limit = 4096
+    container_bits = 16
+    container_size = 1 << 16
+
+    containers = None
+
+    def __init__(self, containers=None):
+        self.containers = {} if containers is None else containers
+
+    @staticmethod
+    def from_sorted(values):
+        bitmap = RoaringBitmap()
+        for value in values:
+            high = value >> RoaringBitmap.container_bits
+            if high not in bitmap.containers:
+                bitmap.containers[high] = []
+            bitmap.containers[high].append(value & (RoaringBitmap.container_size - 1))
+
+        for high, container in bitmap.containers.items():
+            if len(container) > RoaringBitmap.array_limit:
+                bitmap.containers[high] = RoaringBitmap.to_bits(container)
+        return bitmap
+
+    @staticmethod
+    def to_bits(container):
+        if isinstance(container, int):
+            return container
+        raw = bytearray(RoaringBitmap.container_size >> 3)
+        for low in container:
+            raw[low >> 3] = raw[low >> 3] | (1 << (low & 7))
+        return int.from_bytes(bytes(raw), 'little')
+
+    @staticmethod
+    def bits_to_list(bits):
+        return [low for low, bit in enumerate(reversed(bin(bits)[2:])) if bit == '1']
+
+    @staticmethod
+    def normalize(bits):
+        # плотный блок, ставший разреженным, снова храним списком
+        if bin(bits).count('1') > RoaringBitmap.array_limit:
+            return bits
+        return RoaringBitmap.bits_to_list(bits)
+
+    @staticmethod
+    def intersect_arrays(a, b):
+        res = []
+        i = 0
+        j = 0
+        while i < len(a) and j < len(b):
+            if a[i] < b[j]:
+                i = i + 1
+            elif a[i] > b[j]:
+                j = j + 1
+            else:
+                res.append(a[i])
+                i = i + 1
+                j = j + 1
+        return res
+
+    @staticmethod
+    def union_arrays(a, b):
+        res = []
+        i = 0
+        j = 0
+        while i < len(a) and j < len(b):
+            if a[i] < b[j]:
+                res.append(a[i])
+                i = i + 1
+            elif a[i] > b[j]:
+                res.append(b[j])
+                j = j + 1
+            else:
+                res.append(a[i])
+                i = i + 1
+                j = j + 1
+        res.extend(a[i:])
+        res.extend(b[j:])
+        return res
+
+    @staticmethod
+    def and_containers(a, b):
+        if isinstance(a, int) and isinstance(b, int):
+            return RoaringBitmap.normalize(a & b)
+        if isinstance(a, int):
+            a, b = b, a
+        if isinstance(b, int):
+            return [low for low in a if (b >> low) & 1]
+        return RoaringBitmap.intersect_arrays(a, b)
+
+    @staticmethod
+    def or_containers(a, b):
+        if isinstance(a, int) or isinstance(b, int):
+            return RoaringBitmap.to_bits(a) | RoaringBitmap.to_bits(b)
+        res = RoaringBitmap.union_arrays(a, b)
+        if len(res) > RoaringBitmap.array_limit:
+            return RoaringBitmap.to_bits(res)
+        return res
+
+    def __and__(self, other):
+        res = {}
+        for high, container in self.containers.items():
+            if high in other.containers:
+                and_container = self.and_containers(container, other.containers[high])
+                if and_container:
+                    res[high] = and_container
+        return RoaringBitmap(res)
+
+    def __or__(self, other):
+        res = dict(self.containers)
+        for high, container in other.containers.items():
+            res[high] = self.or_containers(res[high], container) if high in res else container
+        return RoaringBitmap(res)
+
+    def complement(self, universe):
+        # дополнение до множества doc_id 1..universe (doc_id начинаются с 1)
+        res = {}
+        for high in range((universe >> self.container_bits) + 1):
+            lo_bound = 1 if high == 0 else 0
+            hi_bound = min(self.container_size - 1, universe - (high << self.container_bits))
+            if hi_bound < lo_bound:
+                continue
+            mask = ((1 << (hi_bound + 1)) - 1) ^ ((1 << lo_bound) - 1)
+            bits = mask & ~self.to_bits(self.containers.get(high, 0))
+            if bits:
+                res[high] = self.normalize(bits)
+        return RoaringBitmap(res)
+
+    def __contains__(self, value):
+        container = self.containers.get(value >> self.container_bits)
+        if container is None:
+            return False
+        low = value & (self.container_size - 1)
+        if isinstance(container, int):
+            return (container >> low) & 1 == 1
+        i = bisect_left(container, low)
+        return i < len(container) and container[i] == low
+
+    def __iter__(self):
+        for high in sorted(self.containers.keys()):
+            container = self.containers[high]
+            lows = self.bits_to_list(container) if isinstance(container, int) else container
+            for low in lows:
+                yield (high << self.container_bits) | low
+
+    def __len__(self):
+        size = 0
+        for container in self.containers.values():
+            size = size + (bin(container).count('1') if isinstance(container, int) else len(container))
+        return size
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return "RoaringBitmap(" + str(list(self)) + ")"
@@ -36,23 +36,19 @@ class IndexBuilder:
         # каждая строка - валидный json, в котором точно есть поля url и content
         with open(self.ipw.get_raw_docs_path(), "r") as in_file:
             doc_id = 0
-            word_id = 1
 
             for line in in_file:
                 doc_id = doc_id + 1
-                jo = json.loads(line, 'utf-8')
+                jo = json.loads(line)
 
                 # нормализуем текст
-                text = jo["content"]
                 # 1. Объединение цифр в один токен в случае, если разряды разделялись дополнительным пробелом.
                 # Пример: стандартная запись числа "10 000". После этого этапа 2 терма превратятся в один: "10000"
-                text = TextNormalizer.join_numbers(text)
                 # 2. Удаляем все знаки пунктуации. Мы используем упрощенную индексацию, поэтому пунктуация нам не нужна
-                text = TextNormalizer.clean_out_punct(text)
                 # 3. Понижаем регистр текста
-                text = TextNormalizer.lower_case(text)
                 # 4. Разбиваем текст на термы
-                terms = TextNormalizer.split(text)
+                # Все 4 шага выполняет TextNormalizer.normalize за один вызов
+                terms = TextNormalizer.normalize(jo["content"])
                 # 5. Лемматизация
                 lemmas = [self.lemmatizer.lemmatize(term) for term in terms]
                 # Некоторые леммы могут встречаться в документе несколько раз. Для нас это лишняя информация => уникуем леммы
@@ -62,14 +58,9 @@ class IndexBuilder:
                 self.docs_dict.add_elem(str(jo["url"]), doc_id)
 
                 for lemma in lemmas_unique:
-                    # Пытаемся добавить очередную лемму в словарь слов
-                    new_id = self.words_dict.add_elem(lemma, word_id)
-                    if new_id < word_id:
-                        # в словаре уже есть такая лемма
-                        pass
-                    else:
-                        # это новая лемма, она получает уникальный word_id. Следующей нужен будет другой id
-                        word_id = word_id+1
+                    # Добавляем очередную лемму в словарь слов: новая лемма получает следующий свободный word_id,
+                    # для уже известной возвращается ее word_id
+                    new_id = self.words_dict.add_elem(lemma)
 
                     # Сохраняем информацию о том, что эта лемма есть в этом документе в матрицу инцидентности
                     self.matrix.activate(new_id, doc_id)
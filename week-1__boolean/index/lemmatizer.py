@@ -2,6 +2,8 @@
 # -*- coding: utf-8 -*-
 
 import logging
+import threading
+from collections import OrderedDict
 import pymorphy2
 
 logging.basicConfig(
@@ -10,22 +12,66 @@ logging.basicConfig(
     level=logging.DEBUG)
 logger = logging.getLogger('lemmatizer')
 
+# один MorphAnalyzer на процесс: словари pymorphy2 загружаются при первом промахе кэша любого TextLemmatizer
+shared_morph = None
+shared_morph_lock = threading.Lock()
+
+
+def get_morph_analyzer():
+    global shared_morph
+    if shared_morph is None:
+        with shared_morph_lock:
+            if shared_morph is None:
+                shared_morph = pymorphy2.MorphAnalyzer()
+    return shared_morph
+
 
 class TextLemmatizer:
-    def __init__(self):
-        self.cache = dict()
-        self.morph = pymorphy2.MorphAnalyzer()
+    # обращения к кэшу, промах - разбор слова pymorphy2
+    cache_hits = 0
+    cache_misses = 0
+    # кэш в памяти ограничен cache_size словоформами: при переполнении вытесняется давно не использованная (LRU)
+    cache_size = 100000
+    cache_evictions = 0
+    # общий MorphAnalyzer (get_morph_analyzer), берется при первом промахе
+    morph = None
+
+    def __init__(self, cache_size=None):
+        self.cache = OrderedDict()
+        if cache_size is not None:
+            self.cache_size = cache_size
+
+    def remember(self, word, lemma):
+        self.cache[word] = lemma
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+            self.cache_evictions = self.cache_evictions + 1
+
+    def cache_stats(self):
+        return {
+            "size": len(self.cache),
+            "capacity": self.cache_size,
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+            "evictions": self.cache_evictions
+        }
 
     def lemmatize(self, word):
-        if word in self.cache:
-            return self.cache[word]
+        result = self.cache.get(word)
+        if result is not None:
+            self.cache_hits = self.cache_hits + 1
+            self.cache.move_to_end(word)
+            return result
+        self.cache_misses = self.cache_misses + 1
 
+        if self.morph is None:
+            self.morph = get_morph_analyzer()
         candidates = self.morph.parse(word)
         if len(candidates) == 0:
             result = word
         else:
             result = candidates[0].normal_form
 
-        self.cache[word] = result
+        self.remember(word, result)
 
         return result
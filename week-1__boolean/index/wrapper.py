@@ -3,6 +3,7 @@
 import json
 import logging
 from struct import Struct
+from index.bitmap import RoaringBitmap
 from index.lemmatizer import TextLemmatizer
 
 logging.basicConfig(
@@ -41,6 +42,8 @@ class Matrix:
         self._tf_idf = {}
         self._docs = []
         self._docs_set = set()
+        # строки матрицы в виде сжатых битовых множеств (см. RoaringBitmap), строятся один раз при загрузке
+        self._rows = {}
 
         # или не делайте ничего:
         # pass
@@ -55,6 +58,7 @@ class Matrix:
         if w_id not in self._tf_idf:
             self._tf_idf[w_id] = {str(d_id): True}
         self._tf_idf[w_id][d_id] = True
+        self._rows.pop(w_id, None)
 
         if d_id not in self._docs_set:
             self._docs_set.add(d_id)
@@ -86,6 +90,24 @@ class Matrix:
 
         return bin_int
 
+    def max_doc_id(self):
+        # наибольший doc_id, встречающийся в матрице (_docs отсортирован как строки, поэтому max по числам)
+        return max((int(d_id) for d_id in self._docs), default=0)
+
+    def build_row(self, w_id):
+        return RoaringBitmap.from_sorted(sorted(int(d_id) for d_id in self._tf_idf[w_id]))
+
+    def extract_bitmap(self, word_id):
+        # возвращает строку матрицы в виде RoaringBitmap с doc_id документов, в которых есть слово
+        w_id = str(word_id)
+
+        if w_id not in self._tf_idf:
+            return RoaringBitmap()
+
+        if w_id not in self._rows:
+            self._rows[w_id] = self.build_row(w_id)
+        return self._rows[w_id]
+
     def load_matrix(self, path):
         loaded_elements = 0
         with open(path, "r", encoding='utf8') as f:
@@ -99,6 +121,9 @@ class Matrix:
                 docs_for_word = list(self._tf_idf[word_id].keys())
                 self._docs_set = self._docs_set.union(set(docs_for_word))
         self._docs = sorted(list(self._docs_set))
+        self._rows = {}
+        for word_id in self._tf_idf:
+            self._rows[word_id] = self.build_row(word_id)
 
         logger.info(msg="Load matrix from '" + path + "'. " + str(len(self._tf_idf.keys())) + " element(s) loaded.")
         logger.info(msg="Load matrix: tf_idf=" + str(self._tf_idf))
@@ -122,6 +147,7 @@ class Dictionary:
     rev_d = None
     build_rev = False
     dictionary_size = 0
+    next_key = 1
     was_reverted = False
     number_struct = Struct("<I")
 
@@ -132,8 +158,11 @@ class Dictionary:
     def clean_start(self):
         self.d = {}
         if self.build_rev:
+            # обратное отображение: rev_d[key] = elem, для свободных key - None
+            # занят ли key, проверяется за O(1) по индексу, а не поиском по списку
             self.rev_d = []
         self.dictionary_size = 0
+        self.next_key = 1
 
     def load_dict(self, path, need_revert=False):
         # указание на need_revert используется для удобства работы со словарем документов (url <-> doc_id)
@@ -155,7 +184,10 @@ class Dictionary:
                 bin_data = bin_file.read(self.number_struct.size)
                 key = self.number_struct.unpack(bin_data)[0]
                 if need_revert:
-                    self.add_elem(key, record)
+                    # ключом здесь становится id, а значением - строка, обратное отображение не нужно
+                    if key not in self.d:
+                        self.d[key] = record
+                        self.dictionary_size = self.dictionary_size + 1
                 else:
                     self.add_elem(record, key)
         logger.info(msg="Load dictionary from '" + path + "'. " + str(self.dictionary_size) + " element(s) loaded.")
@@ -173,26 +205,33 @@ class Dictionary:
                 bin_file.write(self.number_struct.pack(self.d[k]))
         logger.info(msg="Save dictionary to '" + path + "'. " + str(self.dictionary_size) + " element(s) saved.")
 
-    def add_elem(self, elem, key):
+    def add_elem(self, elem, key=None):
+        # если key не задан, элемент получает следующий свободный id (счетчик только растет)
         if elem in self.d:
             return self.d[elem]
 
         self.dictionary_size = self.dictionary_size + 1
+        if key is None:
+            key = self.next_key
 
         if self.build_rev:
-            while key in self.rev_d:
+            while self.has_key(key):
                 key = key + 1
+            if key >= len(self.rev_d):
+                self.rev_d.extend([None] * (key + 1 - len(self.rev_d)))
+            self.rev_d[key] = elem
 
-            self.d[elem] = key
-            for i in range(len(self.rev_d)):
-                if self.rev_d[i] > key:
-                    self.rev_d.insert(i, key)
-                    return key
-            self.rev_d.append(key)
-            return key
-        else:
-            self.d[elem] = key
-            return key
+        self.d[elem] = key
+        if key >= self.next_key:
+            self.next_key = key + 1
+        return key
+
+    def has_key(self, key):
+        return self.rev_d is not None and key < len(self.rev_d) and self.rev_d[key] is not None
+
+    def get_elem(self, key):
+        # элемент по его id (только для словаря с build_rev)
+        return self.rev_d[key] if self.has_key(key) else None
 
     def make_reverted(self):
         self.clean_revert()
@@ -232,3 +271,8 @@ class Wrapper:
         self.matrix.load_matrix(ipw.get_index_path())
 
         self.lemmatizer = TextLemmatizer()
+
+    def docs_count(self):
+        # наибольший doc_id индекса: документы с повторяющимся url есть в матрице, но не в docs_dict,
+        # поэтому размер docs_dict его занижает
+        return max(max(self.docs_dict.d.keys(), default=0), self.matrix.max_doc_id())
@@ -4,6 +4,7 @@
 import re
 from enum import Enum
 
+from index.bitmap import RoaringBitmap
 from index.normalizer import TextNormalizer
 
 
@@ -104,6 +105,8 @@ class TreeNode:
         if self.token.is_term():
             return values_map[self.token.value]
         elif self.token.is_not():
+            if isinstance(left_value, RoaringBitmap):
+                return left_value.complement(docs_count)
             return self.execute_bit_not(left_value, docs_count)
         elif self.token.tokenType == TokenType.OR:
             return left_value | right_value
@@ -6,6 +6,7 @@ import sys
 
 from urllib.parse import unquote
 
+from index.bitmap import RoaringBitmap
 from index.wrapper import Wrapper
 from search_shell.qtree import QueryTree
 
@@ -30,14 +31,18 @@ class Shell:
         for term in terms:
             key = self.wrapper.words_dict.get_key(term)
             if key is not None:
-                binary_line = self.wrapper.matrix.extract_line(key)
-                res[term] = binary_line
+                res[term] = self.wrapper.matrix.extract_bitmap(key)
             else:
-                res[term] = 0b0
+                res[term] = RoaringBitmap()
 
         return res
 
     def decipher_query_results(self, query_result):
+        if isinstance(query_result, RoaringBitmap):
+            # у документов с повторяющимся url нет своей записи в docs_dict, такие doc_id пропускаются
+            urls = [self.wrapper.docs_dict.d.get(doc_id) for doc_id in query_result]
+            return [url for url in urls if url is not None]
+
         if query_result == 0:
             return []
 
@@ -71,7 +76,7 @@ class Shell:
             if res_map is None:
                 print("Sorry, I cannot execute your query")
             else:
-                query_result = tree.left_right_root_execute(res_map, self.wrapper.docs_dict.dictionary_size)
+                query_result = tree.left_right_root_execute(res_map, self.wrapper.docs_count())
                 docs_result = self.decipher_query_results(query_result)
                 print(str(len(docs_result)) + " doc(s) found")
                 print('\n'.join(self.human_readable_url(doc_name) for doc_name in docs_result))
@@ -0,0 +1,43 @@
+#!/usr/bin/python3.4
+# -*- coding: utf-8 -*-
+
+import unittest
+from unittest import TestCase
+
+from index.bitmap import RoaringBitmap
+
+
+class RoaringBitmapTestCase(TestCase):
+    def test_sparse(self):
+        a = RoaringBitmap.from_sorted([1, 3, 5, 70000, 70002])
+        b = RoaringBitmap.from_sorted([3, 4, 5, 70002, 200000])
+
+        self.assertEqual(5, len(a))
+        self.assertTrue(70000 in a)
+        self.assertFalse(70001 in a)
+        self.assertEqual([3, 5, 70002], list(a & b))
+        self.assertEqual([1, 3, 4, 5, 70000, 70002, 200000], list(a | b))
+        self.assertEqual([2, 4, 6, 7], list(RoaringBitmap.from_sorted([1, 3, 5]).complement(7)))
+        self.assertEqual([], list(RoaringBitmap().complement(0)))
+
+    def test_dense(self):
+        evens = list(range(2, 100000, 2))
+        threes = list(range(3, 100000, 3))
+        a = RoaringBitmap.from_sorted(evens)
+        b = RoaringBitmap.from_sorted(threes)
+
+        # первый блок плотный, второй (65536..99999) тоже содержит больше array_limit элементов
+        self.assertTrue(isinstance(a.containers[0], int))
+        self.assertEqual(len(evens), len(a))
+        self.assertEqual(list(range(6, 100000, 6)), list(a & b))
+        self.assertEqual(sorted(set(evens) | set(threes)), list(a | b))
+        self.assertEqual(list(range(1, 100000, 2)), list(a.complement(99999)))
+
+        # пересечение плотного и разреженного блоков
+        sparse = RoaringBitmap.from_sorted([4, 5, 65538, 65539])
+        self.assertEqual([4, 65538], list(a & sparse))
+        self.assertEqual([4, 65538], list(sparse & a))
+
+
+if __name__ == '__main__':
+    unittest.main()
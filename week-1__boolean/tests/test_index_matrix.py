@@ -64,6 +64,33 @@ class IndexMatrixTestCase(TestCase):
         self.assertEqual(0b000110, matrix.extract_line(53))
         self.assertEqual(0, matrix.extract_line(54))
 
+    def test_matrix_extract_bitmap(self):
+        matrix = Matrix()
+
+        documents = {
+            15: [2, 5],
+            27: [1],
+            39: [1, 3, 4],
+        }
+
+        for word, docs in documents.items():
+            for doc in docs:
+                matrix.activate(word, doc)
+
+        for word, docs in documents.items():
+            self.assertEqual(docs, list(matrix.extract_bitmap(word)))
+        self.assertEqual([], list(matrix.extract_bitmap(54)))
+
+        matrix.activate(15, 6)
+        self.assertEqual([2, 5, 6], list(matrix.extract_bitmap(15)))
+
+    def test_matrix_max_doc_id(self):
+        matrix = Matrix()
+        self.assertEqual(0, matrix.max_doc_id())
+        for doc in [9, 10, 2]:
+            matrix.activate(15, doc)
+        self.assertEqual(10, matrix.max_doc_id())
+
 
     def test_matrix_save_load(self):
         matrix = Matrix()
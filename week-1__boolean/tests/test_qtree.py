@@ -6,6 +6,7 @@ from search_shell.qtree import Tokenizer
 from search_shell.qtree import TokenType
 from search_shell.qtree import QueryTree
 
+from index.bitmap import RoaringBitmap
 from index.lemmatizer import TextLemmatizer
 
 
@@ -169,6 +170,18 @@ class QTreeTestCase(TestCase):
              },
             9), 0b100111101)
 
+    def test_complex_tree_execution_bitmap(self):
+        qt = QueryTree("meat OR !(apple AND grapes AND (lemon OR ginger))", self.lemmatizer)
+        self.assertEqual(list(qt.left_right_root_execute(
+            {
+                "meat":   RoaringBitmap.from_sorted([1, 6, 7]),
+                "apple":  RoaringBitmap.from_sorted([2, 3, 4, 7, 8]),
+                "grapes": RoaringBitmap.from_sorted([2, 3, 5, 6, 7, 8]),
+                "lemon":  RoaringBitmap.from_sorted([2, 3, 5, 7, 8]),
+                "ginger": RoaringBitmap.from_sorted([3, 4, 5, 7, 8])
+             },
+            9)), [1, 4, 5, 6, 7, 9])
+
 
 if __name__ == '__main__':
     unittest.main()
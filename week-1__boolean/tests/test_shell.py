@@ -0,0 +1,56 @@
+#!/usr/bin/python3.4
+# -*- coding: utf-8 -*-
+
+import unittest
+from unittest import TestCase
+
+import os
+import shutil
+
+from index.wrapper import Dictionary
+from index.wrapper import IndexPathWrapper
+from index.wrapper import Matrix
+from index.wrapper import Wrapper
+from search_shell.qtree import QueryTree
+from search_shell.shell import Shell
+
+
+class ShellTestCase(TestCase):
+    index_path = "./test_shell_index"
+
+    def setUp(self):
+        # документ 3 повторяет url документа 1 и в docs_dict не попадает, документ 4 - последний
+        os.makedirs(self.index_path)
+        ipw = IndexPathWrapper(self.index_path)
+        docs_dict = Dictionary(True)
+        words_dict = Dictionary()
+        matrix = Matrix()
+        for doc_id, (url, words) in enumerate([("http://a/1", ["apple"]), ("http://a/2", ["apple"]),
+                                               ("http://a/1", ["lemon"]), ("http://a/4", ["lemon"])], 1):
+            docs_dict.add_elem(url, doc_id)
+            for word in words:
+                matrix.activate(words_dict.add_elem(word), doc_id)
+        docs_dict.save_dict(ipw.get_docs_dict_path())
+        words_dict.save_dict(ipw.get_words_dict_path())
+        matrix.save_matrix(ipw.get_index_path())
+
+    def tearDown(self):
+        shutil.rmtree(self.index_path)
+
+    def test_duplicate_urls(self):
+        shell = Shell(self.index_path)
+        shell.wrapper = Wrapper(self.index_path)
+        self.assertEqual(3, shell.wrapper.docs_dict.dictionary_size)
+        self.assertEqual(4, shell.wrapper.docs_count())
+
+        res_map = shell.fill_from_matrix(["apple", "lemon"])
+        self.assertEqual(["http://a/4"], shell.decipher_query_results(res_map["lemon"]))
+
+        qt = QueryTree("!apple", shell.wrapper.lemmatizer)
+        result = qt.left_right_root_execute(res_map, shell.wrapper.docs_count())
+        self.assertEqual([3, 4], list(result))
+        self.assertEqual(["http://a/4"], shell.decipher_query_results(result))
+
+
+if __name__ == '__main__':
+    unittest.main()
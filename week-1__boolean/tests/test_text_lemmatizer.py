@@ -10,6 +10,24 @@ class TextLemmatizerTestCase(TestCase):
         self.assertEqual("яблоко", lemmatizer.lemmatize("яблоками"))
         self.assertEqual("удивительный", lemmatizer.lemmatize("удивительнейшая"))
 
+    def test_shared_analyzer(self):
+        first = TextLemmatizer()
+        second = TextLemmatizer()
+        self.assertIsNone(first.morph)
+        first.lemmatize("яблоками")
+        second.lemmatize("груши")
+        self.assertIsNotNone(first.morph)
+        self.assertIs(first.morph, second.morph)
+
+    def test_lru(self):
+        lemmatizer = TextLemmatizer(cache_size=2)
+        for word in ["яблоками", "груши", "яблоками", "сливы", "груши", "яблоками"]:
+            lemmatizer.lemmatize(word)
+        # повторное обращение к "яблоками" сделало самой старой "груши": ее и вытеснили "сливы"
+        self.assertEqual(["груши", "яблоками"], list(lemmatizer.cache.keys()))
+        self.assertEqual({"size": 2, "capacity": 2, "hits": 1, "misses": 5, "evictions": 3},
+                         lemmatizer.cache_stats())
+
 
 if __name__ == '__main__':
     unittest.main()
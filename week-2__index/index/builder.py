@@ -1,14 +1,26 @@
 #!/usr/bin/python3.4
 # -*- coding: utf-8 -*-
 
+import argparse
 import json
 import logging
-import sys
+from itertools import islice
+from multiprocessing import Pool
 from index.wrapper import Dictionary
+from index.wrapper import DocsDictionary
+from index.wrapper import FormsDictionary
 from index.wrapper import IndexPathWrapper
+from index.wrapper import KGramIndex
 from index.wrapper import RevertIndex
+from index.wrapper import SpimiForms
+from index.wrapper import SpimiRevertIndex
+from index.wrapper import TermDictionary
+from index.wrapper import Tombstones
 from index.normalizer import TextNormalizer
+from index.lemmatizer import LemmaCache
 from index.lemmatizer import TextLemmatizer
+from index.stats import BuildStats
+from index.stats import StageTimers
 
 logging.basicConfig(
     format='%(levelname)s %(asctime)s : %(message)s',
@@ -16,64 +28,194 @@ logging.basicConfig(
     level=logging.DEBUG)
 logger = logging.getLogger('index_builder')
 
+# лемматизатор процесса, обрабатывающего куски raw_docs.json (свой в каждом процессе пула)
+chunk_lemmatizer = None
+
+
+def init_chunk_worker(lemma_cache_path=None):
+    global chunk_lemmatizer
+    chunk_lemmatizer = TextLemmatizer(lemma_cache_path)
+
+
+def process_chunk(chunk):
+    # chunk = (doc_id первой строки, [строки raw_docs.json])
+    # возвращает частичный индекс куска: [(url, doc_id)], термы в порядке первого появления, списки doc_id термов,
+    # словоформы куска {словоформа: лемма}, новые для кэша лемм словоформы и StageTimers куска
+    doc_id, lines = chunk
+    urls = []
+    terms = {}
+    postings = []
+    forms = {}
+    timers = StageTimers()
+    cache_hits = chunk_lemmatizer.cache_hits
+    cache_misses = chunk_lemmatizer.cache_misses
+    cache_evictions = chunk_lemmatizer.cache_evictions
+    # кусок проходит стадии целиком: разбор всех строк, нормализация всех текстов и т.д.
+    with timers.timer("parse"):
+        jos = [json.loads(line) for line in lines]
+
+    # normalize text
+    with timers.timer("normalize"):
+        docs_words = list(TextNormalizer.normalize_many(jo["content"] for jo in jos))
+
+    # lemmatize
+    with timers.timer("lemmatize"):
+        docs_lemmas = [[chunk_lemmatizer.lemmatize(word) for word in words] for words in docs_words]
+        for words, lemmas in zip(docs_words, docs_lemmas):
+            forms.update(zip(words, lemmas))
+
+    with timers.timer("invert"):
+        for jo, lemmas in zip(jos, docs_lemmas):
+            urls.append((str(jo["url"]), doc_id))
+            # леммы документа берутся в порядке первого появления, а не в порядке обхода set:
+            # тогда id термов не зависят ни от PYTHONHASHSEED, ни от разбиения на куски
+            for lemma in dict.fromkeys(lemmas):
+                if lemma not in terms:
+                    terms[lemma] = len(postings)
+                    postings.append([])
+                postings[terms[lemma]].append(doc_id)
+            doc_id = doc_id + 1
+    timers.docs = len(jos)
+    timers.tokens = sum(len(words) for words in docs_words)
+
+    timers.cache_hits = chunk_lemmatizer.cache_hits - cache_hits
+    timers.cache_misses = chunk_lemmatizer.cache_misses - cache_misses
+    timers.cache_evictions = chunk_lemmatizer.cache_evictions - cache_evictions
+    return urls, list(terms.keys()), postings, forms, chunk_lemmatizer.take_new_lemmas(), timers
+
 
 class IndexBuilder:
     ipw = None
     docs_dict = None
     words_dict = None
     index = None
-
-    def __init__(self, path):
+    stats = None
+    # удаленные документы (deletes.bm) при перестройке в индекс не попадают, их doc_id остаются незанятыми
+    deleted = None
+    # последний выданный doc_id (url документов могут повторяться, поэтому размер docs_dict меньше)
+    docs_cnt = 0
+    # сколько строк raw_docs.json обрабатывается за одну задачу пула
+    chunk_size = 256
+    # кэш лемм на диске: процессы берут из него известные словоформы, новые собираются здесь и дописываются в конце
+    lemma_cache_path = None
+    new_lemmas = None
+    # словоформы документов -> леммы, для forms.dic (SpimiForms)
+    forms = None
+    memory_budget = None
+
+    def __init__(self, path, memory_budget=None, lemma_cache_path=None):
+        # memory_budget - сколько байт можно занять инвертированными списками, словоформами для forms.dic
+        # и новыми для кэша лемм словоформами, прежде чем сбросить их на диск (см. check_memory);
+        # если не задан, индекс целиком строится в памяти
+        # lemma_cache_path - кэш лемм, по умолчанию lemmas.cache в каталоге индекса
         self.ipw = IndexPathWrapper(path)
+        self.lemma_cache_path = lemma_cache_path if lemma_cache_path is not None else self.ipw.get_lemma_cache_path()
+        self.memory_budget = memory_budget
+        self.new_lemmas = {}
+        self.forms = SpimiForms(self.ipw.main_path)
         self.docs_dict = Dictionary(True)
         self.words_dict = Dictionary(True)
-        self.index = RevertIndex()
-        self.lemmatizer = TextLemmatizer()
+        if memory_budget is None:
+            self.index = RevertIndex()
+        else:
+            self.index = SpimiRevertIndex(memory_budget, self.ipw.main_path)
+        self.deleted = Tombstones(self.ipw.get_deletes_path())
 
-    def build_index(self):
-        logger.info(msg="Build index")
-        # read files
+    def read_chunks(self):
         with open(self.ipw.get_raw_docs_path(), "r") as in_file:
-            doc_id = 0
-            word_id = 1
-
-            for line in in_file:
-                doc_id = doc_id + 1
-                jo = json.loads(line, 'utf-8')
-
-                # normalize text
-                text = jo["content"]
-                text = TextNormalizer.join_numbers(text)
-                text = TextNormalizer.clean_out_punct(text)
-                text = TextNormalizer.lower_case(text)
-                words = TextNormalizer.split(text)
-
-                # lemmatize
-                lemmas = [self.lemmatizer.lemmatize(word) for word in words]
-                lemmas_unique = set(lemmas)
-
-                # build dictionaries
-                self.docs_dict.add_elem(str(jo["url"]), doc_id)
-
-                for lemma in lemmas_unique:
-                    new_id = self.words_dict.add_elem(lemma, word_id)
-                    if new_id < word_id:
-                        pass
-                    else:
-                        word_id = word_id+1
-
-                    # build matrix
-                    self.index.add_pair(new_id, doc_id)
+            doc_id = 1
+            while True:
+                lines = list(islice(in_file, self.chunk_size))
+                if len(lines) == 0:
+                    return
+                yield doc_id, lines
+                doc_id = doc_id + len(lines)
+
+    def merge_chunk(self, urls, terms, postings):
+        # куски приходят по порядку, поэтому id выдаются в порядке первого появления терма во всей коллекции,
+        # а doc_id в каждом списке остаются отсортированными - ровно как при последовательном построении
+        for url, doc_id in urls:
+            if doc_id not in self.deleted:
+                self.docs_dict.add_elem(url, doc_id)
+            self.docs_cnt = doc_id
+
+        for term, docs in zip(terms, postings):
+            docs = [doc_id for doc_id in docs if doc_id not in self.deleted]
+            if len(docs) == 0:
+                continue
+            word_id = self.words_dict.add_elem(term)
+            for doc_id in docs:
+                self.index.add_pair(word_id, doc_id)
+
+    def add_chunk(self, urls, terms, postings, forms, new_lemmas, timers):
+        self.stats.add(timers)
+        self.forms.update(forms)
+        self.new_lemmas.update(new_lemmas)
+        with self.stats.timer("merge"):
+            self.merge_chunk(urls, terms, postings)
+            self.check_memory()
+        self.stats.progress()
+
+    def flush_new_lemmas(self):
+        if len(self.new_lemmas) > 0:
+            LemmaCache.write(self.lemma_cache_path, self.new_lemmas)
+            self.new_lemmas = {}
+
+    def check_memory(self):
+        # memory_budget делят списки doc_id, словоформы и новые словоформы кэша лемм (по оценке SpimiForms.pair_size);
+        # пока бюджет превышен, на диск сбрасывается самая большая часть: прогон списков, прогон словоформ
+        # или новые словоформы - сразу в кэш лемм, куда они попали бы и в конце построения
+        if self.memory_budget is None:
+            return
+        parts = [(self.index.memory_used, self.index.flush_run),
+                 (self.forms.memory_used, self.forms.flush_run),
+                 (len(self.new_lemmas) * SpimiForms.pair_size, self.flush_new_lemmas)]
+        parts.sort(key=lambda part: part[0], reverse=True)
+        memory_used = sum(used for used, flush in parts)
+        for used, flush in parts:
+            if memory_used < self.memory_budget:
+                return
+            flush()
+            memory_used = memory_used - used
+
+    def build_index(self, workers=1):
+        logger.info(msg="Build index, {} worker(s)".format(workers))
+        self.stats = BuildStats(workers)
+        # read files
+        # нормализация и лемматизация идут кусками: в этом процессе или в пуле из workers процессов,
+        # словари и обратный индекс собираются только здесь из частичных индексов кусков
+        if workers > 1:
+            with Pool(workers, init_chunk_worker, (self.lemma_cache_path,)) as pool:
+                for partial in pool.imap(process_chunk, self.read_chunks()):
+                    self.add_chunk(*partial)
+        else:
+            init_chunk_worker(self.lemma_cache_path)
+            for chunk in self.read_chunks():
+                self.add_chunk(*process_chunk(chunk))
 
         logger.info(str(self.docs_dict.dictionary_size) + " doc(s), " + str(self.words_dict.dictionary_size) + " word(s)")
+        self.stats.progress(True)
+
+        with self.stats.timer("save"):
+            TermDictionary.write(self.ipw.get_words_dict_path(), self.words_dict.d)
+            KGramIndex.write(self.ipw.get_kgrams_dict_path(), self.ipw.get_kgrams_index_path(), self.words_dict.d)
+            try:
+                FormsDictionary.write(self.ipw.get_forms_dict_path(), self.forms, self.words_dict.d)
+            finally:
+                self.forms.close()
+            DocsDictionary.write(self.ipw.get_docs_dict_path(), self.docs_dict.d, max_key=self.docs_cnt)
+            self.index.save_index(self.ipw.get_index_path())
+            self.flush_new_lemmas()
 
-        self.words_dict.save_dict(self.ipw.get_words_dict_path())
-        self.docs_dict.save_dict(self.ipw.get_docs_dict_path())
-        self.index.save_index(self.ipw.get_index_path())
+        self.stats.save(self.ipw.get_build_stats_path(), self.words_dict.dictionary_size)
 
 
 if __name__ == '__main__':
-    if len(sys.argv[1:]) != 1:
-        logger.fatal(msg="Incorrect input")
-        exit(1)
-    IndexBuilder(sys.argv[1]).build_index()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--memory-budget", type=int, default=None,
+                        help="memory budget for postings, word forms and new lemmas, MB")
+    args = parser.parse_args()
+    memory_budget = None if args.memory_budget is None else args.memory_budget * 1024 * 1024
+    IndexBuilder(args.path, memory_budget).build_index(args.workers)
@@ -0,0 +1,201 @@
+#!/usr/bin/python3.4
+# -*- coding: utf-8 -*-
+
+import argparse
+import heapq
+import logging
+import os
+import shutil
+import threading
+from index.builder import IndexBuilder
+from index.wrapper import DocsDictionary
+from index.wrapper import FormsDictionary
+from index.wrapper import IndexPathWrapper
+from index.wrapper import KGramIndex
+from index.wrapper import PostingFile
+from index.wrapper import Segment
+from index.wrapper import SegmentsManifest
+from index.wrapper import TermDictionary
+from index.wrapper import Tombstones
+
+logging.basicConfig(
+    format='%(levelname)s %(asctime)s : %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p',
+    level=logging.DEBUG)
+logger = logging.getLogger('index_segments')
+
+
+class SegmentManager:
+    # дописывание документов в индекс без полной перестройки:
+    # * add_segment строит из нового raw_docs.json отдельный неизменяемый сегмент (обычным IndexBuilder)
+    #   и дописывает его в segments.json - Wrapper.refresh увидит его при следующем запросе
+    # * merge сливает сегменты по size-tiered политике: сегмент попадает в уровень floor(log_{merge_factor}(docs)),
+    #   и merge_factor соседних сегментов одного уровня сливаются в один; соседних - чтобы doc_id сегмента шли подряд
+    # сегменты только создаются и удаляются целиком, segments.json заменяется атомарно,
+    # поэтому поиск продолжает работать во время слияния (в том числе в фоновом потоке)
+    merge_factor = 4
+
+    ipw = None
+    lock = None
+    merge_thread = None
+
+    def __init__(self, path):
+        self.ipw = IndexPathWrapper(path)
+        self.lock = threading.Lock()
+
+    def main_docs_cnt(self):
+        # doc_id основного индекса идут с 1, сегменты нумеруются после них
+        main_segment = Segment(self.ipw.main_path)
+        main_segment.close()
+        return main_segment.docs_cnt
+
+    def reserve_name(self):
+        with self.lock:
+            manifest = SegmentsManifest.read(self.ipw.get_segments_manifest_path())
+            name = "seg_%06d" % manifest["next_id"]
+            manifest["next_id"] = manifest["next_id"] + 1
+            SegmentsManifest.write(self.ipw.get_segments_manifest_path(), manifest)
+        return name
+
+    def add_segment(self, raw_docs_path, workers=1):
+        name = self.reserve_name()
+        path = self.ipw.get_segment_path(name)
+        # сегмент строится во временном каталоге и появляется под своим именем только готовым
+        os.makedirs(path + ".tmp")
+        shutil.copyfile(raw_docs_path, IndexPathWrapper(path + ".tmp").get_raw_docs_path())
+        builder = IndexBuilder(path + ".tmp", lemma_cache_path=self.ipw.get_lemma_cache_path())
+        builder.build_index(workers)
+        os.rename(path + ".tmp", path)
+
+        with self.lock:
+            manifest = SegmentsManifest.read(self.ipw.get_segments_manifest_path())
+            if len(manifest["segments"]) > 0:
+                base = manifest["segments"][-1]["base"] + manifest["segments"][-1]["docs"]
+            else:
+                base = self.main_docs_cnt()
+            manifest["segments"].append({"name": name, "base": base, "docs": builder.docs_cnt})
+            SegmentsManifest.write(self.ipw.get_segments_manifest_path(), manifest)
+        logger.info(msg="Add segment '{}'. {} doc(s) from {}.".format(name, builder.docs_cnt, base + 1))
+        return name
+
+    def tier(self, docs_cnt):
+        tier = 0
+        while docs_cnt >= self.merge_factor:
+            docs_cnt = docs_cnt // self.merge_factor
+            tier = tier + 1
+        return tier
+
+    def find_merge(self, segments):
+        # первые merge_factor соседних сегментов одного уровня или None
+        tiers = [self.tier(segment["docs"]) for segment in segments]
+        for i in range(len(segments) - self.merge_factor + 1):
+            if len(set(tiers[i:i + self.merge_factor])) == 1:
+                return segments[i:i + self.merge_factor]
+        return None
+
+    def merge_segments(self, entries, path):
+        # термы сегментов сливаются в порядке сортировки и нумеруются заново,
+        # списки одного терма склеиваются со сдвигом doc_id на base сегмента относительно первого
+        # удаленные документы (deletes.bm основного индекса, глобальные doc_id) в слитый сегмент не попадают
+        segments = [Segment(self.ipw.get_segment_path(entry["name"]), entry["base"]) for entry in entries]
+        first_base = entries[0]["base"]
+        deleted = Tombstones(self.ipw.get_deletes_path())
+        try:
+            terms = {}
+            for term, key in heapq.merge(*[segment.words_dict.items() for segment in segments]):
+                if term not in terms:
+                    terms[term] = len(terms) + 1
+
+            def term_docs():
+                for term, term_id in terms.items():
+                    docs = []
+                    for segment in segments:
+                        key = segment.words_dict.get_key(term)
+                        if key is not None:
+                            shift = segment.base - first_base
+                            docs.extend(doc + shift for doc in segment.index.extract_inverted_list(key)
+                                        if doc + segment.base not in deleted)
+                    yield term_id, docs
+
+            forms = {}
+            for segment in segments:
+                if segment.forms_dict is not None:
+                    forms.update(segment.forms_dict.items())
+
+            urls = [None]
+            for segment in segments:
+                urls.extend(None if doc_id + segment.base in deleted else segment.docs_dict.get_elem(doc_id)
+                            for doc_id in range(1, segment.docs_cnt + 1))
+            docs_cnt = len(urls) - 1
+
+            ipw = IndexPathWrapper(path)
+            os.makedirs(path)
+            TermDictionary.write(ipw.get_words_dict_path(), terms)
+            KGramIndex.write(ipw.get_kgrams_dict_path(), ipw.get_kgrams_index_path(), terms)
+            FormsDictionary.write(ipw.get_forms_dict_path(), forms, terms)
+            DocsDictionary.write_urls(ipw.get_docs_dict_path(), urls)
+            PostingFile.write(ipw.get_index_path(), term_docs(), terms_cnt=len(terms))
+            with open(ipw.get_raw_docs_path(), "wb") as out_file:
+                for entry in entries:
+                    segment_ipw = IndexPathWrapper(self.ipw.get_segment_path(entry["name"]))
+                    with open(segment_ipw.get_raw_docs_path(), "rb") as in_file:
+                        shutil.copyfileobj(in_file, out_file)
+        finally:
+            for segment in segments:
+                segment.close()
+        return docs_cnt
+
+    def merge(self):
+        # сливает сегменты, пока политика находит что слить; возвращает количество слияний
+        merges_cnt = 0
+        while True:
+            with self.lock:
+                entries = self.find_merge(SegmentsManifest.read(self.ipw.get_segments_manifest_path())["segments"])
+            if entries is None:
+                return merges_cnt
+
+            name = self.reserve_name()
+            path = self.ipw.get_segment_path(name)
+            docs_cnt = self.merge_segments(entries, path + ".tmp")
+            os.rename(path + ".tmp", path)
+
+            names = [entry["name"] for entry in entries]
+            with self.lock:
+                manifest = SegmentsManifest.read(self.ipw.get_segments_manifest_path())
+                first = [segment["name"] for segment in manifest["segments"]].index(names[0])
+                manifest["segments"][first:first + len(names)] = \
+                    [{"name": name, "base": entries[0]["base"], "docs": docs_cnt}]
+                SegmentsManifest.write(self.ipw.get_segments_manifest_path(), manifest)
+            # открытые читателями файлы остаются доступны через mmap и после удаления каталога
+            for old_name in names:
+                shutil.rmtree(self.ipw.get_segment_path(old_name))
+            logger.info(msg="Merge segments {} into '{}'. {} doc(s).".format(str(names), name, docs_cnt))
+            merges_cnt = merges_cnt + 1
+
+    def merge_in_background(self):
+        # одновременно идет не больше одного фонового слияния
+        if self.merge_thread is None or not self.merge_thread.is_alive():
+            self.merge_thread = threading.Thread(target=self.merge)
+            self.merge_thread.start()
+        return self.merge_thread
+
+    def wait_merges(self):
+        # дождаться фонового слияния и слить сегменты, добавленные уже после его окончания;
+        # возвращает количество слияний, сделанных здесь
+        if self.merge_thread is not None:
+            self.merge_thread.join()
+        return self.merge()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path")
+    parser.add_argument("--add", action="append", default=[], help="raw_docs.json with new documents, may be repeated")
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+    manager = SegmentManager(args.path)
+    for raw_docs_path in args.add:
+        manager.add_segment(raw_docs_path, args.workers)
+        # пока строится следующий сегмент, уже добавленные сливаются в фоне
+        manager.merge_in_background()
+    manager.wait_merges()
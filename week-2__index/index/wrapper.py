@@ -1,8 +1,19 @@
 #!/usr/bin/python3.4
 # -*- coding: utf-8 -*-
 
+import heapq
+import json
 import logging
+import math
+import mmap
+import os
+import re
+import tempfile
+from array import array
+from bisect import bisect_left
+from itertools import islice
 from struct import Struct
+from urllib.parse import unquote
 from index.lemmatizer import TextLemmatizer
 
 logging.basicConfig(
@@ -27,16 +38,467 @@ class IndexPathWrapper:
     def get_index_path(self):
         return self.main_path + "/idx.idx"
 
+    def get_kgrams_dict_path(self):
+        return self.main_path + "/kgrams.dic"
+
+    def get_kgrams_index_path(self):
+        return self.main_path + "/kgrams.idx"
+
     def get_raw_docs_path(self):
         return self.main_path + "/raw_docs.json"
 
+    def get_build_stats_path(self):
+        return self.main_path + "/build_stats.json"
+
+    def get_deletes_path(self):
+        return self.main_path + "/deletes.bm"
+
+    def get_forms_dict_path(self):
+        return self.main_path + "/forms.dic"
+
+    def get_lemma_cache_path(self):
+        return self.main_path + "/lemmas.cache"
+
+    def get_segments_manifest_path(self):
+        return self.main_path + "/segments.json"
+
+    def get_segment_path(self, name):
+        return self.main_path + "/segments/" + name
+
+
+class VarByteCodec:
+    # переменная длина записи числа: по 7 бит в байте, старший бит выставлен у последнего байта числа
+    # в инвертированных списках храним не сами doc_id, а разницы между соседними (они возрастают => разницы > 0)
+
+    @staticmethod
+    def encode(numbers):
+        res = bytearray()
+        for n in numbers:
+            chunk = [0x80 | (n & 0x7f)]
+            n = n >> 7
+            while n > 0:
+                chunk.append(n & 0x7f)
+                n = n >> 7
+            chunk.reverse()
+            res.extend(chunk)
+        return bytes(res)
+
+    @staticmethod
+    def decode(data, offset, count):
+        # возвращает список из count чисел и смещение, на котором закончилось чтение
+        res = []
+        n = 0
+        pos = offset
+        while len(res) < count:
+            b = data[pos]
+            pos = pos + 1
+            if b < 0x80:
+                n = (n << 7) | b
+            else:
+                res.append((n << 7) | (b & 0x7f))
+                n = 0
+        return res, pos
+
+    @staticmethod
+    def encode_gaps(doc_ids):
+        prev = 0
+        gaps = []
+        for doc_id in doc_ids:
+            gaps.append(doc_id - prev)
+            prev = doc_id
+        return VarByteCodec.encode(gaps)
+
+    @staticmethod
+    def decode_gaps(data, offset, count):
+        gaps, pos = VarByteCodec.decode(data, offset, count)
+        doc_id = 0
+        for i in range(len(gaps)):
+            doc_id = doc_id + gaps[i]
+            gaps[i] = doc_id
+        return gaps
+
+
+class ListCursor:
+    # курсор по отсортированному списку doc_id в памяти
+    # doc() - текущий документ (None, если список закончился)
+    # next() - переход к следующему документу
+    # advance_to(doc_id) - переход к первому документу >= doc_id (назад курсор никогда не двигается)
+    docs = None
+    i = 0
+    end = 0
+
+    def __init__(self, docs, start=0, end=None):
+        self.docs = docs
+        self.i = start
+        self.end = len(docs) if end is None else end
+
+    def doc(self):
+        return self.docs[self.i] if self.i < self.end else None
+
+    def next(self):
+        if self.i < self.end:
+            self.i = self.i + 1
+        return self.doc()
+
+    def advance_to(self, target):
+        if self.i >= self.end or self.docs[self.i] >= target:
+            return self.doc()
+        # галопирующий поиск: удваиваем шаг, пока не перепрыгнем target, затем бинарный поиск в последнем окне
+        bound = 1
+        while self.i + bound < self.end and self.docs[self.i + bound] < target:
+            bound = bound * 2
+        self.i = bisect_left(self.docs, target, self.i + bound // 2 + 1, min(self.i + bound + 1, self.end))
+        return self.doc()
+
+
+class PostingCursor:
+    # курсор по сжатому инвертированному списку с указателями пропуска (формат версии 3)
+    # документы декодируются по одному; advance_to бинарным поиском находит последний указатель пропуска
+    # перед нужным документом и продолжает декодирование с него, не трогая пропущенные байты
+    data = None
+    docs_cnt = 0
+    step = 0
+    skips_cnt = 0
+    skips_offset = 0
+    data_offset = 0
+    i = -1
+    last = 0
+    pos = 0
+
+    def __init__(self, data, offset, docs_cnt):
+        self.data = data
+        self.docs_cnt = docs_cnt
+        self.step = PostingFile.skip_step(docs_cnt)
+        self.skips_cnt = PostingFile.number_struct.unpack_from(data, offset)[0]
+        self.skips_offset = offset + PostingFile.number_struct.size
+        self.data_offset = self.skips_offset + self.skips_cnt * PostingFile.skip_struct.size
+        self.i = -1
+        self.last = 0
+        self.pos = self.data_offset
+        self.next()
+
+    def __len__(self):
+        return self.docs_cnt
+
+    def doc(self):
+        return self.last if self.i < self.docs_cnt else None
+
+    def next(self):
+        if self.i >= self.docs_cnt:
+            return None
+        self.i = self.i + 1
+        if self.i == self.docs_cnt:
+            return None
+
+        gap = 0
+        while True:
+            b = self.data[self.pos]
+            self.pos = self.pos + 1
+            if b < 0x80:
+                gap = (gap << 7) | b
+            else:
+                gap = (gap << 7) | (b & 0x7f)
+                break
+        self.last = self.last + gap
+        return self.last
+
+    def skip(self, j):
+        return PostingFile.skip_struct.unpack_from(self.data, self.skips_offset + j * PostingFile.skip_struct.size)
+
+    def advance_to(self, target):
+        if self.i >= self.docs_cnt:
+            return None
+        if self.last >= target:
+            return self.last
+
+        # ищем последний указатель пропуска с doc_id < target среди тех, что впереди курсора
+        lo = (self.i + 1) // self.step if self.step > 0 else 0
+        hi = self.skips_cnt
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.skip(mid)[0] < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        j = lo - 1
+        if j >= 0 and (j + 1) * self.step - 1 > self.i:
+            self.last, pos = self.skip(j)
+            self.i = (j + 1) * self.step - 1
+            self.pos = self.data_offset + pos
+
+        while self.last < target:
+            if self.next() is None:
+                return None
+        return self.last
+
+
+class PostingList:
+    # инвертированный список в файле индекса: длина известна из таблицы термов без чтения списка,
+    # документы декодируются только при обходе
+    reader = None
+    offset = 0
+    docs_cnt = 0
+
+    def __init__(self, reader, offset, docs_cnt):
+        self.reader = reader
+        self.offset = offset
+        self.docs_cnt = docs_cnt
+
+    def __len__(self):
+        return self.docs_cnt
+
+    def __iter__(self):
+        cursor = self.cursor()
+        doc = cursor.doc()
+        while doc is not None:
+            yield doc
+            doc = cursor.next()
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return "PostingList(docs_cnt={})".format(self.docs_cnt)
+
+    def cursor(self):
+        return self.reader.read_cursor(self.offset, self.docs_cnt)
+
+
+class ChainCursor:
+    # курсор по спискам сегментов подряд: parts = [(base, курсор), ...] по возрастанию base,
+    # doc_id из курсора сегмента сдвигается на его base
+    # advance_to пропускает сегменты, все doc_id которых меньше target, не трогая их курсоры,
+    # а внутри сегмента работает его курсор (с указателями пропуска для списков из файла индекса)
+    parts = None
+    k = 0
+
+    def __init__(self, parts):
+        self.parts = [(base, cursor) for base, cursor in parts if cursor.doc() is not None]
+        self.k = 0
+
+    def doc(self):
+        if self.k >= len(self.parts):
+            return None
+        base, cursor = self.parts[self.k]
+        return cursor.doc() + base
+
+    def next(self):
+        if self.k >= len(self.parts):
+            return None
+        base, cursor = self.parts[self.k]
+        if cursor.next() is None:
+            self.k = self.k + 1
+        return self.doc()
+
+    def advance_to(self, target):
+        while self.k < len(self.parts):
+            # doc_id сегмента не больше base следующего за ним сегмента
+            if self.k + 1 < len(self.parts) and self.parts[self.k + 1][0] < target:
+                self.k = self.k + 1
+                continue
+            base, cursor = self.parts[self.k]
+            if cursor.advance_to(target - base) is not None:
+                return self.doc()
+            self.k = self.k + 1
+        return None
+
+
+class SegmentsPostingList:
+    # инвертированный список терма по всем сегментам: parts = [(base, список сегмента), ...]
+    # списки сегментов не склеиваются и не декодируются заранее, курсор - ChainCursor
+    parts = None
+
+    def __init__(self, parts):
+        self.parts = [(base, docs) for base, docs in parts if len(docs) > 0]
+
+    def __len__(self):
+        return sum(len(docs) for base, docs in self.parts)
+
+    def __iter__(self):
+        for base, docs in self.parts:
+            for doc in docs:
+                yield doc + base
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __repr__(self):
+        return "SegmentsPostingList(docs_cnt={})".format(len(self))
+
+    def cursor(self):
+        return ChainCursor([(base, docs.cursor() if hasattr(docs, 'cursor') else ListCursor(docs))
+                            for base, docs in self.parts])
+
+
+class PostingFile:
+    # файл обратного индекса, отображенный в память (mmap)
+    # формат файла:
+    # * заголовок: магическая строка, версия формата, количество термов
+    # * таблица термов, отсортированная по term_id: (term_id, смещение списка в файле, количество документов)
+    # * инвертированные списки
+    #   версия 1: подряд идущие doc_id по 4 байта
+    #   версия 2: разницы между соседними doc_id, сжатые VarByteCodec
+    #   версия 3: как версия 2, но перед списком лежат указатели пропуска: их количество и пары
+    #             (doc_id, смещение следующего за ним документа относительно начала сжатых данных)
+    #             для каждого skip_step(n)-го документа, что позволяет курсору не декодировать список целиком
+    # при открытии файла ничего не декодируется: терм ищется бинарным поиском по таблице,
+    # а инвертированный список читается только для тех термов, которые нужны запросу
+    magic = b"RIDX"
+    versions = (1, 2, 3)
+    version = 3
+    header_struct = Struct("<4sII")
+    entry_struct = Struct("<III")
+    skip_struct = Struct("<II")
+    number_struct = Struct("<I")
+
+    path = None
+    mm = None
+    terms_cnt = 0
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as bin_file:
+            self.mm = mmap.mmap(bin_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.version, self.terms_cnt = self.header_struct.unpack_from(self.mm, 0)
+        if magic != self.magic or self.version not in self.versions:
+            self.close()
+            raise ValueError("Unsupported index format in '{}'".format(path))
+
+    @classmethod
+    def has_header(cls, path):
+        with open(path, "rb") as bin_file:
+            return bin_file.read(len(cls.magic)) == cls.magic
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+
+    def entries(self):
+        # (term_id, смещение, количество документов) в порядке возрастания term_id
+        for i in range(self.terms_cnt):
+            yield self.entry(i)
+
+    def entry(self, i):
+        return self.entry_struct.unpack_from(self.mm, self.header_struct.size + i * self.entry_struct.size)
+
+    def find(self, term_id):
+        # бинарный поиск по таблице термов
+        # возвращает (смещение, количество документов) или None, если терма в индексе нет
+        lo = 0
+        hi = self.terms_cnt
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_term, offset, docs_cnt = self.entry(mid)
+            if mid_term < term_id:
+                lo = mid + 1
+            elif mid_term > term_id:
+                hi = mid
+            else:
+                return offset, docs_cnt
+        return None
+
+    def doc_freq(self, term_id):
+        found = self.find(term_id)
+        return 0 if found is None else found[1]
+
+    def postings(self, term_id):
+        found = self.find(term_id)
+        if found is None:
+            return []
+        return self.read_postings(*found)
+
+    def posting_list(self, term_id):
+        found = self.find(term_id)
+        if found is None:
+            return []
+        return PostingList(self, *found)
+
+    def cursor(self, term_id):
+        found = self.find(term_id)
+        if found is None:
+            return ListCursor([])
+        return self.read_cursor(*found)
+
+    def read_postings(self, offset, docs_cnt):
+        if self.version == 1:
+            return list(Struct("<%dI" % docs_cnt).unpack_from(self.mm, offset))
+        if self.version == 3:
+            skips_cnt = self.number_struct.unpack_from(self.mm, offset)[0]
+            offset = offset + self.number_struct.size + skips_cnt * self.skip_struct.size
+        return VarByteCodec.decode_gaps(self.mm, offset, docs_cnt)
+
+    def read_cursor(self, offset, docs_cnt):
+        if self.version == 3:
+            return PostingCursor(self.mm, offset, docs_cnt)
+        return ListCursor(self.read_postings(offset, docs_cnt))
+
+    @staticmethod
+    def skip_step(docs_cnt):
+        # указатель пропуска ставится на каждый ~sqrt(n)-й документ; для коротких списков они не нужны
+        return int(math.sqrt(docs_cnt)) if docs_cnt >= 16 else 0
+
+    @classmethod
+    def encode_with_skips(cls, docs):
+        step = cls.skip_step(len(docs))
+        skips = []
+        data = bytearray()
+        prev = 0
+        for i, doc in enumerate(docs):
+            data.extend(VarByteCodec.encode([doc - prev]))
+            prev = doc
+            if step > 0 and (i + 1) % step == 0 and i + 1 < len(docs):
+                skips.append(cls.skip_struct.pack(doc, len(data)))
+        return cls.number_struct.pack(len(skips)) + b"".join(skips) + bytes(data)
+
+    @classmethod
+    def encode_block(cls, docs, version):
+        if version == 1:
+            return Struct("<%dI" % len(docs)).pack(*docs)
+        elif version == 2:
+            return VarByteCodec.encode_gaps(docs)
+        return cls.encode_with_skips(docs)
+
+    @classmethod
+    def write(cls, path, term_docs, version=None, terms_cnt=None):
+        # term_docs = [(term_id, [doc_id, ...]), ...] в порядке возрастания term_id, doc_id в каждом списке возрастают
+        # если terms_cnt известен заранее, term_docs может быть генератором: списки пишутся в файл по одному,
+        # а таблица термов дописывается в зарезервированное место в конце
+        version = cls.version if version is None else version
+        if terms_cnt is None:
+            term_docs = list(term_docs)
+            terms_cnt = len(term_docs)
+
+        table = bytearray()
+        saved_cnt = 0
+        offset = cls.header_struct.size + terms_cnt * cls.entry_struct.size
+        with open(path, "wb") as bin_file:
+            bin_file.write(cls.header_struct.pack(cls.magic, version, terms_cnt))
+            bin_file.seek(offset)
+
+            for term, docs in term_docs:
+                block = cls.encode_block(docs, version)
+                table.extend(cls.entry_struct.pack(term, offset, len(docs)))
+                bin_file.write(block)
+                offset = offset + len(block)
+                saved_cnt = saved_cnt + len(docs)
+
+            if len(table) != terms_cnt * cls.entry_struct.size:
+                raise ValueError("Expected {} term(s), got {}".format(terms_cnt, len(table) // cls.entry_struct.size))
+            bin_file.seek(cls.header_struct.size)
+            bin_file.write(bytes(table))
+        return saved_cnt
+
 
 class RevertIndex:
     m = None
+    reader = None
     number_struct = Struct("<I")
 
     def __init__(self):
         self.m = {}
+        self.reader = None
 
     def add_pair(self, term, doc):
         if term in self.m:
@@ -50,20 +512,43 @@ class RevertIndex:
     def value(self, term, doc):
         # возвращаем True, если в инвертированном списке для данного терма есть данный документ
         # в противном случае возвращаем False
-        if term in self.m:
-            return doc in self.m[term]
-        else:
-            return False
+        docs = self.extract_inverted_list(term)
+        i = bisect_left(docs, doc)
+        return i < len(docs) and docs[i] == doc
 
     def extract_inverted_list(self, term_id):
         # получаем инвертированный список для данного терма
         # если у нас нет никакой информации для данного терма, то возвращаем пустой список
         if term_id in self.m:
             return self.m[term_id]
+        elif self.reader is not None:
+            return self.reader.postings(term_id)
         else:
             return []
 
+    def extract_postings(self, term_id):
+        # то же, что extract_inverted_list, но список из файла индекса не декодируется сразу (см. PostingList)
+        if term_id not in self.m and self.reader is not None:
+            return self.reader.posting_list(term_id)
+        return self.extract_inverted_list(term_id)
+
+    def cursor(self, term_id):
+        if term_id not in self.m and self.reader is not None:
+            return self.reader.cursor(term_id)
+        return ListCursor(self.extract_inverted_list(term_id))
+
     def load_index(self, path):
+        self.m = {}
+        self.reader = None
+        if not PostingFile.has_header(path):
+            self.load_legacy_index(path)
+            return
+
+        self.reader = PostingFile(path)
+        logger.info(msg="Load index from '{}'. {} term(s) mapped.".format(path, self.reader.terms_cnt))
+
+    def load_legacy_index(self, path):
+        # старый формат без заголовка и таблицы термов: читаем его целиком в память
         loaded_cnt = 0
         with open(path, "rb") as bin_file:
             terms_cnt = self.number_struct.unpack(bin_file.read(self.number_struct.size))[0]
@@ -79,26 +564,293 @@ class RevertIndex:
         logger.info(msg="Load index from '{}'. {} element(s) loaded.".format(path, loaded_cnt))
 
     def save_index(self, path):
-        saved_cnt = 0
-        with open(path, "wb") as bin_file:
-            bin_file.write(self.number_struct.pack(len(self.m)))
+        saved_cnt = PostingFile.write(path, sorted(self.m.items()))
+        logger.info(msg="Save index to '{}'. {} element(s) saved.".format(path, saved_cnt))
+
+
+class SpimiRevertIndex:
+    # обратный индекс для построения коллекций больше памяти (SPIMI, single-pass in-memory indexing)
+    # пары (term, doc) копятся в памяти, пока оценка занятой памяти не превысит memory_budget байт,
+    # затем блок сбрасывается на диск прогоном: отсортированным по term_id файлом в формате PostingFile
+    # save_index сливает прогоны k-путевым слиянием по term_id; doc_id растут от прогона к прогону,
+    # поэтому списки одного терма из разных прогонов просто склеиваются, и в памяти всегда один список
+    # результат побайтно совпадает с RevertIndex.save_index
+    posting_size = 4
+    # оценка накладных расходов на терм в блоке: ключ словаря и объект array
+    term_size = 120
+
+    m = None
+    memory_budget = 0
+    memory_used = 0
+    runs_dir = None
+    runs = None
+
+    def __init__(self, memory_budget, runs_dir=None):
+        self.m = {}
+        self.memory_budget = memory_budget
+        self.runs_dir = runs_dir
+        self.runs = []
+
+    def add_pair(self, term, doc):
+        if term in self.m:
+            self.m[term].append(doc)
+            self.memory_used = self.memory_used + self.posting_size
+        else:
+            self.m[term] = array("I", [doc])
+            self.memory_used = self.memory_used + self.term_size + self.posting_size
+
+        if self.memory_used >= self.memory_budget:
+            self.flush_run()
+
+    def flush_run(self):
+        if len(self.m) == 0:
+            return
+        fd, path = tempfile.mkstemp(suffix=".run", dir=self.runs_dir)
+        os.close(fd)
+        saved_cnt = PostingFile.write(path, sorted(self.m.items()))
+        self.runs.append(path)
+        logger.info(msg="Flush run '{}'. {} term(s), {} element(s) saved.".format(path, len(self.m), saved_cnt))
+        self.m = {}
+        self.memory_used = 0
+
+    @staticmethod
+    def read_run(run, reader):
+        # номер прогона в кортеже: при равных term_id кортежи сравниваются по нему, а не по спискам
+        for term, offset, docs_cnt in reader.entries():
+            yield term, run, reader.read_postings(offset, docs_cnt)
+
+    @staticmethod
+    def merge_runs(readers):
+        current = None
+        docs = None
+        runs = [SpimiRevertIndex.read_run(run, reader) for run, reader in enumerate(readers)]
+        for term, run, run_docs in heapq.merge(*runs):
+            if term != current:
+                if current is not None:
+                    yield current, docs
+                current = term
+                docs = []
+            docs.extend(run_docs)
+        if current is not None:
+            yield current, docs
+
+    def save_index(self, path):
+        if len(self.runs) == 0:
+            saved_cnt = PostingFile.write(path, sorted(self.m.items()))
+            logger.info(msg="Save index to '{}'. {} element(s) saved.".format(path, saved_cnt))
+            return
+
+        self.flush_run()
+        readers = [PostingFile(run) for run in self.runs]
+        try:
+            # для резервирования таблицы термов нужно их число: сливаются только таблицы прогонов, без списков
+            terms_cnt = 0
+            prev = None
+            for term in heapq.merge(*[(entry[0] for entry in reader.entries()) for reader in readers]):
+                if term != prev:
+                    terms_cnt = terms_cnt + 1
+                    prev = term
+            saved_cnt = PostingFile.write(path, self.merge_runs(readers), terms_cnt=terms_cnt)
+        finally:
+            for reader in readers:
+                reader.close()
+            for run in self.runs:
+                os.remove(run)
+            self.runs = []
+        logger.info(msg="Save index to '{}'. {} element(s) merged from {} run(s).".format(path, saved_cnt, len(readers)))
+
+
+class SpimiForms:
+    # словоформы документов -> леммы (для forms.dic) при построении коллекций больше памяти, как в SpimiRevertIndex:
+    # пары копятся в памяти, а flush_run сбрасывает их на диск прогоном - файлом пар, отсортированных по словоформе
+    # в байтах UTF-8; когда сбрасывать, решает IndexBuilder по memory_used
+    # items() сливает прогоны и пары в памяти k-путевым слиянием; у словоформы всегда одна лемма,
+    # поэтому ее повторы в разных прогонах просто пропускаются
+    pair_struct = Struct("<II")
+    # оценка памяти на пару: две строки и запись словаря
+    pair_size = 160
+
+    m = None
+    memory_used = 0
+    runs_dir = None
+    runs = None
+
+    def __init__(self, runs_dir=None):
+        self.m = {}
+        self.runs_dir = runs_dir
+        self.runs = []
+
+    def update(self, forms):
+        for form, lemma in forms.items():
+            if form not in self.m:
+                self.m[form] = lemma
+                self.memory_used = self.memory_used + self.pair_size
+
+    def flush_run(self):
+        if len(self.m) == 0:
+            return
+        fd, path = tempfile.mkstemp(suffix=".forms", dir=self.runs_dir)
+        with os.fdopen(fd, "wb") as bin_file:
+            for form, lemma in self.sorted_pairs():
+                bin_file.write(self.pair_struct.pack(len(form), len(lemma)))
+                bin_file.write(form)
+                bin_file.write(lemma)
+        self.runs.append(path)
+        logger.info(msg="Flush forms run '{}'. {} element(s) saved.".format(path, len(self.m)))
+        self.m = {}
+        self.memory_used = 0
+
+    def sorted_pairs(self):
+        return sorted((form.encode('utf-8'), lemma.encode('utf-8')) for form, lemma in self.m.items())
+
+    @classmethod
+    def read_run(cls, path):
+        with open(path, "rb") as bin_file:
+            while True:
+                data = bin_file.read(cls.pair_struct.size)
+                if len(data) == 0:
+                    return
+                form_len, lemma_len = cls.pair_struct.unpack(data)
+                yield bin_file.read(form_len), bin_file.read(lemma_len)
+
+    def items(self):
+        # пары (словоформа, лемма) по возрастанию словоформы в байтах UTF-8, каждая словоформа один раз
+        prev = None
+        for form, lemma in heapq.merge(self.sorted_pairs(), *[self.read_run(path) for path in self.runs]):
+            if form != prev:
+                prev = form
+                yield form.decode('utf-8'), lemma.decode('utf-8')
+
+    def close(self):
+        for run in self.runs:
+            os.remove(run)
+        self.runs = []
+
+
+class CsrRevertIndex:
+    # обратный индекс, целиком загруженный в память в виде CSR (compressed sparse row):
+    # * terms - отсортированные term_id
+    # * offsets - для i-го терма его документы лежат в postings[offsets[i]:offsets[i + 1]]
+    # * postings - все doc_id всех термов подряд в одном массиве uint32
+    # вместо списка python-объектов на каждый документ тратится 4 байта
+    terms = None
+    offsets = None
+    postings = None
+
+    def __init__(self):
+        self.terms = array("I")
+        self.offsets = array("I", [0])
+        self.postings = array("I")
+
+    def append_term(self, term, docs):
+        # термы должны добавляться в порядке возрастания term_id
+        self.terms.append(term)
+        self.postings.extend(docs)
+        self.offsets.append(len(self.postings))
 
-            for term in self.m:
-                bin_file.write(self.number_struct.pack(term))
-                bin_file.write(self.number_struct.pack(len(self.m[term])))
+    @staticmethod
+    def from_revert_index(index):
+        csr = CsrRevertIndex()
+        for term in sorted(index.m.keys()):
+            csr.append_term(term, index.m[term])
+        return csr
 
-                for doc in self.m[term]:
-                    bin_file.write(self.number_struct.pack(doc))
-                    saved_cnt = saved_cnt + 1
+    def find_row(self, term_id):
+        i = bisect_left(self.terms, term_id)
+        if i < len(self.terms) and self.terms[i] == term_id:
+            return i
+        return None
 
+    def value(self, term, doc):
+        row = self.find_row(term)
+        if row is None:
+            return False
+        start = self.offsets[row]
+        end = self.offsets[row + 1]
+        i = bisect_left(self.postings, doc, start, end)
+        return i < end and self.postings[i] == doc
+
+    def extract_inverted_list(self, term_id):
+        row = self.find_row(term_id)
+        if row is None:
+            return []
+        return self.postings[self.offsets[row]:self.offsets[row + 1]].tolist()
+
+    def extract_postings(self, term_id):
+        return self.extract_inverted_list(term_id)
+
+    def cursor(self, term_id):
+        row = self.find_row(term_id)
+        if row is None:
+            return ListCursor([])
+        return ListCursor(self.postings, self.offsets[row], self.offsets[row + 1])
+
+    def items(self):
+        for row in range(len(self.terms)):
+            yield self.terms[row], self.postings[self.offsets[row]:self.offsets[row + 1]]
+
+    def load_index(self, path):
+        self.__init__()
+        if not PostingFile.has_header(path):
+            index = RevertIndex()
+            index.load_legacy_index(path)
+            for term in sorted(index.m.keys()):
+                self.append_term(term, index.m[term])
+        else:
+            reader = PostingFile(path)
+            for term, offset, docs_cnt in reader.entries():
+                self.append_term(term, reader.read_postings(offset, docs_cnt))
+            reader.close()
+
+        logger.info(msg="Load index from '{}'. {} element(s) loaded.".format(path, len(self.postings)))
+
+    def save_index(self, path):
+        saved_cnt = PostingFile.write(path, self.items())
         logger.info(msg="Save index to '{}'. {} element(s) saved.".format(path, saved_cnt))
 
 
+class TermTrie:
+    # префиксное дерево термов: узел - dict { символ : дочерний узел }, id терма лежит в узле под ключом None
+    root = None
+
+    def __init__(self):
+        self.root = {}
+
+    def add(self, term, key):
+        node = self.root
+        for ch in term:
+            if ch not in node:
+                node[ch] = {}
+            node = node[ch]
+        node[None] = key
+
+    def prefix_items(self, prefix, limit=None):
+        # пары (term, term_id) для всех термов, начинающихся с prefix, в порядке сортировки, не больше limit штук
+        # обходится только поддерево префикса
+        node = self.root
+        for ch in prefix:
+            if ch not in node:
+                return []
+            node = node[ch]
+
+        res = []
+        stack = [(prefix, node)]
+        while len(stack) > 0 and (limit is None or len(res) < limit):
+            term, node = stack.pop()
+            if None in node:
+                res.append((term, node[None]))
+            for ch in sorted((ch for ch in node if ch is not None), reverse=True):
+                stack.append((term + ch, node[ch]))
+        return res
+
+
 class Dictionary:
     d = None
     rev_d = None
     build_rev = False
     dictionary_size = 0
+    next_key = 1
+    trie = None
     was_reverted = False
     number_struct = Struct("<I")
 
@@ -109,8 +861,12 @@ class Dictionary:
     def clean_start(self):
         self.d = {}
         if self.build_rev:
+            # обратное отображение: rev_d[key] = elem, для свободных key - None
+            # занят ли key, проверяется за O(1) по индексу, а не поиском по списку
             self.rev_d = []
         self.dictionary_size = 0
+        self.next_key = 1
+        self.trie = None
 
     def load_dict(self, path, need_revert=False):
         self.clean_start()
@@ -130,7 +886,10 @@ class Dictionary:
                 bin_data = bin_file.read(self.number_struct.size)
                 key = self.number_struct.unpack(bin_data)[0]
                 if need_revert:
-                    self.add_elem(key, record)
+                    # ключом здесь становится id, а значением - строка, обратное отображение не нужно
+                    if key not in self.d:
+                        self.d[key] = record
+                        self.dictionary_size = self.dictionary_size + 1
                 else:
                     self.add_elem(record, key)
         logger.info(msg="Load dictionary from '" + path + "'. " + str(self.dictionary_size) + " element(s) loaded.")
@@ -148,26 +907,34 @@ class Dictionary:
                 bin_file.write(self.number_struct.pack(self.d[k]))
         logger.info(msg="Save dictionary to '" + path + "'. " + str(self.dictionary_size) + " element(s) saved.")
 
-    def add_elem(self, elem, key):
+    def add_elem(self, elem, key=None):
+        # если key не задан, элемент получает следующий свободный id (счетчик только растет)
         if elem in self.d:
             return self.d[elem]
 
         self.dictionary_size = self.dictionary_size + 1
+        self.trie = None
+        if key is None:
+            key = self.next_key
 
         if self.build_rev:
-            while key in self.rev_d:
+            while self.has_key(key):
                 key = key + 1
+            if key >= len(self.rev_d):
+                self.rev_d.extend([None] * (key + 1 - len(self.rev_d)))
+            self.rev_d[key] = elem
 
-            self.d[elem] = key
-            for i in range(len(self.rev_d)):
-                if self.rev_d[i] > key:
-                    self.rev_d.insert(i, key)
-                    return key
-            self.rev_d.append(key)
-            return key
-        else:
-            self.d[elem] = key
-            return key
+        self.d[elem] = key
+        if key >= self.next_key:
+            self.next_key = key + 1
+        return key
+
+    def has_key(self, key):
+        return self.rev_d is not None and key < len(self.rev_d) and self.rev_d[key] is not None
+
+    def get_elem(self, key):
+        # элемент по его id (только для словаря с build_rev)
+        return self.rev_d[key] if self.has_key(key) else None
 
     def make_reverted(self):
         self.clean_revert()
@@ -187,23 +954,634 @@ class Dictionary:
         else:
             return None
 
+    def prefix_items(self, prefix, limit=None):
+        # префиксное дерево строится при первом префиксном запросе
+        if self.trie is None:
+            self.trie = TermTrie()
+            for elem, key in self.d.items():
+                self.trie.add(elem, key)
+        return self.trie.prefix_items(prefix, limit)
+
+
+class TermDictionary:
+    # словарь термов (term -> term_id) на диске, отображенный в память (mmap)
+    # формат файла:
+    # * заголовок: магическая строка, версия, количество термов, размер блока, количество блоков
+    # * смещения начала блоков (разреженный индекс: одна запись на block_size термов)
+    # * блоки; термы отсортированы по байтам UTF-8, внутри блока каждый терм хранится как
+    #   (длина общего префикса с предыдущим термом, длина остатка, остаток, term_id), числа - VarByteCodec,
+    #   первый терм блока хранится целиком
+    # get_key - бинарный поиск блока по первым термам блоков и последовательный просмотр одного блока,
+    # весь словарь в память не загружается
+    magic = b"TDIC"
+    version = 1
+    block_size = 16
+    header_struct = Struct("<4sIIII")
+
+    path = None
+    mm = None
+    dictionary_size = 0
+    blocks = None
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as bin_file:
+            self.mm = mmap.mmap(bin_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.dictionary_size, self.block_size, blocks_cnt = self.header_struct.unpack_from(self.mm, 0)
+        if magic != self.magic or version != self.version:
+            self.close()
+            raise ValueError("Unsupported dictionary format in '{}'".format(path))
+        self.blocks = array("I", Struct("<%dI" % blocks_cnt).unpack_from(self.mm, self.header_struct.size))
+        logger.info(msg="Load dictionary from '{}'. {} element(s) mapped.".format(path, self.dictionary_size))
+
+    @classmethod
+    def has_header(cls, path):
+        with open(path, "rb") as bin_file:
+            return bin_file.read(len(cls.magic)) == cls.magic
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+
+    def read_entry(self, pos, prev):
+        # возвращает (терм в байтах, term_id, смещение следующей записи)
+        (prefix_len, suffix_len), pos = VarByteCodec.decode(self.mm, pos, 2)
+        term = prev[:prefix_len] + self.mm[pos:pos + suffix_len]
+        (key,), pos = VarByteCodec.decode(self.mm, pos + suffix_len, 1)
+        return term, key, pos
+
+    def block_entries(self, block):
+        pos = self.blocks[block]
+        term = b""
+        for i in range(min(self.block_size, self.dictionary_size - block * self.block_size)):
+            term, key, pos = self.read_entry(pos, term)
+            yield term, key
+
+    def find_block(self, term):
+        # последний блок, первый терм которого <= term
+        lo = 0
+        hi = len(self.blocks)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.read_entry(self.blocks[mid], b"")[0] <= term:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo - 1
+
+    def get_key(self, elem):
+        term = elem.encode('utf-8')
+        block = self.find_block(term)
+        if block < 0:
+            return None
+        for block_term, key in self.block_entries(block):
+            if block_term == term:
+                return key
+            if block_term > term:
+                break
+        return None
+
+    def prefix_range(self, prefix):
+        # пары (term, term_id) с данным префиксом по порядку: термы отсортированы, поэтому все они лежат подряд -
+        # находим блок, где они начинаются, и читаем записи, пока префикс совпадает
+        start = prefix.encode('utf-8')
+        for block in range(max(0, self.find_block(start)), len(self.blocks)):
+            for term, key in self.block_entries(block):
+                if term.startswith(start):
+                    yield term.decode('utf-8'), key
+                elif term > start:
+                    return
+
+    def prefix_items(self, prefix, limit=None):
+        return list(islice(self.prefix_range(prefix), limit))
+
+    def item_at(self, pos):
+        # pos-я по порядку сортировки пара (term, term_id), pos начинается с 0
+        for i, (term, key) in enumerate(self.block_entries(pos // self.block_size)):
+            if i == pos % self.block_size:
+                return term.decode('utf-8'), key
+        return None
+
+    def items(self):
+        # все пары (term, term_id) в порядке сортировки термов
+        for block in range(len(self.blocks)):
+            for term, key in self.block_entries(block):
+                yield term.decode('utf-8'), key
+
+    @classmethod
+    def write(cls, path, d):
+        # d = { term : term_id }
+        cls.write_sorted(path, sorted((term.encode('utf-8'), key) for term, key in d.items()), len(d))
+
+    @classmethod
+    def write_sorted(cls, path, terms, terms_cnt):
+        # terms - пары (терм в UTF-8, term_id) по возрастанию терма, их ровно terms_cnt;
+        # пары пишутся в файл по мере чтения, смещения блоков дописываются в заголовок в конце
+        blocks_cnt = (terms_cnt + cls.block_size - 1) // cls.block_size
+        blocks = []
+        offset = cls.header_struct.size + blocks_cnt * 4
+        prev = b""
+        with open(path, "wb") as bin_file:
+            bin_file.write(cls.header_struct.pack(cls.magic, cls.version, terms_cnt, cls.block_size, blocks_cnt))
+            bin_file.write(bytes(blocks_cnt * 4))
+            for i, (term, key) in enumerate(terms):
+                if i % cls.block_size == 0:
+                    blocks.append(offset)
+                    prev = b""
+                prefix_len = 0
+                while prefix_len < min(len(prev), len(term)) and prev[prefix_len] == term[prefix_len]:
+                    prefix_len = prefix_len + 1
+                entry = VarByteCodec.encode([prefix_len, len(term) - prefix_len]) + term[prefix_len:] + \
+                    VarByteCodec.encode([key])
+                bin_file.write(entry)
+                offset = offset + len(entry)
+                prev = term
+            bin_file.seek(cls.header_struct.size)
+            bin_file.write(Struct("<%dI" % blocks_cnt).pack(*blocks))
+        logger.info(msg="Save dictionary to '{}'. {} element(s) saved.".format(path, terms_cnt))
+
+
+class KGramIndex:
+    # k-граммный индекс словаря для запросов с '*' в начале или середине терма (*граф*, ф*ка)
+    # терм дополняется граничным символом с обеих сторон ($граф$) и разбивается на k-граммы ($гр, гра, раф, аф$)
+    # хранится в двух файлах существующих форматов:
+    # * kgrams.dic - TermDictionary: k-грамма -> gram_id
+    # * kgrams.idx - PostingFile: gram_id -> отсортированные номера термов (с 1) в порядке words.dic
+    # шаблон разбивается на куски между '*', их k-граммы пересекаются как обычные инвертированные списки,
+    # а каждый кандидат проверяется регулярным выражением (k-граммы не учитывают порядок кусков)
+    # так словарь не перебирается целиком: читаются только списки k-грамм шаблона и записи кандидатов
+    k = 3
+    boundary = '$'
+
+    grams_dict = None
+    postings = None
+    words_dict = None
+
+    def __init__(self, grams_dict_path, index_path, words_dict):
+        # words_dict - TermDictionary, по которому был построен индекс
+        self.grams_dict = TermDictionary(grams_dict_path)
+        self.postings = PostingFile(index_path)
+        self.words_dict = words_dict
+
+    @classmethod
+    def exists(cls, grams_dict_path, index_path):
+        return os.path.exists(grams_dict_path) and os.path.exists(index_path)
+
+    def close(self):
+        self.grams_dict.close()
+        self.postings.close()
+
+    @classmethod
+    def grams(cls, piece):
+        return set(piece[i:i + cls.k] for i in range(len(piece) - cls.k + 1))
+
+    @classmethod
+    def term_grams(cls, term):
+        return cls.grams(cls.boundary + term + cls.boundary)
+
+    @classmethod
+    def pattern_grams(cls, pattern):
+        res = set()
+        for piece in (cls.boundary + pattern + cls.boundary).split('*'):
+            res.update(cls.grams(piece))
+        return res
+
+    @staticmethod
+    def pattern_regexp(pattern):
+        return re.compile('.*'.join(re.escape(piece) for piece in pattern.split('*')) + r'\Z', re.DOTALL)
+
+    def candidates(self, grams):
+        # пересечение списков k-грамм, начиная с самого короткого
+        found = []
+        for gram in grams:
+            gram_id = self.grams_dict.get_key(gram)
+            if gram_id is None:
+                return []
+            found.append(self.postings.find(gram_id))
+        found.sort(key=lambda entry: entry[1])
+        cursors = [self.postings.read_cursor(offset, docs_cnt) for offset, docs_cnt in found]
+
+        res = []
+        pos = cursors[0].doc()
+        while pos is not None:
+            for cursor in cursors[1:]:
+                found = cursor.advance_to(pos)
+                if found is None:
+                    return res
+                if found != pos:
+                    pos = cursors[0].advance_to(found)
+                    break
+            else:
+                res.append(pos)
+                pos = cursors[0].next()
+        return res
+
+    def wildcard_items(self, pattern, limit=None):
+        # пары (term, term_id) для всех термов, подходящих под шаблон, в порядке сортировки, не больше limit штук
+        grams = self.pattern_grams(pattern)
+        if len(grams) > 0:
+            items = (self.words_dict.item_at(pos - 1) for pos in self.candidates(grams))
+        else:
+            # куски шаблона короче k (a*b, *а*): k-граммы ничего не отсекают, поэтому проверяются только термы
+            # с началом шаблона в качестве префикса (TermDictionary.prefix_range)
+            # шаблон без начала так перебирал бы весь словарь на каждом запросе и не выполняется;
+            # исключение - "*": ему подходит любой терм, и перебор заканчивается на limit
+            prefix = pattern.split('*')[0]
+            if len(prefix) == 0 and len(pattern.strip('*')) > 0:
+                logger.info(msg="Skip wildcard '{}': no prefix and no {}-grams to look up.".format(pattern, self.k))
+                return []
+            items = self.words_dict.prefix_range(prefix)
+
+        regexp = self.pattern_regexp(pattern)
+        res = []
+        for term, key in items:
+            if regexp.match(term):
+                if limit is not None and len(res) >= limit:
+                    break
+                res.append((term, key))
+        return res
+
+    @classmethod
+    def write(cls, grams_dict_path, index_path, d):
+        # d = { term : term_id }; номера термов соответствуют порядку TermDictionary.write
+        terms = sorted(term.encode('utf-8') for term in d)
+        gram_terms = {}
+        for pos, term in enumerate(terms):
+            for gram in cls.term_grams(term.decode('utf-8')):
+                if gram in gram_terms:
+                    gram_terms[gram].append(pos + 1)
+                else:
+                    gram_terms[gram] = [pos + 1]
+
+        grams = sorted(gram_terms.keys(), key=lambda gram: gram.encode('utf-8'))
+        TermDictionary.write(grams_dict_path, {gram: gram_id + 1 for gram_id, gram in enumerate(grams)})
+        PostingFile.write(index_path, [(gram_id + 1, gram_terms[gram]) for gram_id, gram in enumerate(grams)])
+        logger.info(msg="Save k-gram index to '{}'. {} gram(s) saved.".format(index_path, len(grams)))
+
+
+class FormsDictionary:
+    # словоформы документов -> термы words.dic (forms.dic), строится вместе с индексом
+    # хранится как TermDictionary: словоформа -> номер ее терма в порядке сортировки words.dic (с 1), как в KGramIndex
+    # term - поиск словоформы в forms.dic и чтение одного блока words.dic, без лемматизации
+    forms_dict = None
+    words_dict = None
+
+    def __init__(self, path, words_dict):
+        self.forms_dict = TermDictionary(path)
+        self.words_dict = words_dict
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(path) and TermDictionary.has_header(path)
+
+    def close(self):
+        self.forms_dict.close()
+
+    def term(self, form):
+        rank = self.forms_dict.get_key(form)
+        if rank is None:
+            return None
+        return self.words_dict.item_at(rank - 1)[0]
+
+    def items(self):
+        # все пары (словоформа, терм) в порядке сортировки словоформ
+        terms = [term for term, key in self.words_dict.items()]
+        for form, rank in self.forms_dict.items():
+            yield form, terms[rank - 1]
+
+    @classmethod
+    def write(cls, path, forms, d):
+        # forms = { словоформа : терм } или SpimiForms, d = { term : term_id }; словоформы термов не из d пропускаются
+        ranks = {term: pos + 1 for pos, term in enumerate(sorted(d, key=lambda term: term.encode('utf-8')))}
+        if isinstance(forms, dict):
+            TermDictionary.write(path, {form: ranks[term] for form, term in forms.items() if term in ranks})
+            return
+
+        # SpimiForms отдает словоформы уже по порядку, и они пишутся без словаря в памяти;
+        # для заголовка нужно их число - оно считается отдельным проходом
+        def ranked_forms():
+            for form, term in forms.items():
+                if term in ranks:
+                    yield form.encode('utf-8'), ranks[term]
+
+        TermDictionary.write_sorted(path, ranked_forms(), sum(1 for item in ranked_forms()))
+
+
+class DocsDictionary:
+    # словарь документов (doc_id -> url) на диске, отображенный в память (mmap)
+    # формат файла:
+    # * заголовок: магическая строка, версия, количество документов, максимальный doc_id
+    # * таблица смещений: для каждого doc_id от 0 до максимального - начало его строки, плюс конец последней строки
+    # * строки url подряд, в UTF-8, уже раскодированные из %-нотации
+    # url документа - срез между двумя соседними смещениями, поэтому при открытии ничего не читается,
+    # а декодируются только те url, которые действительно показываются пользователю
+    magic = b"DDIC"
+    version = 1
+    header_struct = Struct("<4sIII")
+    bounds_struct = Struct("<II")
+
+    path = None
+    mm = None
+    dictionary_size = 0
+    max_key = 0
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as bin_file:
+            self.mm = mmap.mmap(bin_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.dictionary_size, self.max_key = self.header_struct.unpack_from(self.mm, 0)
+        if magic != self.magic or version != self.version:
+            self.close()
+            raise ValueError("Unsupported dictionary format in '{}'".format(path))
+        logger.info(msg="Load dictionary from '{}'. {} element(s) mapped.".format(path, self.dictionary_size))
+
+    @classmethod
+    def has_header(cls, path):
+        with open(path, "rb") as bin_file:
+            return bin_file.read(len(cls.magic)) == cls.magic
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+
+    def get_elem(self, key):
+        if key < 0 or key > self.max_key:
+            return None
+        start, end = self.bounds_struct.unpack_from(self.mm, self.header_struct.size + key * 4)
+        if start == end:
+            return None
+        return self.mm[start:end].decode('utf-8')
+
+    @classmethod
+    def write(cls, path, d, max_key=None):
+        # d = { url : doc_id }
+        # max_key - последний doc_id, если после последнего url есть doc_id без url
+        if max_key is None:
+            max_key = max(d.values()) if len(d) > 0 else 0
+        urls = [None] * (max_key + 1)
+        for url, key in d.items():
+            urls[key] = unquote(url)
+        cls.write_urls(path, urls)
+
+    @classmethod
+    def write_urls(cls, path, urls):
+        # urls[doc_id] - уже раскодированный url или None, urls[0] не используется
+        data = [b"" if url is None else url.encode('utf-8') for url in urls]
+        size = len(urls) - urls.count(None)
+
+        offset = cls.header_struct.size + (len(data) + 1) * 4
+        offsets = []
+        for url in data:
+            offsets.append(offset)
+            offset = offset + len(url)
+        offsets.append(offset)
+
+        with open(path, "wb") as bin_file:
+            bin_file.write(cls.header_struct.pack(cls.magic, cls.version, size, len(data) - 1))
+            bin_file.write(Struct("<%dI" % len(offsets)).pack(*offsets))
+            for url in data:
+                bin_file.write(url)
+        logger.info(msg="Save dictionary to '{}'. {} element(s) saved.".format(path, size))
+
+
+class Tombstones:
+    # удаленные документы: битовая карта в файле deletes.bm, бит doc_id выставлен - документ удален
+    # удаление - запись одного байта на место (O(1)), индекс при этом не перестраивается;
+    # поиск пропускает такие doc_id, а перестройка индекса физически выкидывает их из списков
+    path = None
+    bits = None
+    mtime = None
+
+    def __init__(self, path):
+        self.path = path
+        self.bits = b""
+        self.refresh()
+
+    def refresh(self):
+        # перечитать файл, если он изменился; возвращает True, если изменился
+        mtime = os.stat(self.path).st_mtime_ns if os.path.exists(self.path) else None
+        if mtime == self.mtime:
+            return False
+        self.mtime = mtime
+        if mtime is None:
+            self.bits = b""
+        else:
+            with open(self.path, "rb") as bin_file:
+                self.bits = bin_file.read()
+        return True
+
+    def __contains__(self, doc_id):
+        byte = doc_id >> 3
+        return byte < len(self.bits) and (self.bits[byte] >> (doc_id & 7)) & 1 == 1
+
+    def __len__(self):
+        return sum(bin(byte).count('1') for byte in self.bits)
+
+    def __iter__(self):
+        for i, byte in enumerate(self.bits):
+            if byte:
+                for bit in range(8):
+                    if (byte >> bit) & 1:
+                        yield (i << 3) | bit
+
+    def filter(self, docs):
+        # doc_id из docs, кроме удаленных; docs перебирается лениво
+        for doc in docs:
+            if doc not in self:
+                yield doc
+
+    @staticmethod
+    def delete(path, doc_id):
+        with open(path, "r+b" if os.path.exists(path) else "w+b") as bin_file:
+            bin_file.seek(doc_id >> 3)
+            byte = bin_file.read(1)
+            bin_file.seek(doc_id >> 3)
+            bin_file.write(bytes([(byte[0] if len(byte) > 0 else 0) | (1 << (doc_id & 7))]))
+
+
+class Segment:
+    # одна часть индекса: каталог с words.dic, docs.dic, idx.idx (и k-граммным индексом)
+    # doc_id внутри сегмента локальные (с 1), глобальный doc_id = base + локальный
+    words_dict = None
+    docs_dict = None
+    index = None
+    kgram_index = None
+    forms_dict = None
+    name = None
+    base = 0
+    docs_cnt = 0
+
+    def __init__(self, path, base=0, in_memory=False, name=None):
+        # in_memory=True - загрузить весь обратный индекс в память (CsrRevertIndex),
+        # иначе индекс отображается в память и списки читаются с диска по требованию
+        ipw = IndexPathWrapper(path)
+        self.base = base
+        self.name = name
+
+        if TermDictionary.has_header(ipw.get_words_dict_path()):
+            self.words_dict = TermDictionary(ipw.get_words_dict_path())
+            if KGramIndex.exists(ipw.get_kgrams_dict_path(), ipw.get_kgrams_index_path()):
+                self.kgram_index = KGramIndex(ipw.get_kgrams_dict_path(), ipw.get_kgrams_index_path(), self.words_dict)
+            if FormsDictionary.exists(ipw.get_forms_dict_path()):
+                self.forms_dict = FormsDictionary(ipw.get_forms_dict_path(), self.words_dict)
+        else:
+            self.words_dict = Dictionary()
+            self.words_dict.load_dict(ipw.get_words_dict_path())
+
+        if DocsDictionary.has_header(ipw.get_docs_dict_path()):
+            self.docs_dict = DocsDictionary(ipw.get_docs_dict_path())
+            self.docs_cnt = self.docs_dict.max_key
+        else:
+            self.docs_dict = Dictionary(True)
+            self.docs_dict.load_dict(ipw.get_docs_dict_path(), True)
+            self.docs_cnt = self.docs_dict.dictionary_size
+
+        self.index = CsrRevertIndex() if in_memory else RevertIndex()
+        self.index.load_index(ipw.get_index_path())
+
+    def close(self):
+        if self.kgram_index is not None:
+            self.kgram_index.close()
+        if self.forms_dict is not None:
+            self.forms_dict.close()
+        if isinstance(self.words_dict, TermDictionary):
+            self.words_dict.close()
+        if isinstance(self.docs_dict, DocsDictionary):
+            self.docs_dict.close()
+        if isinstance(self.index, RevertIndex) and self.index.reader is not None:
+            self.index.reader.close()
+
+    def postings(self, term):
+        key = self.words_dict.get_key(term)
+        return [] if key is None else self.index.extract_postings(key)
+
+    def get_doc_url(self, doc_id):
+        # url документа (по локальному doc_id) в читаемом виде; старый docs.dic хранит url в %-нотации
+        if isinstance(self.docs_dict, DocsDictionary):
+            return self.docs_dict.get_elem(doc_id)
+        url = self.docs_dict.d.get(doc_id)
+        return None if url is None else unquote(url)
+
+
+class SegmentsManifest:
+    # список сегментов, добавленных к индексу после его построения (segments.json в каталоге индекса):
+    # {"next_id": N, "segments": [{"name": имя каталога, "base": сдвиг doc_id, "docs": количество doc_id}, ...]}
+    # сегменты идут по возрастанию base и покрывают doc_id подряд, сразу после документов основного индекса
+    # файл заменяется атомарно (запись во временный файл и os.replace): читатель видит либо старый список, либо новый
+
+    @staticmethod
+    def read(path):
+        if not os.path.exists(path):
+            return {"next_id": 1, "segments": []}
+        with open(path, "r") as in_file:
+            return json.load(in_file)
+
+    @staticmethod
+    def write(path, manifest):
+        with open(path + ".tmp", "w") as out_file:
+            json.dump(manifest, out_file)
+        os.replace(path + ".tmp", path)
+
 
 class Wrapper:
+    # основной индекс и сегменты из segments.json
+    # words_dict, docs_dict, index и kgram_index - части основного индекса;
+    # поиск по всем сегментам сразу - postings, prefix_items, wildcard_items, form_term, get_doc_url, docs_count
+    # deleted - удаленные документы (глобальные doc_id), их отбрасывает live_docs
     words_dict = None
     docs_dict = None
     index = None
     lemmatizer = None
+    kgram_index = None
+    ipw = None
+    in_memory = False
+    segments = None
+    manifest_mtime = None
+    deleted = None
 
-    def __init__(self, index_path):
-        ipw = IndexPathWrapper(index_path)
+    def __init__(self, index_path, in_memory=False):
+        self.ipw = IndexPathWrapper(index_path)
+        self.in_memory = in_memory
 
-        self.words_dict = Dictionary()
-        self.words_dict.load_dict(ipw.get_words_dict_path())
+        main_segment = Segment(index_path, 0, in_memory)
+        self.words_dict = main_segment.words_dict
+        self.docs_dict = main_segment.docs_dict
+        self.index = main_segment.index
+        self.kgram_index = main_segment.kgram_index
+        self.segments = [main_segment]
+        self.deleted = Tombstones(self.ipw.get_deletes_path())
+        self.refresh()
 
-        self.docs_dict = Dictionary(True)
-        self.docs_dict.load_dict(ipw.get_docs_dict_path(), True)
+        # shell - единственный писатель кэша лемм в своем процессе, поэтому сбрасывает новые словоформы сам
+        self.lemmatizer = TextLemmatizer(self.ipw.get_lemma_cache_path(), autosave=True)
 
-        self.index = RevertIndex()
-        self.index.load_index(ipw.get_index_path())
+    def refresh(self):
+        # перечитать segments.json и deletes.bm, если они изменились: новые сегменты открываются, слитые - закрываются
+        # возвращает True, если список сегментов или удаленных документов изменился
+        deletes_changed = self.deleted.refresh()
+        path = self.ipw.get_segments_manifest_path()
+        mtime = os.stat(path).st_mtime_ns if os.path.exists(path) else None
+        if mtime == self.manifest_mtime:
+            return deletes_changed
+        self.manifest_mtime = mtime
+
+        opened = dict((segment.name, segment) for segment in self.segments[1:])
+        segments = [self.segments[0]]
+        for entry in SegmentsManifest.read(path)["segments"]:
+            segment = opened.pop(entry["name"], None)
+            if segment is None:
+                segment = Segment(self.ipw.get_segment_path(entry["name"]), entry["base"], self.in_memory, entry["name"])
+            segments.append(segment)
+        for segment in opened.values():
+            segment.close()
+        self.segments = segments
+        logger.info(msg="Refresh segments. {} segment(s) opened.".format(len(self.segments)))
+        return True
+
+    def live_docs(self, docs):
+        return self.deleted.filter(docs)
+
+    def docs_count(self):
+        last = self.segments[-1]
+        return last.base + last.docs_cnt
+
+    def postings(self, term):
+        # сегменты идут по возрастанию doc_id, поэтому их списки идут друг за другом (см. SegmentsPostingList)
+        if len(self.segments) == 1:
+            return self.segments[0].postings(term)
+        return SegmentsPostingList([(segment.base, segment.postings(term)) for segment in self.segments])
+
+    def form_term(self, form):
+        # терм словоформы из документов индекса или None, если словоформа не встречалась ни в одном сегменте
+        for segment in self.segments:
+            if segment.forms_dict is not None:
+                term = segment.forms_dict.term(form)
+                if term is not None:
+                    return term
+        return None
+
+    def merge_items(self, segments_items, limit):
+        # объединение отсортированных по термам списков (term, term_id) разных сегментов;
+        # term_id в сегментах свои, поэтому вместо них возвращается None
+        terms = set(term for items in segments_items for term, key in items)
+        terms = sorted(terms, key=lambda term: term.encode('utf-8'))
+        return [(term, None) for term in (terms if limit is None else terms[:limit])]
+
+    def prefix_items(self, prefix, limit=None):
+        if len(self.segments) == 1:
+            return self.words_dict.prefix_items(prefix, limit)
+        return self.merge_items([segment.words_dict.prefix_items(prefix, limit) for segment in self.segments], limit)
+
+    def wildcard_items(self, pattern, limit=None):
+        return self.merge_items([segment.kgram_index.wildcard_items(pattern, limit) for segment in self.segments
+                                 if segment.kgram_index is not None], limit)
 
-        self.lemmatizer = TextLemmatizer()
+    def get_doc_url(self, doc_id):
+        for segment in reversed(self.segments):
+            if doc_id > segment.base:
+                return segment.get_doc_url(doc_id - segment.base)
+        return None
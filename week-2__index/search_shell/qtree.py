@@ -1,11 +1,13 @@
 #!/usr/bin/python3.4
 # -*- coding: utf-8 -*-
 
+import heapq
 import logging
 import re
 from enum import Enum
 
 from index.normalizer import TextNormalizer
+from index.wrapper import ListCursor
 
 logging.basicConfig(
     format='%(levelname)s %(asctime)s : %(message)s',
@@ -18,6 +20,7 @@ class TokenType(Enum):
     TERM = 1
     LEFT_BR = 2
     RIGHT_BR = 3
+    NOT = 6
     AND = 5
     OR = 4
 
@@ -56,6 +59,14 @@ class Token:
     def is_term(self):
         return self.tokenType == TokenType.TERM
 
+    def is_wildcard(self):
+        # терм с '*' - шаблон: "кот*", "*граф*", "ф*ка"
+        return self.is_term() and self.value is not None and len(self.value) > 1 and '*' in self.value
+
+    def is_prefix(self):
+        # терм вида "кот*" - все термы словаря, начинающиеся с "кот"
+        return self.is_wildcard() and self.value.find('*') == len(self.value) - 1
+
     def is_brace(self):
         return self.tokenType == TokenType.LEFT_BR or self.tokenType == TokenType.RIGHT_BR
 
@@ -71,6 +82,9 @@ class Token:
     def is_oper_or(self):
         return self.tokenType == TokenType.OR
 
+    def is_not(self):
+        return self.tokenType == TokenType.NOT
+
 
 class TreeNode:
     token = None
@@ -91,23 +105,104 @@ class TreeNode:
         return lower_node.left_root_right_print()
 
     def left_root_right_print(self):
+        if self.token.is_not():
+            return str(self.token) + \
+                str(Token(TokenType.LEFT_BR)) + \
+                self.left.left_root_right_print() + \
+                str(Token(TokenType.RIGHT_BR))
+
         return self.form_level_for_print(self.token, self.left) + \
             str(self.token) + \
             self.form_level_for_print(self.token, self.right)
 
+    @staticmethod
+    def make_cursor(docs):
+        # списки из индекса (PostingList) умеют отдавать курсор с указателями пропуска, остальные - обычные списки
+        return docs.cursor() if hasattr(docs, 'cursor') else ListCursor(docs)
+
+    # во сколько раз один список должен быть длиннее другого, чтобы вместо слияния прыгать по длинному курсором
+    gallop_ratio = 8
+
+    # все списки документов отсортированы по возрастанию doc_id (так их строит IndexBuilder),
+    # и результаты операций тоже остаются отсортированными - на этом построены оба алгоритма ниже
+
     def intersect_lists(self, a, b):
-        return list(sorted(set(a) & set(b)))
+        if len(a) > len(b):
+            a, b = b, a
+        if len(b) < self.gallop_ratio * len(a):
+            return self.merge_intersect(a, b)
+
+        # идем по короткому списку и продвигаем курсор длинного списка сразу к нужному документу
+        res = []
+        cursor = self.make_cursor(b)
+        for doc in a:
+            found = cursor.advance_to(doc)
+            if found is None:
+                break
+            if found == doc:
+                res.append(doc)
+        return res
+
+    @staticmethod
+    def merge_intersect(a, b):
+        res = []
+        a_iter = iter(a)
+        b_iter = iter(b)
+        x = next(a_iter, None)
+        y = next(b_iter, None)
+        while x is not None and y is not None:
+            if x < y:
+                x = next(a_iter, None)
+            elif x > y:
+                y = next(b_iter, None)
+            else:
+                res.append(x)
+                x = next(a_iter, None)
+                y = next(b_iter, None)
+        return res
+
+    def difference_lists(self, a, b):
+        # документы из a, которых нет в b: идем по a и проверяем каждый документ курсором по b
+        res = []
+        cursor = self.make_cursor(b)
+        for doc in a:
+            if cursor.advance_to(doc) != doc:
+                res.append(doc)
+        return res
 
     def union_lists(self, a, b):
-        return list(set(a).union(set(b)))
+        res = []
+        a_iter = iter(a)
+        b_iter = iter(b)
+        x = next(a_iter, None)
+        y = next(b_iter, None)
+        while x is not None and y is not None:
+            if x < y:
+                res.append(x)
+                x = next(a_iter, None)
+            elif x > y:
+                res.append(y)
+                y = next(b_iter, None)
+            else:
+                res.append(x)
+                x = next(a_iter, None)
+                y = next(b_iter, None)
+        if x is not None:
+            res.append(x)
+            res.extend(a_iter)
+        if y is not None:
+            res.append(y)
+            res.extend(b_iter)
+        return res
 
-    def left_right_root_execute(self, value_map):
+    def left_right_root_execute(self, value_map, docs_count=0):
         # результат выполнения запроса
         # value_map содержит термы запроса (см. Tokenizer.get_terms()) и документы, в которых эти термы встречались (из обратного индекса)
         # возвращает список документов, если запрос удалось выполнить, или пустой список, если не удалось
         # порядок выполнения запроса: Left-Right-Root, т.е. для каждого узла, начиная с корня, выполняется вначале левой поддерево, потом правое, потом сам узел
         # если узел сам по себе является термом (т.е. у него нет поддеревьев), то результатом является список связанных с этим термом документов из value_map
-        # узел может быть одним из 2 операторов: AND или OR
+        # узел может быть одним из 3 операторов: AND, OR или NOT
+        # docs_count - количество документов в индексе (doc_id от 1 до docs_count), нужно для NOT
 
         logger.info(msg="left_right_root_execute: token={}".format(str(self.token)))
 
@@ -120,8 +215,19 @@ class TreeNode:
             else:
                 return []
 
-        l_docs = self.left.left_right_root_execute(value_map)
-        r_docs = self.right.left_right_root_execute(value_map)
+        # A AND NOT B - разность списков, дополнение к B не строится
+        if self.token.is_oper_and() and self.right.token.is_not():
+            return self.difference_lists(self.left.left_right_root_execute(value_map, docs_count),
+                                         self.right.left.left_right_root_execute(value_map, docs_count))
+        if self.token.is_oper_and() and self.left.token.is_not():
+            return self.difference_lists(self.right.left_right_root_execute(value_map, docs_count),
+                                         self.left.left.left_right_root_execute(value_map, docs_count))
+
+        if self.token.is_not():
+            return self.difference_lists(range(1, docs_count + 1), self.left.left_right_root_execute(value_map, docs_count))
+
+        l_docs = self.left.left_right_root_execute(value_map, docs_count)
+        r_docs = self.right.left_right_root_execute(value_map, docs_count)
 
         # узел является оператором
         if self.token.is_oper_and():
@@ -135,22 +241,255 @@ class TreeNode:
             return res
 
 
+class AndCursor:
+    # ленивое пересечение: все курсоры продвигаются к одному и тому же документу,
+    # первым идет курсор самого короткого списка, он и задает шаг
+    cursors = None
+    current = None
+
+    def __init__(self, cursors):
+        self.cursors = cursors
+        self.current = self.align(cursors[0].doc())
+
+    def align(self, target):
+        doc = target
+        while doc is not None:
+            for cursor in self.cursors:
+                found = cursor.advance_to(doc)
+                if found is None:
+                    doc = None
+                    break
+                if found > doc:
+                    doc = found
+                    break
+            else:
+                return doc
+        return None
+
+    def doc(self):
+        return self.current
+
+    def next(self):
+        if self.current is not None:
+            self.current = self.align(self.current + 1)
+        return self.current
+
+    def advance_to(self, target):
+        if self.current is not None and self.current < target:
+            self.current = self.align(target)
+        return self.current
+
+
+class OrCursor:
+    # ленивое объединение: текущий документ - наименьший среди текущих документов всех курсоров
+    cursors = None
+    current = None
+
+    def __init__(self, cursors):
+        self.cursors = cursors
+        self.current = self.smallest()
+
+    def smallest(self):
+        docs = [cursor.doc() for cursor in self.cursors if cursor.doc() is not None]
+        return min(docs) if len(docs) > 0 else None
+
+    def doc(self):
+        return self.current
+
+    def next(self):
+        if self.current is None:
+            return None
+        for cursor in self.cursors:
+            if cursor.doc() == self.current:
+                cursor.next()
+        self.current = self.smallest()
+        return self.current
+
+    def advance_to(self, target):
+        if self.current is not None and self.current < target:
+            for cursor in self.cursors:
+                cursor.advance_to(target)
+            self.current = self.smallest()
+        return self.current
+
+
+class NotCursor:
+    # ленивое дополнение до множества doc_id 1..docs_count: перебираются только документы, которых нет в курсоре cursor
+    # внутри AndCursor дает потоковую разность A AND NOT B, список всех документов не строится никогда
+    cursor = None
+    docs_count = 0
+    current = None
+
+    def __init__(self, cursor, docs_count):
+        self.cursor = cursor
+        self.docs_count = docs_count
+        self.current = self.align(1)
+
+    def align(self, target):
+        doc = target
+        while doc <= self.docs_count:
+            if self.cursor.advance_to(doc) != doc:
+                return doc
+            doc = doc + 1
+        return None
+
+    def doc(self):
+        return self.current
+
+    def next(self):
+        if self.current is not None:
+            self.current = self.align(self.current + 1)
+        return self.current
+
+    def advance_to(self, target):
+        if self.current is not None and self.current < target:
+            self.current = self.align(target)
+        return self.current
+
+
+class PlanNode(TreeNode):
+    # узел плана выполнения запроса
+    # в отличие от дерева разбора, цепочки одинаковых ассоциативных операторов схлопнуты в один узел
+    # с произвольным числом детей: a AND (b AND c) -> AND(a, b, c)
+    children = None
+
+    def __init__(self, token, children=None):
+        TreeNode.__init__(self, token)
+        self.children = [] if children is None else children
+
+    @staticmethod
+    def from_tree(node):
+        if node.token.is_term():
+            return PlanNode(node.token)
+
+        if node.token.is_not():
+            child_plan = PlanNode.from_tree(node.left)
+            # NOT NOT a -> a
+            if child_plan.token.is_not():
+                return child_plan.children[0]
+            return PlanNode(node.token, [child_plan])
+
+        plan = PlanNode(node.token)
+        for child in [node.left, node.right]:
+            child_plan = PlanNode.from_tree(child)
+            if child_plan.token == node.token:
+                plan.children.extend(child_plan.children)
+            else:
+                plan.children.append(child_plan)
+        return plan
+
+    def __repr__(self):
+        if self.token.is_term():
+            return self.token.value
+        return self.token.tokenType.name + '(' + ', '.join(repr(child) for child in self.children) + ')'
+
+    def estimate(self, value_map, docs_count=0):
+        # оценка размера результата сверху: для терма - длина его инвертированного списка (из таблицы термов индекса,
+        # список при этом не декодируется), для AND - минимальная оценка среди детей, для OR - сумма,
+        # для NOT - все документы: оценка отрицаемого узла тоже лишь сверху, и разность с ней могла бы занизить размер
+        # поэтому нулевая оценка значит, что результат точно пуст
+        if self.token.is_term():
+            return len(value_map.get(self.token.value, []))
+        if self.token.is_not():
+            return docs_count
+        estimates = [child.estimate(value_map, docs_count) for child in self.children]
+        return min(estimates) if self.token.is_oper_and() else sum(estimates)
+
+    def split_and_children(self, value_map, docs_count):
+        # для AND: обычные операнды в порядке возрастания оценки и операнды под NOT
+        positive = [child for child in self.children if not child.token.is_not()]
+        negative = [child for child in self.children if child.token.is_not()]
+        positive.sort(key=lambda child: child.estimate(value_map, docs_count))
+        return positive, negative
+
+    def execute(self, value_map, docs_count=0):
+        if self.token.is_term():
+            return value_map.get(self.token.value, [])
+
+        if self.token.is_not():
+            return list(self.stream_cursor(self.cursor(value_map, docs_count)))
+
+        if self.token.is_oper_and():
+            positive, negative = self.split_and_children(value_map, docs_count)
+            if len(positive) == 0:
+                # все операнды под NOT: это дополнение к их объединению
+                return list(self.stream_cursor(self.cursor(value_map, docs_count)))
+
+            # начинаем с самого короткого списка: промежуточный результат не может быть длиннее него,
+            # а если хотя бы один из операндов пуст, то пуст и весь AND - дальше ничего не вычисляем
+            if positive[0].estimate(value_map, docs_count) == 0:
+                return []
+
+            res = positive[0].execute(value_map, docs_count)
+            for child in positive[1:]:
+                if len(res) == 0:
+                    break
+                res = self.intersect_lists(res, child.execute(value_map, docs_count))
+            # A AND NOT B: из результата выкидываются документы B
+            for child in negative:
+                if len(res) == 0:
+                    break
+                res = self.difference_lists(res, child.children[0].execute(value_map, docs_count))
+            return res if isinstance(res, list) else list(res)
+
+        if self.token.is_oper_or():
+            # слияние k отсортированных списков с удалением повторов
+            res = []
+            for doc in heapq.merge(*[child.execute(value_map, docs_count) for child in self.children]):
+                if len(res) == 0 or res[-1] != doc:
+                    res.append(doc)
+            return res
+
+    @staticmethod
+    def stream_cursor(cursor):
+        doc = cursor.doc()
+        while doc is not None:
+            yield doc
+            doc = cursor.next()
+
+    def cursor(self, value_map, docs_count=0):
+        # тот же план, но вместо списков - ленивые курсоры (документ за документом, без промежуточных списков)
+        if self.token.is_term():
+            return self.make_cursor(value_map.get(self.token.value, []))
+
+        if self.token.is_not():
+            return NotCursor(self.children[0].cursor(value_map, docs_count), docs_count)
+
+        if self.token.is_oper_and():
+            positive, negative = self.split_and_children(value_map, docs_count)
+            if len(positive) > 0 and positive[0].estimate(value_map, docs_count) == 0:
+                return ListCursor([])
+            # курсоры под NOT идут последними: документы предлагают обычные операнды, а NOT их только отсеивает
+            return AndCursor([child.cursor(value_map, docs_count) for child in positive + negative])
+
+        if self.token.is_oper_or():
+            return OrCursor([child.cursor(value_map, docs_count) for child in self.children])
+
+
 class Tokenizer:
     expression = None
     tokens = None
     iterator = 0
     lemmatizer = None
+    # словоформы документов индекса (forms.dic, см. Wrapper.form_term) или None
+    forms = None
 
-    def __init__(self, exp, lemmatizer):
+    def __init__(self, exp, lemmatizer, forms=None):
         self.expression = exp
         self.lemmatizer = lemmatizer
+        self.forms = forms
 
     def _simplify_token(self, token):
+        # словоформа из документов индекса находится одним поиском в forms.dic, лемматизатор нужен только для остальных
+        if self.forms is not None:
+            term = self.forms.form_term(TextNormalizer.lower_case(token))
+            if term is not None:
+                return term
         lemma = self.lemmatizer.lemmatize(token)
         return TextNormalizer.lower_case(lemma)
 
     def tokenize(self):
-        regexp = re.compile(r'(\bAND\b|\bOR\b|\(|\))')
+        regexp = re.compile(r'(\bAND\b|\bOR\b|\bNOT\b|!|\(|\))')
         raw_tokens = regexp.split(self.expression)
         raw_tokens = [token.strip() for token in raw_tokens if token.strip() != '']
 
@@ -160,10 +499,15 @@ class Tokenizer:
                 self.tokens.append(Token(TokenType.AND))
             elif token == 'OR':
                 self.tokens.append(Token(TokenType.OR))
+            elif token == 'NOT' or token == '!':
+                self.tokens.append(Token(TokenType.NOT))
             elif token == '(':
                 self.tokens.append(Token(TokenType.LEFT_BR))
             elif token == ')':
                 self.tokens.append(Token(TokenType.RIGHT_BR))
+            elif len(token) > 1 and '*' in token:
+                # шаблон не лемматизируется: лемма от части слова не имеет смысла
+                self.tokens.append(Token(TokenType.TERM, TextNormalizer.lower_case(token)))
             else:
                 self.tokens.append(Token(TokenType.TERM, self._simplify_token(token)))
 
@@ -181,6 +525,9 @@ class Tokenizer:
                 while not op.is_lbrace():
                     result.append(op)
                     op = operator_stack.pop()
+            elif token.is_not():
+                # унарный префиксный оператор: его операнд еще впереди, поэтому из стека ничего не выталкиваем
+                operator_stack.append(token)
             else:
                 while len(operator_stack) > 0:
                     op = operator_stack.pop()
@@ -209,8 +556,8 @@ class QueryTree:
     tokenizer = None
     root = None
 
-    def __init__(self, expression_string, lemmatizer):
-        self.tokenizer = Tokenizer(expression_string, lemmatizer)
+    def __init__(self, expression_string, lemmatizer, forms=None):
+        self.tokenizer = Tokenizer(expression_string, lemmatizer, forms)
         self.tokenizer.tokenize()
         self.tokenizer.postfix()
         self.parse()
@@ -221,6 +568,9 @@ class QueryTree:
             node = TreeNode(token)
             if token.is_term():
                 stack.append(node)
+            elif token.is_not():
+                node.left = stack.pop()
+                stack.append(node)
             else:
                 node.right = stack.pop()
                 node.left = stack.pop()
@@ -228,10 +578,78 @@ class QueryTree:
         self.root = stack.pop() if stack != [] else None
 
     def extract_terms(self):
-        return self.tokenizer.get_terms()
+        if self.root is None:
+            return self.tokenizer.get_terms()
+        # термы берутся из дерева, а не из токенов: после expand_wildcards в дереве появляются новые термы
+        res = []
+        stack = [self.root]
+        while len(stack) > 0:
+            node = stack.pop()
+            if node.token.is_term():
+                if node.token.value not in res:
+                    res.append(node.token.value)
+                continue
+            if node.right is not None:
+                stack.append(node.right)
+            stack.append(node.left)
+        return res
+
+    def expand_wildcards(self, words_dict, limit=None, kgram_index=None):
+        # каждый терм-шаблон заменяется на OR всех подходящих термов словаря (не больше limit штук),
+        # план выполнения потом схлопывает эту цепочку в один n-арный OR
+        # "кот*" ищется по префиксу в words_dict, остальные шаблоны - через k-граммный индекс
+        # если подходящих термов нет (или нет k-граммного индекса), шаблон остается термом, которого нет в индексе
+        self.root = self.expand_node(self.root, words_dict, limit, kgram_index)
+
+    def expand_node(self, node, words_dict, limit, kgram_index):
+        if node is None:
+            return None
+        if not node.token.is_wildcard():
+            node.left = self.expand_node(node.left, words_dict, limit, kgram_index)
+            node.right = self.expand_node(node.right, words_dict, limit, kgram_index)
+            return node
+
+        if node.token.is_prefix():
+            items = words_dict.prefix_items(node.token.value[:-1], limit)
+        elif kgram_index is not None:
+            items = kgram_index.wildcard_items(node.token.value, limit)
+        else:
+            items = []
+        terms = [term for term, key in items]
+        logger.info(msg="expand_wildcards: {} -> {}".format(node.token.value, str(terms)))
+        if len(terms) == 0:
+            return node
+
+        res = TreeNode(Token(TokenType.TERM, terms[0]))
+        for term in terms[1:]:
+            or_node = TreeNode(Token(TokenType.OR))
+            or_node.left = res
+            or_node.right = TreeNode(Token(TokenType.TERM, term))
+            res = or_node
+        return res
+
+    def build_plan(self):
+        return None if self.root is None else PlanNode.from_tree(self.root)
+
+    def execute(self, value_map, docs_count=0):
+        # выполнение запроса по плану (см. PlanNode); результат тот же, что у left_right_root_execute
+        plan = self.build_plan()
+        if plan is None:
+            return []
+        logger.info(msg="execute: plan={}".format(repr(plan)))
+        return plan.execute(value_map, docs_count)
+
+    def stream(self, value_map, docs_count=0):
+        # выполнение запроса по одному документу за раз: генератор doc_id в порядке возрастания
+        plan = self.build_plan()
+        if plan is None:
+            return
+        logger.info(msg="stream: plan={}".format(repr(plan)))
+        for doc in PlanNode.stream_cursor(plan.cursor(value_map, docs_count)):
+            yield doc
 
     def left_root_right_print(self):
         return '' if self.root is None else self.root.left_root_right_print()
 
-    def left_right_root_execute(self, value_map):
-        return [] if self.root is None else self.root.left_right_root_execute(value_map)
+    def left_right_root_execute(self, value_map, docs_count=0):
+        return [] if self.root is None else self.root.left_right_root_execute(value_map, docs_count)
@@ -3,8 +3,8 @@
 
 import logging
 import sys
-
-from urllib.parse import unquote
+import time
+from itertools import islice
 
 from index.wrapper import Wrapper
 from search_shell.qtree import QueryTree
@@ -20,27 +20,31 @@ class Shell:
     wrapper = None
     main_path = None
     tree = None
+    page_size = None
+    # сколько термов словаря подставлять вместо одного терма-шаблона ("кот*", "*граф*")
+    prefix_limit = 100
 
-    def __init__(self, main_path):
+    def __init__(self, main_path, page_size=None):
+        # page_size - сколько документов показывать; если не задан, ответ считается и выводится целиком
         self.main_path = main_path
+        self.page_size = page_size
 
     def fill_from_index(self, terms):
         res = {}
 
         for term in terms:
-            key = self.wrapper.words_dict.get_key(term)
-            res[term] = [] if key is None else self.wrapper.index.extract_inverted_list(key)
+            res[term] = self.wrapper.postings(term)
         return res
 
-    def decipher_query_results(self, query_result):
-        doc_list = []
+    def doc_urls(self, query_result):
+        # у документов с повторяющимся url нет своего url в docs.dic, такие doc_id пропускаются
         for doc_id in query_result:
-            doc_list.append(self.wrapper.docs_dict.d[doc_id])
-        return doc_list
+            url = self.wrapper.get_doc_url(doc_id)
+            if url is not None:
+                yield url
 
-    @staticmethod
-    def human_readable_url(raw_url):
-        return unquote(raw_url)
+    def decipher_query_results(self, query_result):
+        return list(self.doc_urls(query_result))
 
     def run(self):
         logger.info(msg="Start index shell")
@@ -50,21 +54,35 @@ class Shell:
             input_str = ''.join(elem for elem in input(">> "))
 
             if input_str == "quit":
+                # словоформы запросов, которых не было в кэше лемм, пригодятся следующим запускам
+                self.wrapper.lemmatizer.save()
                 return
 
-            tree = QueryTree(input_str, self.wrapper.lemmatizer)
+            started = time.perf_counter()
+            # сегменты и удаления с момента прошлого запроса видны сразу
+            self.wrapper.refresh()
+            tree = QueryTree(input_str, self.wrapper.lemmatizer, self.wrapper)
+            tree.expand_wildcards(self.wrapper, self.prefix_limit, self.wrapper)
             terms = tree.extract_terms()
             res_map = self.fill_from_index(terms)
-            query_result = tree.left_right_root_execute(res_map)
             if res_map is None:
                 print("Sorry, I cannot execute your query")
+            elif self.page_size is not None:
+                # документы приходят из дерева запроса по одному, поэтому ответ целиком не вычисляется
+                stream = self.doc_urls(self.wrapper.live_docs(tree.stream(res_map, self.wrapper.docs_count())))
+                docs_result = list(islice(stream, self.page_size))
+                print(str(len(docs_result)) + " doc(s) shown" + (", more found" if next(stream, None) is not None else ""))
+                print('\n'.join(docs_result))
             else:
+                query_result = list(self.wrapper.live_docs(tree.execute(res_map, self.wrapper.docs_count())))
                 docs_result = self.decipher_query_results(query_result)
                 print(str(len(docs_result)) + " doc(s) found")
-                print('\n'.join(self.human_readable_url(doc_name) for doc_name in docs_result))
+                print('\n'.join(docs_result))
+            logger.info(msg="Query done in {:.1f} ms. Lemma cache: {}".format(
+                (time.perf_counter() - started) * 1000, self.wrapper.lemmatizer.cache_stats()))
 
 
 if __name__ == '__main__':
     if len(sys.argv) < 2:
         logger.fatal(msg="No input path were given")
-    Shell(sys.argv[1]).run()
+    Shell(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else None).run()
@@ -0,0 +1,55 @@
+#!/usr/bin/python3.4
+# -*- coding: utf-8 -*-
+
+import unittest
+from unittest import TestCase
+
+import json
+import os.path
+
+from index.stats import BuildStats
+from index.stats import StageTimers
+
+
+class BuildStatsTestCase(TestCase):
+    stats_path = "./test_stats.json"
+
+    def tearDown(self):
+        if os.path.exists(self.stats_path):
+            os.remove(self.stats_path)
+
+    def test_stage_timers(self):
+        timers = StageTimers()
+        with timers.timer("parse"):
+            sum(range(1000))
+        with timers.timer("parse"):
+            pass
+        timers.docs = 2
+        timers.tokens = 10
+        timers.cache_hits = 3
+        timers.cache_misses = 1
+        timers.cache_evictions = 2
+        self.assertEqual(["parse"], list(timers.wall.keys()))
+        self.assertTrue(timers.wall["parse"] > 0)
+
+        stats = BuildStats(2)
+        stats.add(timers)
+        stats.add(timers)
+        with stats.timer("save"):
+            pass
+        self.assertEqual(2 * timers.wall["parse"], stats.wall["parse"])
+
+        report = stats.save(self.stats_path, 7)
+        with open(self.stats_path, "r") as in_file:
+            self.assertEqual(report, json.load(in_file))
+        self.assertEqual(4, report["docs"])
+        self.assertEqual(20, report["tokens"])
+        self.assertEqual(7, report["terms"])
+        self.assertEqual(2, report["workers"])
+        self.assertEqual(["parse", "save"], sorted(report["stages"].keys()))
+        self.assertEqual({"hits": 6, "misses": 2, "evictions": 4, "hit_rate": 0.75}, report["lemmatizer_cache"])
+        self.assertTrue(report["peak_memory_kb"]["self"] > 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
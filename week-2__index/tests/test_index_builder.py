@@ -0,0 +1,107 @@
+#!/usr/bin/python3.4
+# -*- coding: utf-8 -*-
+
+import unittest
+from unittest import TestCase
+
+import json
+import os
+import shutil
+
+from index.builder import IndexBuilder
+from index.lemmatizer import LemmaCache
+from index.lemmatizer import TextLemmatizer
+from index.normalizer import TextNormalizer
+from index.wrapper import DocsDictionary
+from index.wrapper import IndexPathWrapper
+from index.wrapper import PostingFile
+from index.wrapper import TermDictionary
+
+
+class IndexBuilderTestCase(TestCase):
+    index_path = "./test_builder"
+    docs = [
+        ("http://a/1", "Москва - столица России, город федерального значения."),
+        ("http://a/2", "В Москве 12 500 000 жителей; столица растет."),
+        ("http://a/3", "Кот и пес. Коты, псы и кошки!"),
+        ("http://a/4", "Яблоки и груши: яблоками кормят котов."),
+        ("http://a/5", "apple grapes lemon, apples."),
+        ("http://a/6", "Город-герой Москва."),
+        ("http://a/7", "пес пес пес"),
+        ("http://a/8", "Столицы России и федеральные города."),
+        ("http://a/9", "lemon ginger 1 000"),
+        ("http://a/10", "Груши, сливы и кошки.")
+    ]
+
+    def setUp(self):
+        os.makedirs(self.index_path)
+        with open(IndexPathWrapper(self.index_path).get_raw_docs_path(), "w") as out_file:
+            for url, content in self.docs:
+                out_file.write(json.dumps({"url": url, "content": content}) + "\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.index_path)
+
+    def sequential_index(self):
+        # построение в один проход по документам: id термов в порядке первого появления
+        lemmatizer = TextLemmatizer()
+        terms = {}
+        postings = {}
+        for doc_id, (url, content) in enumerate(self.docs, 1):
+            for word in TextNormalizer.normalize(content):
+                lemma = lemmatizer.lemmatize(word)
+                term_id = terms.setdefault(lemma, len(terms) + 1)
+                if postings.setdefault(term_id, [])[-1:] != [doc_id]:
+                    postings[term_id].append(doc_id)
+        return terms, postings
+
+    def read_index(self):
+        ipw = IndexPathWrapper(self.index_path)
+        files = {}
+        for path in [ipw.get_words_dict_path(), ipw.get_docs_dict_path(), ipw.get_index_path(),
+                     ipw.get_kgrams_dict_path(), ipw.get_kgrams_index_path(), ipw.get_forms_dict_path()]:
+            with open(path, "rb") as bin_file:
+                files[path] = bin_file.read()
+        return files
+
+    def test_chunks_and_workers(self):
+        terms, postings = self.sequential_index()
+
+        ipw = IndexPathWrapper(self.index_path)
+        reference = None
+        for chunk_size, workers in [(256, 1), (1, 1), (3, 1), (1, 2), (3, 2), (4, 3)]:
+            builder = IndexBuilder(self.index_path)
+            builder.chunk_size = chunk_size
+            builder.build_index(workers)
+            self.assertEqual(len(self.docs), builder.docs_cnt)
+
+            if reference is None:
+                term_dictionary = TermDictionary(ipw.get_words_dict_path())
+                self.assertEqual(terms, dict(term_dictionary.items()))
+                term_dictionary.close()
+                posting_file = PostingFile(ipw.get_index_path())
+                self.assertEqual(postings, dict((term_id, posting_file.postings(term_id)) for term_id in postings))
+                posting_file.close()
+                docs_dictionary = DocsDictionary(ipw.get_docs_dict_path())
+                self.assertEqual([url for url, content in self.docs],
+                                 [docs_dictionary.get_elem(doc_id) for doc_id in range(1, len(self.docs) + 1)])
+                docs_dictionary.close()
+                reference = self.read_index()
+            else:
+                # файлы индекса побайтно совпадают при любом разбиении на куски и любом числе процессов
+                self.assertEqual(reference, self.read_index(), (chunk_size, workers))
+
+        # при маленьком бюджете памяти списки, словоформы и новые словоформы кэша лемм сбрасываются на диск,
+        # а файлы индекса остаются теми же; прогоны после построения удаляются
+        for chunk_size, workers, memory_budget in [(1, 1, 1), (3, 2, 1), (2, 1, 1000)]:
+            os.remove(ipw.get_lemma_cache_path())
+            builder = IndexBuilder(self.index_path, memory_budget)
+            builder.chunk_size = chunk_size
+            builder.build_index(workers)
+            self.assertEqual(reference, self.read_index(), (chunk_size, workers, memory_budget))
+            self.assertEqual([], [name for name in os.listdir(self.index_path) if name.endswith((".run", ".forms"))])
+            self.assertEqual("кошка", LemmaCache(ipw.get_lemma_cache_path()).get("кошки"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,16 +5,25 @@ import unittest
 from unittest import TestCase
 
 from index.wrapper import Dictionary
+from index.wrapper import DocsDictionary
+from index.wrapper import FormsDictionary
+from index.wrapper import KGramIndex
+from index.wrapper import SpimiForms
+from index.wrapper import TermDictionary
 
 import os.path
 
 
 class IndexDictionariesTestCase(TestCase):
     dictionary_path = "./test.dict"
+    kgrams_dict_path = "./test.kgd"
+    kgrams_index_path = "./test.kgi"
+    forms_dict_path = "./test.fdc"
 
     def tearDown(self):
-        if os.path.exists(self.dictionary_path):
-            os.remove(self.dictionary_path)
+        for path in [self.dictionary_path, self.kgrams_dict_path, self.kgrams_index_path, self.forms_dict_path]:
+            if os.path.exists(path):
+                os.remove(path)
 
     def test_dict_rw(self):
         dictionary = Dictionary()
@@ -76,6 +85,22 @@ class IndexDictionariesTestCase(TestCase):
         self.assertTrue("bazingaaaaaaa" in dictionary.d)
         self.assertEqual(4, dictionary.d["bazingaaaaaaa"])
 
+    def test_dict_auto_keys(self):
+        dictionary = Dictionary(True)
+        self.assertEqual(1, dictionary.add_elem("a"))
+        self.assertEqual(2, dictionary.add_elem("b"))
+        self.assertEqual(1, dictionary.add_elem("a"))
+        self.assertEqual(10, dictionary.add_elem("c", 10))
+        self.assertEqual(11, dictionary.add_elem("d"))
+        self.assertEqual(3, dictionary.add_elem("e", 2))
+
+        self.assertEqual(5, dictionary.dictionary_size)
+        self.assertEqual("b", dictionary.get_elem(2))
+        self.assertEqual("e", dictionary.get_elem(3))
+        self.assertEqual("d", dictionary.get_elem(11))
+        self.assertEqual(None, dictionary.get_elem(5))
+        self.assertEqual(None, dictionary.get_elem(100))
+
     def test_dict_cyrillic(self):
         dictionary = Dictionary()
         dictionary.add_elem(u"яблоко", 1)
@@ -98,6 +123,153 @@ class IndexDictionariesTestCase(TestCase):
         self.assertTrue(u"груша" in another_dictionary.d)
         self.assertTrue(u"123" in another_dictionary.d)
 
+    def test_dict_prefix(self):
+        dictionary = Dictionary()
+        for i, word in enumerate([u"яблоко", u"яблоня", u"груша", "ab", "a", "abc", "b"]):
+            dictionary.add_elem(word, i + 1)
+
+        self.assertEqual([(u"яблоко", 1), (u"яблоня", 2)], dictionary.prefix_items(u"ябл"))
+        self.assertEqual([("a", 5), ("ab", 4), ("abc", 6)], dictionary.prefix_items("a"))
+        self.assertEqual([("a", 5), ("ab", 4)], dictionary.prefix_items("a", 2))
+        self.assertEqual([], dictionary.prefix_items("c"))
+
+        dictionary.add_elem("abd", 8)
+        self.assertEqual([("abc", 6), ("abd", 8)], dictionary.prefix_items("abc") + dictionary.prefix_items("abd"))
+
+    def test_term_dict(self):
+        words = [u"яблоко", u"яблоня", u"яблочный", u"груша", u"груз", "a", "ab", "abc", "b"] + \
+            ["term%03d" % i for i in range(100)]
+        d = {}
+        for i, word in enumerate(words):
+            d[word] = i + 1
+
+        TermDictionary.write(self.dictionary_path, d)
+        self.assertTrue(TermDictionary.has_header(self.dictionary_path))
+
+        term_dictionary = TermDictionary(self.dictionary_path)
+        self.assertEqual(len(words), term_dictionary.dictionary_size)
+        for word, key in d.items():
+            self.assertEqual(key, term_dictionary.get_key(word))
+        for word in ["", "0", "aa", u"яблок", u"яблоки", "term100", "zzz", u"я"]:
+            self.assertEqual(None, term_dictionary.get_key(word))
+
+        self.assertEqual(sorted(d.items(), key=lambda item: item[0].encode('utf-8')), list(term_dictionary.items()))
+
+        self.assertEqual([(u"яблоко", 1), (u"яблоня", 2), (u"яблочный", 3)], term_dictionary.prefix_items(u"ябл"))
+        self.assertEqual([(u"яблоко", 1), (u"яблоня", 2)], term_dictionary.prefix_items(u"ябл", 2))
+        self.assertEqual(["term0%d%d" % (i // 10, i % 10) for i in range(100)],
+                         [term for term, key in term_dictionary.prefix_items("term")])
+        self.assertEqual([("a", 6), ("ab", 7), ("abc", 8)], term_dictionary.prefix_items("a"))
+        self.assertEqual([], term_dictionary.prefix_items("c"))
+        self.assertEqual(len(words), len(term_dictionary.prefix_items("")))
+        term_dictionary.close()
+
+    def test_kgram_index(self):
+        words = [u"граф", u"графика", u"фотограф", u"телеграфный", u"фабрика", u"фишка", u"фка", u"грант"] + \
+            ["term%03d" % i for i in range(100)]
+        d = {}
+        for i, word in enumerate(words):
+            d[word] = i + 1
+
+        self.assertEqual({"$гр", "гра", "раф", "аф$"}, KGramIndex.term_grams(u"граф"))
+        self.assertEqual({"ка$"}, KGramIndex.pattern_grams(u"ф*ка"))
+        self.assertEqual({"гра", "раф"}, KGramIndex.pattern_grams(u"*граф*"))
+
+        TermDictionary.write(self.dictionary_path, d)
+        KGramIndex.write(self.kgrams_dict_path, self.kgrams_index_path, d)
+        term_dictionary = TermDictionary(self.dictionary_path)
+        self.assertEqual(("term000", 9), term_dictionary.item_at(0))
+        self.assertEqual((u"фотограф", 3), term_dictionary.item_at(len(words) - 1))
+
+        kgram_index = KGramIndex(self.kgrams_dict_path, self.kgrams_index_path, term_dictionary)
+        self.assertEqual([(u"граф", 1), (u"графика", 2), (u"телеграфный", 4), (u"фотограф", 3)],
+                         kgram_index.wildcard_items(u"*граф*"))
+        self.assertEqual([(u"фабрика", 5), (u"фишка", 6), (u"фка", 7)], kgram_index.wildcard_items(u"ф*ка"))
+        self.assertEqual([(u"граф", 1), (u"фотограф", 3)], kgram_index.wildcard_items(u"*граф"))
+        self.assertEqual([(u"граф", 1)], kgram_index.wildcard_items(u"*граф*", 1))
+        self.assertEqual([], kgram_index.wildcard_items(u"*ёж*"))
+        self.assertEqual([("term007", 16), ("term017", 26)], kgram_index.wildcard_items("t*m0*7", 2))
+        self.assertEqual(len(words), len(kgram_index.wildcard_items("*")))
+        self.assertEqual(5, len(kgram_index.wildcard_items("**", 5)))
+        # куски короче k: перебираются только термы с префиксом "ф" или "t", шаблон без префикса не выполняется
+        self.assertEqual(set(), KGramIndex.pattern_grams(u"ф*а"))
+        self.assertEqual([(u"фабрика", 5), (u"фишка", 6), (u"фка", 7)], kgram_index.wildcard_items(u"ф*а"))
+        self.assertEqual([(u"фишка", 6)], kgram_index.wildcard_items(u"ф*ш*"))
+        self.assertEqual([("term001", 10), ("term011", 20)], kgram_index.wildcard_items("t*1", 2))
+        self.assertEqual([], kgram_index.wildcard_items(u"*ш*"))
+        self.assertEqual([], kgram_index.wildcard_items(u"*a"))
+        kgram_index.close()
+        term_dictionary.close()
+
+    def test_forms_dict(self):
+        d = {u"кот": 7, u"пес": 3, u"яблоко": 12}
+        forms = {u"кот": u"кот", u"котами": u"кот", u"коты": u"кот", u"псы": u"пес", u"яблоками": u"яблоко",
+                 u"грушами": u"груша"}
+        TermDictionary.write(self.dictionary_path, d)
+        FormsDictionary.write(self.forms_dict_path, forms, d)
+        self.assertFalse(FormsDictionary.exists(self.dictionary_path + ".missing"))
+        self.assertTrue(FormsDictionary.exists(self.forms_dict_path))
+
+        term_dictionary = TermDictionary(self.dictionary_path)
+        forms_dictionary = FormsDictionary(self.forms_dict_path, term_dictionary)
+        self.assertEqual(u"кот", forms_dictionary.term(u"котами"))
+        self.assertEqual(u"пес", forms_dictionary.term(u"псы"))
+        self.assertEqual(u"яблоко", forms_dictionary.term(u"яблоками"))
+        # терма "груша" нет в словаре, поэтому его словоформы не сохраняются
+        self.assertIsNone(forms_dictionary.term(u"грушами"))
+        self.assertIsNone(forms_dictionary.term(u"кошками"))
+        self.assertEqual(sorted((form, term) for form, term in forms.items() if term in d),
+                         list(forms_dictionary.items()))
+        forms_dictionary.close()
+        term_dictionary.close()
+
+    def test_spimi_forms(self):
+        d = dict((u"терм%03d" % i, i + 1) for i in range(40))
+        forms = dict((u"форма%03d" % i, u"терм%03d" % (i % 50)) for i in range(100))
+        TermDictionary.write(self.dictionary_path, d)
+
+        # словоформы приходят кусками и сбрасываются прогонами, повторы между прогонами пропускаются
+        spimi_forms = SpimiForms(".")
+        items = sorted(forms.items(), reverse=True)
+        for start in range(0, len(items), 30):
+            spimi_forms.update(dict(items[start:start + 40]))
+            self.assertEqual(len(items[start:start + 40]) * SpimiForms.pair_size, spimi_forms.memory_used)
+            spimi_forms.flush_run()
+            self.assertEqual(0, spimi_forms.memory_used)
+        spimi_forms.update({u"форма000": u"терм000", u"форма100": u"терм001"})
+        forms[u"форма100"] = u"терм001"
+        self.assertEqual(4, len(spimi_forms.runs))
+        self.assertEqual(sorted(forms.items()), list(spimi_forms.items()))
+
+        # forms.dic из прогонов побайтно совпадает с forms.dic из словаря в памяти
+        FormsDictionary.write(self.forms_dict_path, spimi_forms, d)
+        with open(self.forms_dict_path, "rb") as bin_file:
+            spilled = bin_file.read()
+        FormsDictionary.write(self.forms_dict_path, forms, d)
+        with open(self.forms_dict_path, "rb") as bin_file:
+            self.assertEqual(bin_file.read(), spilled)
+
+        runs = spimi_forms.runs
+        spimi_forms.close()
+        self.assertFalse(any(os.path.exists(run) for run in runs))
+
+    def test_docs_dict(self):
+        d = {"https://ru.wikipedia.org/wiki/%D0%9C%D0%BE%D1%81%D0%BA%D0%B2%D0%B0": 1,
+             "https://ru.wikipedia.org/wiki/%D0%A0%D0%B8%D0%BC": 2,
+             "http://example.com/a%20b": 4}
+        DocsDictionary.write(self.dictionary_path, d)
+        self.assertTrue(DocsDictionary.has_header(self.dictionary_path))
+
+        docs_dictionary = DocsDictionary(self.dictionary_path)
+        self.assertEqual(3, docs_dictionary.dictionary_size)
+        self.assertEqual(u"https://ru.wikipedia.org/wiki/Москва", docs_dictionary.get_elem(1))
+        self.assertEqual(u"https://ru.wikipedia.org/wiki/Рим", docs_dictionary.get_elem(2))
+        self.assertEqual("http://example.com/a b", docs_dictionary.get_elem(4))
+        self.assertIsNone(docs_dictionary.get_elem(3))
+        self.assertIsNone(docs_dictionary.get_elem(0))
+        self.assertIsNone(docs_dictionary.get_elem(5))
+        docs_dictionary.close()
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -7,6 +7,7 @@ from search_shell.qtree import TokenType
 from search_shell.qtree import QueryTree
 
 from index.lemmatizer import TextLemmatizer
+from index.wrapper import Dictionary
 
 
 class QTreeTestCase(TestCase):
@@ -156,6 +157,184 @@ class QTreeTestCase(TestCase):
                 "ginger": [3, 4, 5, 7, 8]
              }), [1, 2, 3, 6, 7, 8])
 
+    def test_tree_execution_skewed_lists(self):
+        qt = QueryTree("apple AND grapes", self.lemmatizer)
+        self.assertEqual(qt.left_right_root_execute(
+            {
+                "apple": [5, 500, 999, 1001],
+                "grapes": list(range(1, 1000, 2))
+            }), [5, 999])
+
+    def test_tree_execution_keeps_order(self):
+        qt = QueryTree("(apple OR grapes) AND (lemon OR ginger)", self.lemmatizer)
+        self.assertEqual(qt.left_right_root_execute(
+            {
+                "apple": [2, 40, 70],
+                "grapes": [1, 3, 40, 45, 90],
+                "lemon": [3, 45, 1000],
+                "ginger": [1, 2, 70, 71]
+            }), [1, 2, 3, 45, 70])
+
+    def test_plan_flattening(self):
+        qt = QueryTree("meat OR (apple AND grapes AND (lemon OR ginger OR (pear OR plum)))", self.lemmatizer)
+        self.assertEqual("OR(meat, AND(apple, grapes, OR(lemon, ginger, pear, plum)))", repr(qt.build_plan()))
+        self.assertEqual(None, QueryTree("", self.lemmatizer).build_plan())
+
+    def test_plan_execution(self):
+        value_map = {
+            "meat": [1, 6, 7],
+            "apple": [2, 3, 4, 7, 8],
+            "grapes": [2, 3, 5, 6, 7, 8],
+            "lemon": [2, 3, 5, 7, 8],
+            "ginger": [3, 4, 5, 7, 8]
+        }
+        for query in ["meat OR (apple AND grapes AND (lemon OR ginger))",
+                      "apple AND grapes AND meat",
+                      "(apple OR meat) AND (lemon OR meat)",
+                      "meat",
+                      "banana"]:
+            qt = QueryTree(query, self.lemmatizer)
+            self.assertEqual(qt.left_right_root_execute(value_map), qt.execute(value_map))
+
+    def test_stream_execution(self):
+        value_map = {
+            "meat": [1, 6, 7],
+            "apple": [2, 3, 4, 7, 8],
+            "grapes": [2, 3, 5, 6, 7, 8],
+            "lemon": [2, 3, 5, 7, 8],
+            "ginger": [3, 4, 5, 7, 8],
+            "pear": list(range(1, 1000))
+        }
+        for query in ["meat OR (apple AND grapes AND (lemon OR ginger))",
+                      "apple AND grapes AND meat",
+                      "(apple OR meat) AND (lemon OR meat) AND pear",
+                      "pear AND (ginger OR meat)",
+                      "meat",
+                      "banana",
+                      "banana OR meat",
+                      ""]:
+            qt = QueryTree(query, self.lemmatizer)
+            self.assertEqual(qt.execute(value_map), list(qt.stream(value_map)))
+
+    def test_stream_is_lazy(self):
+        qt = QueryTree("apple OR grapes", self.lemmatizer)
+        stream = qt.stream({"apple": range(1, 10 ** 9, 2), "grapes": range(2, 10 ** 9, 2)})
+        self.assertEqual([1, 2, 3, 4, 5], [next(stream) for i in range(5)])
+
+    def test_not_tokenizer(self):
+        tkzr = Tokenizer("meat AND NOT (apple OR !grapes)", self.lemmatizer)
+        tkzr.tokenize()
+        self.assertEqual(tkzr.tokens, [Token(TokenType.TERM, 'meat'),
+                                       Token(TokenType.AND, None),
+                                       Token(TokenType.NOT, None),
+                                       Token(TokenType.LEFT_BR, None),
+                                       Token(TokenType.TERM, 'apple'),
+                                       Token(TokenType.OR, None),
+                                       Token(TokenType.NOT, None),
+                                       Token(TokenType.TERM, 'grapes'),
+                                       Token(TokenType.RIGHT_BR, None)])
+        tkzr.postfix()
+        self.assertEqual(tkzr.tokens, [Token(TokenType.TERM, 'meat'),
+                                       Token(TokenType.TERM, 'apple'),
+                                       Token(TokenType.TERM, 'grapes'),
+                                       Token(TokenType.NOT, None),
+                                       Token(TokenType.OR, None),
+                                       Token(TokenType.NOT, None),
+                                       Token(TokenType.AND, None)])
+
+    def test_not_execution(self):
+        value_map = {
+            "meat": [1, 6, 7],
+            "apple": [2, 3, 4, 7, 8],
+            "grapes": [2, 3, 5, 6, 7, 8],
+            "lemon": [2, 3, 5, 7, 8],
+            "ginger": [3, 4, 5, 7, 8]
+        }
+        expected = {
+            "apple AND NOT grapes": [4],
+            "NOT grapes AND apple": [4],
+            "NOT meat": [2, 3, 4, 5, 8, 9],
+            "NOT NOT meat": [1, 6, 7],
+            "NOT meat AND NOT apple": [5, 9],
+            "meat OR NOT (apple AND grapes AND (lemon OR ginger))": [1, 4, 5, 6, 7, 9],
+            "grapes AND NOT (meat OR lemon)": [],
+            "grapes AND NOT banana": [2, 3, 5, 6, 7, 8],
+            "banana AND NOT grapes": [],
+            # оценка OR завышена (сумма), поэтому NOT от нее не может считаться пустым
+            "grapes AND ((NOT (apple OR lemon)) OR zzz)": [6]
+        }
+        for query, docs in expected.items():
+            qt = QueryTree(query, self.lemmatizer)
+            self.assertEqual(docs, qt.left_right_root_execute(value_map, 9), query)
+            self.assertEqual(docs, qt.execute(value_map, 9), query)
+            self.assertEqual(docs, list(qt.stream(value_map, 9)), query)
+
+    def test_not_estimate(self):
+        value_map = {"a": [1, 2], "b": [1, 2], "c": [1, 2, 3, 4]}
+        qt = QueryTree("c AND ((NOT (a OR b)) OR zzz)", self.lemmatizer)
+        self.assertEqual([3, 4], qt.left_right_root_execute(value_map, 4))
+        self.assertEqual([3, 4], qt.execute(value_map, 4))
+        self.assertEqual([3, 4], list(qt.stream(value_map, 4)))
+
+    def test_prefix_expansion(self):
+        words_dict = Dictionary()
+        for i, word in enumerate(["apple", "applet", "apricot", "grapes", "grapefruit", "lemon"]):
+            words_dict.add_elem(word, i + 1)
+        value_map = {
+            "apple": [1, 4],
+            "applet": [2],
+            "apricot": [3, 4],
+            "grapes": [2, 5],
+            "grapefruit": [4, 6],
+            "lemon": [1, 2, 3]
+        }
+
+        qt = QueryTree("AP* AND NOT grape*", self.lemmatizer)
+        qt.expand_wildcards(words_dict)
+        self.assertEqual(["apple", "applet", "apricot", "grapefruit", "grapes"], qt.extract_terms())
+        self.assertEqual("AND(OR(apple, applet, apricot), NOT(OR(grapefruit, grapes)))", repr(qt.build_plan()))
+        self.assertEqual([1, 3], qt.execute(value_map, 6))
+        self.assertEqual([1, 3], list(qt.stream(value_map, 6)))
+
+        qt = QueryTree("app* AND lemon", self.lemmatizer)
+        qt.expand_wildcards(words_dict, 1)
+        self.assertEqual(["apple", "lemon"], qt.extract_terms())
+        self.assertEqual([1], qt.execute(value_map))
+
+        qt = QueryTree("*ppl* OR lemon", self.lemmatizer)
+        qt.expand_wildcards(words_dict)
+        self.assertEqual(["*ppl*", "lemon"], qt.extract_terms())
+
+        qt = QueryTree("banan* OR lemon", self.lemmatizer)
+        qt.expand_wildcards(words_dict)
+        self.assertEqual(["banan*", "lemon"], qt.extract_terms())
+        self.assertEqual([1, 2, 3], qt.execute(value_map))
+
+    def test_forms_tokenizer(self):
+        class Forms:
+            def form_term(self, form):
+                return {"apples": "apple", "grapes": "grape"}.get(form)
+
+        class NoLemmatizer:
+            def lemmatize(self, word):
+                raise AssertionError("'{}' must be found in forms".format(word))
+
+        tkzr = Tokenizer("Apples AND grapes AND app*", NoLemmatizer(), Forms())
+        tkzr.tokenize()
+        self.assertEqual(["apple", "grape", "app*"], [token.value for token in tkzr.tokens if token.is_term()])
+
+        # словоформы не из документов индекса лемматизируются как обычно
+        qt = QueryTree("lemons OR grapes", self.lemmatizer, Forms())
+        self.assertEqual(["lemons", "grape"], qt.extract_terms())
+
+    def test_plan_short_circuit(self):
+        class Exploding(list):
+            def __iter__(self):
+                raise AssertionError("list must not be read")
+
+        qt = QueryTree("apple AND grapes AND banana", self.lemmatizer)
+        self.assertEqual([], qt.execute({"apple": Exploding([1, 2]), "grapes": Exploding([1, 2, 3])}))
+
     def test_qtree_1(self):
         qt = QueryTree("", self.lemmatizer)
         self.assertEqual(qt.left_right_root_execute(
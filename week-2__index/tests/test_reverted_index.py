@@ -4,10 +4,26 @@
 import unittest
 from unittest import TestCase
 
+from struct import Struct
+
+from index.wrapper import CsrRevertIndex
+from index.wrapper import ListCursor
+from index.wrapper import PostingFile
 from index.wrapper import RevertIndex
+from index.wrapper import SpimiRevertIndex
+from index.wrapper import VarByteCodec
+
+import os.path
 
 
 class IndexRITestCase(TestCase):
+    index_path = "./test.idx"
+    spimi_index_path = "./test_spimi.idx"
+
+    def tearDown(self):
+        for path in [self.index_path, self.spimi_index_path]:
+            if os.path.exists(path):
+                os.remove(path)
 
     def test_index_basic(self):
         doc_ids = [1, 2, 3, 4, 5, 6]
@@ -57,6 +73,160 @@ class IndexRITestCase(TestCase):
         for word, docs in documents.items():
             self.assertEqual(docs, index.extract_inverted_list(word))
 
+    def test_index_save_load(self):
+        index = RevertIndex()
+
+        documents = {
+            15: [2, 5],
+            27: [1],
+            39: [1, 3, 4],
+            43: [6],
+            53: [4, 5]
+        }
+
+        for word, docs in documents.items():
+            for doc in docs:
+                index.add_pair(word, doc)
+
+        index.save_index(self.index_path)
+
+        loaded_index = RevertIndex()
+        loaded_index.load_index(self.index_path)
+
+        # после загрузки в памяти нет ни одного инвертированного списка
+        self.assertEqual({}, loaded_index.m)
+        for word, docs in documents.items():
+            self.assertEqual(docs, loaded_index.extract_inverted_list(word))
+            for doc in docs:
+                self.assertTrue(loaded_index.value(word, doc))
+        self.assertEqual([], loaded_index.extract_inverted_list(16))
+        self.assertEqual([], loaded_index.extract_inverted_list(100))
+        self.assertFalse(loaded_index.value(15, 3))
+
+    def test_csr_index(self):
+        index = RevertIndex()
+
+        documents = {
+            15: [2, 5],
+            27: [1],
+            39: [1, 3, 4],
+            43: [6],
+            53: [4, 5]
+        }
+
+        for word, docs in documents.items():
+            for doc in docs:
+                index.add_pair(word, doc)
+
+        csr = CsrRevertIndex.from_revert_index(index)
+        for word, docs in documents.items():
+            self.assertEqual(docs, csr.extract_inverted_list(word))
+        self.assertEqual([], csr.extract_inverted_list(16))
+        self.assertTrue(csr.value(39, 3))
+        self.assertFalse(csr.value(39, 2))
+        self.assertFalse(csr.value(40, 1))
+
+        csr.save_index(self.index_path)
+        loaded_csr = CsrRevertIndex()
+        loaded_csr.load_index(self.index_path)
+        for word, docs in documents.items():
+            self.assertEqual(docs, loaded_csr.extract_inverted_list(word))
+        self.assertEqual(9, len(loaded_csr.postings))
+
+    def test_index_cursor(self):
+        index = RevertIndex()
+        frequent = list(range(3, 3000, 3))
+        rare = [7, 9, 1500, 2997, 3001]
+        for doc in frequent:
+            index.add_pair(1, doc)
+        for doc in rare:
+            index.add_pair(2, doc)
+        index.save_index(self.index_path)
+
+        loaded_index = RevertIndex()
+        loaded_index.load_index(self.index_path)
+        self.assertEqual(frequent, loaded_index.extract_inverted_list(1))
+        self.assertEqual(len(frequent), len(loaded_index.extract_postings(1)))
+        self.assertEqual(frequent, list(loaded_index.extract_postings(1)))
+
+        for cursor in [loaded_index.cursor(1), ListCursor(frequent)]:
+            self.assertEqual(3, cursor.doc())
+            self.assertEqual(6, cursor.next())
+            self.assertEqual(6, cursor.advance_to(5))
+            self.assertEqual(9, cursor.advance_to(7))
+            self.assertEqual(1500, cursor.advance_to(1500))
+            self.assertEqual(1503, cursor.advance_to(1501))
+            self.assertEqual(1503, cursor.advance_to(10))
+            self.assertEqual(2997, cursor.advance_to(2996))
+            self.assertEqual(None, cursor.advance_to(2998))
+            self.assertEqual(None, cursor.next())
+
+        cursor = loaded_index.cursor(1)
+        self.assertEqual([9, 1500, 2997], [doc for doc in rare if cursor.advance_to(doc) == doc])
+        self.assertEqual(None, loaded_index.cursor(3).doc())
+
+    def test_index_load_v1(self):
+        PostingFile.write(self.index_path, [(15, [2, 5]), (27, [1])], 1)
+
+        index = RevertIndex()
+        index.load_index(self.index_path)
+
+        self.assertEqual(1, index.reader.version)
+        self.assertEqual([2, 5], index.extract_inverted_list(15))
+        self.assertEqual([1], index.extract_inverted_list(27))
+
+    def test_var_byte_codec(self):
+        numbers = [0, 1, 127, 128, 130, 16383, 16384, 2 ** 32 - 1]
+        data = VarByteCodec.encode(numbers)
+        self.assertEqual(bytes([0x80 | 5]), VarByteCodec.encode([5]))
+        self.assertEqual(bytes([0x01, 0x82]), VarByteCodec.encode([130]))
+        self.assertEqual((numbers, len(data)), VarByteCodec.decode(data, 0, len(numbers)))
+
+        doc_ids = [3, 4, 200, 100500, 100501]
+        self.assertEqual(doc_ids, VarByteCodec.decode_gaps(VarByteCodec.encode_gaps(doc_ids), 0, len(doc_ids)))
+
+    def test_index_load_legacy(self):
+        number_struct = Struct("<I")
+        with open(self.index_path, "wb") as bin_file:
+            bin_file.write(number_struct.pack(2))
+            for term, docs in [(27, [1]), (15, [2, 5])]:
+                bin_file.write(number_struct.pack(term))
+                bin_file.write(number_struct.pack(len(docs)))
+                for doc in docs:
+                    bin_file.write(number_struct.pack(doc))
+
+        index = RevertIndex()
+        index.load_index(self.index_path)
+
+        self.assertEqual([2, 5], index.extract_inverted_list(15))
+        self.assertEqual([1], index.extract_inverted_list(27))
+        self.assertEqual([], index.extract_inverted_list(39))
+
+    def test_spimi_index(self):
+        index = RevertIndex()
+        spimi_index = SpimiRevertIndex(1000, ".")
+        for doc_id in range(1, 200):
+            for term_id in [doc_id % 7 + 1, doc_id % 13 + 20, 100 + doc_id // 50, 500 - doc_id]:
+                index.add_pair(term_id, doc_id)
+                spimi_index.add_pair(term_id, doc_id)
+        self.assertTrue(len(spimi_index.runs) > 2)
+        runs = list(spimi_index.runs)
+
+        index.save_index(self.index_path)
+        spimi_index.save_index(self.spimi_index_path)
+        with open(self.index_path, "rb") as f, open(self.spimi_index_path, "rb") as spimi_f:
+            self.assertEqual(f.read(), spimi_f.read())
+        self.assertFalse(any(os.path.exists(run) for run in runs))
+
+        spimi_index = SpimiRevertIndex(1000000, ".")
+        spimi_index.add_pair(3, 1)
+        spimi_index.save_index(self.spimi_index_path)
+        self.assertEqual([], spimi_index.runs)
+        loaded = RevertIndex()
+        loaded.load_index(self.spimi_index_path)
+        self.assertEqual([1], loaded.extract_inverted_list(3))
+        loaded.reader.close()
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
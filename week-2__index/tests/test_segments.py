@@ -0,0 +1,205 @@
+#!/usr/bin/python3.4
+# -*- coding: utf-8 -*-
+
+import unittest
+from unittest import TestCase
+
+import os
+import shutil
+import threading
+
+from index.deletes import delete_docs
+from index.segments import SegmentManager
+from index.wrapper import DocsDictionary
+from index.wrapper import FormsDictionary
+from index.wrapper import IndexPathWrapper
+from index.wrapper import ChainCursor
+from index.wrapper import KGramIndex
+from index.wrapper import ListCursor
+from index.wrapper import PostingFile
+from index.wrapper import SegmentsManifest
+from index.wrapper import SegmentsPostingList
+from index.wrapper import TermDictionary
+from index.wrapper import Tombstones
+from index.wrapper import Wrapper
+
+
+class SegmentsTestCase(TestCase):
+    index_path = "./test_segments"
+
+    def setUp(self):
+        os.makedirs(self.index_path + "/segments")
+
+    def tearDown(self):
+        shutil.rmtree(self.index_path)
+
+    @staticmethod
+    def write_segment(path, docs):
+        # docs = [(url, [term, ...]), ...], doc_id - номер документа с 1
+        if not os.path.exists(path):
+            os.makedirs(path)
+        ipw = IndexPathWrapper(path)
+        terms = {}
+        postings = {}
+        for doc_id, (url, doc_terms) in enumerate(docs, 1):
+            for term in doc_terms:
+                term_id = terms.setdefault(term, len(terms) + 1)
+                postings.setdefault(term_id, []).append(doc_id)
+        TermDictionary.write(ipw.get_words_dict_path(), terms)
+        KGramIndex.write(ipw.get_kgrams_dict_path(), ipw.get_kgrams_index_path(), terms)
+        # словоформа терма - терм с окончанием "ы"
+        FormsDictionary.write(ipw.get_forms_dict_path(), dict((term + "ы", term) for term in terms), terms)
+        DocsDictionary.write(ipw.get_docs_dict_path(), dict((url, doc_id) for doc_id, (url, t) in enumerate(docs, 1)))
+        PostingFile.write(ipw.get_index_path(), sorted(postings.items()))
+        with open(ipw.get_raw_docs_path(), "w") as out_file:
+            out_file.write("".join(url + "\n" for url, t in docs))
+
+    def add_segment(self, name, docs):
+        ipw = IndexPathWrapper(self.index_path)
+        self.write_segment(ipw.get_segment_path(name), docs)
+        manifest = SegmentsManifest.read(ipw.get_segments_manifest_path())
+        last = manifest["segments"][-1] if len(manifest["segments"]) > 0 else {"base": 0, "docs": 2}
+        manifest["segments"].append({"name": name, "base": last["base"] + last["docs"], "docs": len(docs)})
+        manifest["next_id"] = manifest["next_id"] + 1
+        SegmentsManifest.write(ipw.get_segments_manifest_path(), manifest)
+
+    def test_tiers(self):
+        manager = SegmentManager(self.index_path)
+        self.assertEqual(0, manager.tier(3))
+        self.assertEqual(1, manager.tier(4))
+        self.assertEqual(2, manager.tier(16))
+        segments = [{"docs": 20}, {"docs": 1}, {"docs": 2}, {"docs": 3}, {"docs": 1}, {"docs": 1}]
+        self.assertEqual(segments[1:5], manager.find_merge(segments))
+        self.assertIsNone(manager.find_merge(segments[:4]))
+
+    def test_search_and_merge(self):
+        self.write_segment(self.index_path, [("http://a/1", ["кот", "пес"]), ("http://a/2", ["кот"])])
+        wrapper = Wrapper(self.index_path)
+        self.assertEqual([1, 2], wrapper.postings("кот"))
+        self.assertEqual(2, wrapper.docs_count())
+
+        self.add_segment("seg_000001", [("http://b/1", ["кот", "кит"])])
+        self.add_segment("seg_000002", [("http://c/1", ["пес"]), ("http://c/2", ["кит", "котик"])])
+        self.add_segment("seg_000003", [("http://d/1", ["котик"])])
+        self.add_segment("seg_000004", [("http://e/1", ["пес", "кот"])])
+        self.assertTrue(wrapper.refresh())
+        self.assertFalse(wrapper.refresh())
+        self.assertEqual(7, wrapper.docs_count())
+        self.assertEqual([1, 2, 3, 7], wrapper.postings("кот"))
+        self.assertEqual([3, 5], wrapper.postings("кит"))
+        # списки сегментов не склеиваются: курсор идет по ним с пропусками
+        postings = wrapper.postings("кот")
+        self.assertIsInstance(postings, SegmentsPostingList)
+        self.assertEqual(4, len(postings))
+        cursor = postings.cursor()
+        self.assertEqual(3, cursor.advance_to(3))
+        self.assertEqual(7, cursor.advance_to(4))
+        self.assertIsNone(cursor.next())
+        self.assertEqual([("кот", None), ("котик", None)], wrapper.prefix_items("кот"))
+        self.assertEqual([("кит", None), ("кот", None)], wrapper.wildcard_items("к*т"))
+        self.assertEqual("http://c/2", wrapper.get_doc_url(5))
+        self.assertEqual("котик", wrapper.form_term("котикы"))
+        self.assertIsNone(wrapper.form_term("котики"))
+
+        # уровни при merge_factor = 2: [0, 1, 0, 0] -> [0, 1, 1] -> [0, 2]
+        manager = SegmentManager(self.index_path)
+        manager.merge_factor = 2
+        self.assertEqual(2, manager.merge())
+        manifest = SegmentsManifest.read(IndexPathWrapper(self.index_path).get_segments_manifest_path())
+        self.assertEqual([("seg_000001", 2, 1), ("seg_000006", 3, 4)],
+                         [(segment["name"], segment["base"], segment["docs"]) for segment in manifest["segments"]])
+        self.assertEqual(["seg_000001", "seg_000006"], sorted(os.listdir(self.index_path + "/segments")))
+
+        self.assertTrue(wrapper.refresh())
+        self.assertEqual(3, len(wrapper.segments))
+        self.assertEqual([1, 2, 3, 7], wrapper.postings("кот"))
+        self.assertEqual([1, 4, 7], wrapper.postings("пес"))
+        self.assertEqual([5, 6], wrapper.postings("котик"))
+        self.assertEqual(["кит", "котик", "пес"], [wrapper.form_term(form) for form in ["киты", "котикы", "песы"]])
+        self.assertEqual(["http://a/2", "http://b/1", "http://c/1", "http://e/1"],
+                         [wrapper.get_doc_url(doc_id) for doc_id in [2, 3, 4, 7]])
+
+    def test_tombstones(self):
+        path = IndexPathWrapper(self.index_path).get_deletes_path()
+        tombstones = Tombstones(path)
+        self.assertEqual(0, len(tombstones))
+        self.assertFalse(tombstones.refresh())
+
+        for doc_id in [17, 3, 17, 8]:
+            Tombstones.delete(path, doc_id)
+        self.assertEqual(3, os.path.getsize(path))
+        self.assertTrue(tombstones.refresh())
+        self.assertEqual([3, 8, 17], list(tombstones))
+        self.assertTrue(8 in tombstones)
+        self.assertFalse(9 in tombstones)
+        self.assertFalse(1000 in tombstones)
+        self.assertEqual([1, 9, 20], list(tombstones.filter([1, 3, 8, 9, 17, 20])))
+
+    def test_deletes(self):
+        self.write_segment(self.index_path, [("http://a/1", ["кот", "пес"]), ("http://a/2", ["кот"])])
+        self.add_segment("seg_000001", [("http://b/1", ["кот", "кит"]), ("http://b/2", ["пес"])])
+        self.add_segment("seg_000002", [("http://c/1", ["кот"]), ("http://c/2", ["пес"])])
+        wrapper = Wrapper(self.index_path)
+        self.assertEqual([1, 2, 3, 5], wrapper.postings("кот"))
+
+        delete_docs(self.index_path, [1, 3])
+        self.assertTrue(wrapper.refresh())
+        self.assertEqual([2, 5], list(wrapper.live_docs(wrapper.postings("кот"))))
+        self.assertEqual([4], list(wrapper.live_docs(range(3, 5))))
+
+        # слияние выкидывает удаленные документы физически, doc_id остальных не меняются
+        manager = SegmentManager(self.index_path)
+        manager.merge_factor = 2
+        self.assertEqual(1, manager.merge())
+        wrapper.refresh()
+        self.assertEqual([1, 2, 5], wrapper.postings("кот"))
+        self.assertEqual([], wrapper.postings("кит"))
+        self.assertEqual([1, 4, 6], wrapper.postings("пес"))
+        self.assertEqual([None, "http://b/2", "http://c/1"], [wrapper.get_doc_url(doc_id) for doc_id in [3, 4, 5]])
+
+    def test_chain_cursor(self):
+        # сегменты с base 0, 3, 5 и 9; список третьего сегмента пуст
+        cursor = ChainCursor([(0, ListCursor([1, 3])), (3, ListCursor([2])), (5, ListCursor([])), (9, ListCursor([1, 4]))])
+        docs = [cursor.doc()]
+        while docs[-1] is not None:
+            docs.append(cursor.next())
+        self.assertEqual([1, 3, 5, 10, 13, None], docs)
+
+        cursor = ChainCursor([(0, ListCursor([1, 3])), (3, ListCursor([2])), (5, ListCursor([])), (9, ListCursor([1, 4]))])
+        self.assertEqual(1, cursor.advance_to(0))
+        self.assertEqual(5, cursor.advance_to(4))
+        self.assertEqual(5, cursor.advance_to(5))
+        self.assertEqual(10, cursor.advance_to(6))
+        self.assertEqual(13, cursor.next())
+        self.assertIsNone(cursor.advance_to(14))
+        self.assertIsNone(cursor.next())
+
+        postings = SegmentsPostingList([(0, [2]), (2, []), (4, [1, 3])])
+        self.assertEqual([2, 5, 7], list(postings))
+        self.assertEqual(3, len(postings))
+        self.assertEqual(5, postings.cursor().advance_to(3))
+
+    def test_background_merge(self):
+        self.write_segment(self.index_path, [("http://a/1", ["кот"]), ("http://a/2", ["пес"])])
+        self.add_segment("seg_000001", [("http://b/1", ["кот"])])
+        self.add_segment("seg_000002", [("http://c/1", ["пес"])])
+        manager = SegmentManager(self.index_path)
+        manager.merge_factor = 2
+        thread = manager.merge_in_background()
+        # слияние идет в своем потоке; wait_merges дожидается его, и сливать больше нечего
+        self.assertIsNot(threading.current_thread(), thread)
+        self.assertEqual(0, manager.wait_merges())
+        self.assertFalse(thread.is_alive())
+        manifest = SegmentsManifest.read(IndexPathWrapper(self.index_path).get_segments_manifest_path())
+        self.assertEqual([("seg_000003", 2, 2)],
+                         [(segment["name"], segment["base"], segment["docs"]) for segment in manifest["segments"]])
+
+        self.add_segment("seg_000004", [("http://d/1", ["кот"])])
+        self.add_segment("seg_000005", [("http://e/1", ["кот"])])
+        # сегменты, добавленные после фонового слияния, сливает сам wait_merges: [1, 0, 0] -> [1, 1] -> [2]
+        self.assertEqual(2, manager.wait_merges())
+        self.assertEqual([1, 3, 5, 6], Wrapper(self.index_path).postings("кот"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+#!/usr/bin/python3.4
+# -*- coding: utf-8 -*-
+
+import unittest
+from unittest import TestCase
+
+import json
+import os
+import shutil
+
+from index.builder import IndexBuilder
+from index.wrapper import IndexPathWrapper
+from index.wrapper import Wrapper
+from search_shell.qtree import QueryTree
+from search_shell.shell import Shell
+
+
+class ShellTestCase(TestCase):
+    index_path = "./test_shell_index"
+
+    def setUp(self):
+        # документ 3 повторяет url документа 1, своего url в docs.dic у него нет
+        os.makedirs(self.index_path)
+        with open(IndexPathWrapper(self.index_path).get_raw_docs_path(), "w") as out_file:
+            for url, content in [("http://a/1", "apple"), ("http://a/2", "apple"),
+                                 ("http://a/1", "lemon"), ("http://a/4", "lemon")]:
+                out_file.write(json.dumps({"url": url, "content": content}) + "\n")
+        IndexBuilder(self.index_path).build_index()
+
+    def tearDown(self):
+        shutil.rmtree(self.index_path)
+
+    def run_query(self, shell, query, page_size=None):
+        tree = QueryTree(query, shell.wrapper.lemmatizer, shell.wrapper)
+        res_map = shell.fill_from_index(tree.extract_terms())
+        if page_size is None:
+            return shell.decipher_query_results(tree.execute(res_map, shell.wrapper.docs_count()))
+        stream = shell.doc_urls(tree.stream(res_map, shell.wrapper.docs_count()))
+        return list(next(stream) for i in range(page_size))
+
+    def test_duplicate_urls(self):
+        shell = Shell(self.index_path)
+        shell.wrapper = Wrapper(self.index_path)
+        self.assertIsNone(shell.wrapper.get_doc_url(3))
+
+        self.assertEqual(["http://a/4"], self.run_query(shell, "lemon"))
+        self.assertEqual(["http://a/4"], self.run_query(shell, "NOT apple"))
+        self.assertEqual(["http://a/1", "http://a/2", "http://a/4"], self.run_query(shell, "apple OR lemon"))
+        # страница набирается из документов с url, пропущенный doc_id места в ней не занимает
+        self.assertEqual(["http://a/1", "http://a/2", "http://a/4"], self.run_query(shell, "apple OR lemon", 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
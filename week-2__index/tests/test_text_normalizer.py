@@ -11,6 +11,16 @@ class TextNormalizerTestCase(TestCase):
         self.assertEqual("a b 22 c d 13 e", nrmlz.join_numbers("a b 2 2 c d 1  3 e"))
         self.assertEqual("a b c d 1-3 e", nrmlz.join_numbers("a b c d 1-3 e"))
 
+    def test_normalize(self):
+        text = "«Ёлка», 10 000 руб.!  Цена:1 2-3 (США)\tИ т.д."
+        chain = TextNormalizer.join_numbers(text)
+        chain = TextNormalizer.clean_out_punct(chain)
+        chain = TextNormalizer.lower_case(chain)
+        words = TextNormalizer.split(chain)
+        self.assertEqual(["ёлка", "10000", "руб", "цена", "12", "3", "сша", "и", "т", "д"], words)
+        self.assertEqual(words, TextNormalizer.normalize(text))
+        self.assertEqual([words, [], ["a", "b"]], list(TextNormalizer.normalize_many([text, " ... ", "A.B"])))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,14 +1,19 @@
 #!/usr/bin/python3.4
 # -*- coding: utf-8 -*-
 
+import argparse
 import json
 import logging
-import sys
 from index.wrapper import Dictionary
+from index.wrapper import DocsDictionary
 from index.wrapper import IndexPathWrapper
 from index.wrapper import RevertIndex
+from index.wrapper import SpimiForms
+from index.wrapper import SpimiRevertIndex
+from index.wrapper import Tombstones
 from index.normalizer import TextNormalizer
 from index.lemmatizer import TextLemmatizer
+from index.stats import BuildStats
 
 logging.basicConfig(
     format='%(levelname)s %(asctime)s : %(message)s',
@@ -22,62 +27,116 @@ class IndexBuilder:
     docs_dict = None
     words_dict = None
     index = None
-
-    def __init__(self, path):
+    deleted = None
+    memory_budget = None
+    stats = None
+
+    def __init__(self, path, memory_budget=None):
+        # memory_budget - сколько байт можно занять списками позиций, словоформами для forms.dic
+        # и новыми для кэша лемм словоформами, прежде чем сбросить их на диск (см. check_memory);
+        # если не задан, индекс целиком строится в памяти
         self.ipw = IndexPathWrapper(path)
+        self.memory_budget = memory_budget
         self.docs_dict = Dictionary(True)
         self.words_dict = Dictionary(True)
-        self.index = RevertIndex()
-        self.lemmatizer = TextLemmatizer()
+        if memory_budget is None:
+            self.index = RevertIndex()
+        else:
+            self.index = SpimiRevertIndex(memory_budget, self.ipw.main_path)
+        # удаленные документы (deletes.bm) при перестройке в индекс не попадают, их doc_id остаются незанятыми
+        self.deleted = Tombstones(self.ipw.get_deletes_path())
+        # известные словоформы берутся из кэша лемм на диске (lemmas.cache), новые дописываются в него в конце
+        self.lemmatizer = TextLemmatizer(self.ipw.get_lemma_cache_path())
+        # словоформы документов -> леммы, для forms.dic
+        self.forms = SpimiForms(self.ipw.main_path)
+
+    def check_memory(self):
+        # memory_budget делят списки позиций, словоформы и новые словоформы кэша лемм (по оценке SpimiForms.pair_size);
+        # пока бюджет превышен, на диск сбрасывается самая большая часть: прогон списков, прогон словоформ
+        # или новые словоформы - сразу в кэш лемм, куда они попали бы и в конце построения
+        if self.memory_budget is None:
+            return
+        parts = [(self.index.memory_used, self.index.flush_run),
+                 (self.forms.memory_used, self.forms.flush_run),
+                 (len(self.lemmatizer.new_lemmas) * SpimiForms.pair_size, self.lemmatizer.save)]
+        parts.sort(key=lambda part: part[0], reverse=True)
+        memory_used = sum(used for used, flush in parts)
+        for used, flush in parts:
+            if memory_used < self.memory_budget:
+                return
+            flush()
+            memory_used = memory_used - used
 
     def build_index(self):
         logger.info(msg="Build index")
+        self.stats = BuildStats()
         # read files
         with open(self.ipw.get_raw_docs_path(), "r") as in_file:
             doc_id = 0
-            word_id = 1
 
             for line in in_file:
                 doc_id = doc_id + 1
-                jo = json.loads(line, 'utf-8')
+                if doc_id in self.deleted:
+                    continue
+                with self.stats.timer("parse"):
+                    jo = json.loads(line)
 
                 # normalize text
-                text = jo["content"]
-                text = TextNormalizer.join_numbers(text)
-                text = TextNormalizer.clean_out_punct(text)
-                text = TextNormalizer.lower_case(text)
-                words = TextNormalizer.split(text)
+                with self.stats.timer("normalize"):
+                    words = TextNormalizer.normalize(jo["content"])
 
                 # lemmatize
-                lemmas_unique = {}
-
-                for pos, lemma in enumerate([self.lemmatizer.lemmatize(word) for word in words]):
-                    if lemma not in lemmas_unique:
-                        lemmas_unique[lemma] = []
-                    lemmas_unique[lemma].append(pos)
-
-                # build dictionaries
-                self.docs_dict.add_elem(str(jo["url"]), doc_id)
-
-                for lemma in lemmas_unique.keys():
-                    new_id = self.words_dict.add_elem(lemma, word_id)
-                    if new_id < word_id:
-                        pass
-                    else:
-                        word_id = word_id+1
-
-                    # build matrix
-                    self.index.add_doc(new_id, doc_id, lemmas_unique[lemma])
+                with self.stats.timer("lemmatize"):
+                    lemmas = [self.lemmatizer.lemmatize(word) for word in words]
+
+                with self.stats.timer("invert"):
+                    lemmas_unique = {}
+                    self.forms.update(dict(zip(words, lemmas)))
+                    for pos, lemma in enumerate(lemmas):
+                        if lemma not in lemmas_unique:
+                            lemmas_unique[lemma] = []
+                        lemmas_unique[lemma].append(pos)
+
+                    # build dictionaries
+                    self.docs_dict.add_elem(str(jo["url"]), doc_id)
+
+                    for lemma in lemmas_unique.keys():
+                        new_id = self.words_dict.add_elem(lemma)
+
+                        # build matrix
+                        self.index.add_doc(new_id, doc_id, lemmas_unique[lemma])
+                    self.check_memory()
+                self.stats.docs = self.stats.docs + 1
+                self.stats.tokens = self.stats.tokens + len(words)
+                self.stats.progress()
 
         logger.info(str(self.docs_dict.dictionary_size) + " doc(s), " + str(self.words_dict.dictionary_size) + " word(s)")
-
-        self.words_dict.save_dict(self.ipw.get_words_dict_path())
-        self.docs_dict.save_dict(self.ipw.get_docs_dict_path())
-        self.index.save_index(self.ipw.get_index_path())
-
+        self.stats.progress(True)
+
+        with self.stats.timer("save"):
+            self.words_dict.save_dict(self.ipw.get_words_dict_path())
+            # forms.dic: словоформа -> term_id ее леммы, запросы находят по нему термы без лемматизации
+            # словоформы пишутся по мере слияния прогонов SpimiForms, их число считается отдельным проходом
+            try:
+                Dictionary.write(self.ipw.get_forms_dict_path(),
+                                 ((form, self.words_dict.get_key(lemma)) for form, lemma in self.forms.items()),
+                                 sum(1 for item in self.forms.items()))
+            finally:
+                self.forms.close()
+            DocsDictionary.write(self.ipw.get_docs_dict_path(), self.docs_dict.d)
+            self.index.save_index(self.ipw.get_index_path())
+            self.lemmatizer.save()
+
+        self.stats.cache_hits = self.lemmatizer.cache_hits
+        self.stats.cache_misses = self.lemmatizer.cache_misses
+        self.stats.cache_evictions = self.lemmatizer.cache_evictions
+        self.stats.save(self.ipw.get_build_stats_path(), self.words_dict.dictionary_size)
 
 if __name__ == '__main__':
-    if len(sys.argv[1:]) != 1:
-        logger.fatal(msg="Incorrect input")
-        exit(1)
-    IndexBuilder(sys.argv[1]).build_index()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path")
+    parser.add_argument("--memory-budget", type=int, default=None,
+                        help="memory budget for postings, word forms and new lemmas, MB")
+    args = parser.parse_args()
+    memory_budget = None if args.memory_budget is None else args.memory_budget * 1024 * 1024
+    IndexBuilder(args.path, memory_budget).build_index()
@@ -0,0 +1,30 @@
+#!/usr/bin/python3.4
+# -*- coding: utf-8 -*-
+
+import argparse
+import logging
+from index.wrapper import IndexPathWrapper
+from index.wrapper import Tombstones
+
+logging.basicConfig(
+    format='%(levelname)s %(asctime)s : %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p',
+    level=logging.DEBUG)
+logger = logging.getLogger('index_deletes')
+
+
+def delete_docs(path, doc_ids):
+    # пометить документы удаленными в deletes.bm каталога индекса
+    # поиск перестает их находить со следующего запроса (Wrapper.refresh)
+    deletes_path = IndexPathWrapper(path).get_deletes_path()
+    for doc_id in doc_ids:
+        Tombstones.delete(deletes_path, doc_id)
+    logger.info(msg="Delete {} doc(s) from '{}'.".format(len(doc_ids), path))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path")
+    parser.add_argument("doc_ids", type=int, nargs="+")
+    args = parser.parse_args()
+    delete_docs(args.path, args.doc_ids)
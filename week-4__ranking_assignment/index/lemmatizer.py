@@ -1,7 +1,15 @@
 #!/usr/bin/python3.4
 # -*- coding: utf-8 -*-
 
+import heapq
+import json
 import logging
+import mmap
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from struct import Struct
 import pymorphy2
 
 logging.basicConfig(
@@ -10,22 +18,266 @@ logging.basicConfig(
     level=logging.DEBUG)
 logger = logging.getLogger('lemmatizer')
 
+# один MorphAnalyzer на процесс: словари pymorphy2 загружаются при первом промахе кэша любого TextLemmatizer
+shared_morph = None
+shared_morph_lock = threading.Lock()
+
+
+def get_morph_analyzer():
+    global shared_morph
+    if shared_morph is None:
+        with shared_morph_lock:
+            if shared_morph is None:
+                logger.info(msg="Load pymorphy2 dictionaries")
+                shared_morph = pymorphy2.MorphAnalyzer()
+    return shared_morph
+
+
+# права новых файлов кэша - как у остальных файлов индекса (0666 по umask процесса);
+# umask можно узнать, только временно заменив его, поэтому это делается один раз при импорте, пока нет других потоков
+file_umask = os.umask(0)
+os.umask(file_umask)
+cache_file_mode = 0o666 & ~file_umask
+
+
+def analyzer_tag():
+    # версия pymorphy2 и его словарей: кэш, построенный другой версией, не используется
+    tag = "pymorphy2 " + pymorphy2.__version__
+    try:
+        with open(os.path.join(pymorphy2.MorphAnalyzer.choose_dictionary_path(), "meta.json"), "r") as in_file:
+            meta = dict(json.load(in_file))
+        tag = tag + ", dictionary {} {} {}".format(
+            meta.get("format_version"), meta.get("source_revision"), meta.get("compiled_at"))
+    except (OSError, ValueError):
+        pass
+    return tag
+
+
+class LemmaCache:
+    # кэш словоформа -> лемма на диске (lemmas.cache в каталоге индекса), общий для построителя индекса и shell
+    # формат файла:
+    # * заголовок: магическая строка, версия формата, количество записей, длина строки версии анализатора
+    # * строка версии анализатора (analyzer_tag)
+    # * таблица записей (смещение, длина словоформы, длина леммы), отсортированная по словоформе в байтах UTF-8
+    # * словоформы и леммы в UTF-8
+    # файл открывается (mmap) при первом обращении, get - бинарный поиск по таблице, целиком в память не читается
+    # write дописывает новые пары слиянием со старым файлом и атомарно заменяет его (os.replace)
+    magic = b"LEMC"
+    version = 1
+    header_struct = Struct("<4sIII")
+    entry_struct = Struct("<III")
+
+    path = None
+    mm = None
+    entries_cnt = 0
+    table_offset = 0
+    opened = False
+
+    def __init__(self, path):
+        self.path = path
+
+    def open(self):
+        self.opened = True
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as bin_file:
+            # пустой файл (mmap его не отображает) или обрезанный заголовок - кэша нет
+            if os.fstat(bin_file.fileno()).st_size < self.header_struct.size:
+                logger.info(msg="Ignore damaged lemma cache '{}'.".format(self.path))
+                return
+            self.mm = mmap.mmap(bin_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, entries_cnt, tag_len = self.header_struct.unpack_from(self.mm, 0)
+        try:
+            tag = self.mm[self.header_struct.size:self.header_struct.size + tag_len].decode('utf-8')
+        except ValueError:
+            tag = None
+        if magic != self.magic or version != self.version or tag != analyzer_tag():
+            logger.info(msg="Ignore lemma cache '{}' built by '{}'.".format(self.path, tag))
+            self.ignore()
+            return
+        self.entries_cnt = entries_cnt
+        self.table_offset = self.header_struct.size + tag_len
+        if not self.complete():
+            logger.info(msg="Ignore damaged lemma cache '{}'.".format(self.path))
+            self.ignore()
+            return
+        logger.info(msg="Load lemma cache from '{}'. {} form(s) mapped.".format(self.path, self.entries_cnt))
+
+    def complete(self):
+        # таблица записей и строки последней записи (они идут последними в файле) целиком в файле
+        if self.table_offset + self.entries_cnt * self.entry_struct.size > len(self.mm):
+            return False
+        if self.entries_cnt == 0:
+            return True
+        offset, form_len, lemma_len = self.entry_struct.unpack_from(
+            self.mm, self.table_offset + (self.entries_cnt - 1) * self.entry_struct.size)
+        return offset + form_len + lemma_len <= len(self.mm)
+
+    def ignore(self):
+        # работаем без файла, но не открываем его заново при каждом обращении: до write кэш на диске пуст
+        self.close()
+        self.opened = True
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        self.entries_cnt = 0
+        self.opened = False
+
+    def __len__(self):
+        if not self.opened:
+            self.open()
+        return self.entries_cnt
+
+    def entry(self, i):
+        offset, form_len, lemma_len = self.entry_struct.unpack_from(self.mm, self.table_offset + i * self.entry_struct.size)
+        return self.mm[offset:offset + form_len], offset + form_len, lemma_len
+
+    def get(self, word):
+        if not self.opened:
+            self.open()
+        form = word.encode('utf-8')
+        lo = 0
+        hi = self.entries_cnt
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_form, offset, lemma_len = self.entry(mid)
+            if mid_form == form:
+                return self.mm[offset:offset + lemma_len].decode('utf-8')
+            if mid_form < form:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def items(self):
+        # пары (словоформа, лемма) в байтах UTF-8, по возрастанию словоформы
+        if not self.opened:
+            self.open()
+        for i in range(self.entries_cnt):
+            form, offset, lemma_len = self.entry(i)
+            yield form, self.mm[offset:offset + lemma_len]
+
+    @classmethod
+    def write(cls, path, lemmas):
+        # lemmas - {словоформа: лемма}; старые пары файла сохраняются, новые переписывают их при совпадении
+        new_items = sorted((form.encode('utf-8'), lemma.encode('utf-8')) for form, lemma in lemmas.items())
+        old_cache = cls(path)
+        try:
+            # при равных словоформах новая пара (0) идет раньше старой (1)
+            items = []
+            for form, age, lemma in heapq.merge([(form, 0, lemma) for form, lemma in new_items],
+                                                ((form, 1, lemma) for form, lemma in old_cache.items())):
+                if len(items) == 0 or items[-1][0] != form:
+                    items.append((form, lemma))
+        finally:
+            old_cache.close()
+
+        tag = analyzer_tag().encode('utf-8')
+        offset = cls.header_struct.size + len(tag) + len(items) * cls.entry_struct.size
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+        with os.fdopen(fd, "wb") as bin_file:
+            bin_file.write(cls.header_struct.pack(cls.magic, cls.version, len(items), len(tag)))
+            bin_file.write(tag)
+            for form, lemma in items:
+                bin_file.write(cls.entry_struct.pack(offset, len(form), len(lemma)))
+                offset = offset + len(form) + len(lemma)
+            for form, lemma in items:
+                bin_file.write(form)
+                bin_file.write(lemma)
+        # mkstemp создает файл с правами 0600, а остальные файлы индекса создаются с правами по umask
+        os.chmod(tmp_path, cache_file_mode)
+        os.replace(tmp_path, path)
+        logger.info(msg="Save lemma cache to '{}'. {} form(s), {} new.".format(path, len(items), len(new_items)))
+
 
 class TextLemmatizer:
-    def __init__(self):
-        self.cache = dict()
-        self.morph = pymorphy2.MorphAnalyzer()
+    # обращения к кэшу, для статистики построения индекса и запросов
+    # промах - разбор слова pymorphy2: слово не нашлось ни в памяти, ни в кэше на диске
+    cache_hits = 0
+    cache_misses = 0
+    # кэш в памяти ограничен cache_size словоформами: при переполнении вытесняется давно не использованная (LRU)
+    cache_size = 100000
+    cache_evictions = 0
+    # кэш на диске (LemmaCache) или None
+    disk_cache = None
+    # словоформы, разобранные pymorphy2 и еще не сохраненные в кэш на диске
+    new_lemmas = None
+    # autosave=True - при накоплении autosave_size новых словоформ save сбрасывает их в файл сам (shell);
+    # порог намного меньше cache_size: save переписывает файл целиком, но при падении теряется не больше autosave_size
+    # словоформ; без autosave файл пишет только владелец: процессы пула построителя отдают новые словоформы родителю
+    # (take_new_lemmas), иначе одновременные save затирали бы словоформы друг друга
+    autosave = False
+    autosave_size = 1000
+    # общий MorphAnalyzer (get_morph_analyzer), берется при первом промахе
+    morph = None
+
+    def __init__(self, cache_path=None, cache_size=None, autosave=False, autosave_size=None):
+        self.cache = OrderedDict()
+        self.new_lemmas = dict()
+        if cache_path is not None:
+            self.disk_cache = LemmaCache(cache_path)
+        if cache_size is not None:
+            self.cache_size = cache_size
+        self.autosave = autosave
+        if autosave_size is not None:
+            self.autosave_size = autosave_size
+
+    def remember(self, word, lemma):
+        self.cache[word] = lemma
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+            self.cache_evictions = self.cache_evictions + 1
+
+    def cache_stats(self):
+        return {
+            "size": len(self.cache),
+            "capacity": self.cache_size,
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+            "evictions": self.cache_evictions
+        }
 
     def lemmatize(self, word):
-        if word in self.cache:
-            return self.cache[word]
+        result = self.cache.get(word)
+        if result is not None:
+            self.cache_hits = self.cache_hits + 1
+            self.cache.move_to_end(word)
+            return result
 
+        result = self.disk_cache.get(word) if self.disk_cache is not None else None
+        if result is not None:
+            self.cache_hits = self.cache_hits + 1
+            self.remember(word, result)
+            return result
+        self.cache_misses = self.cache_misses + 1
+
+        if self.morph is None:
+            self.morph = get_morph_analyzer()
         candidates = self.morph.parse(word)
         if len(candidates) == 0:
             result = word
         else:
             result = candidates[0].normal_form
 
-        self.cache[word] = result
+        self.remember(word, result)
+        if self.disk_cache is not None:
+            self.new_lemmas[word] = result
+            if self.autosave and len(self.new_lemmas) >= self.autosave_size:
+                self.save()
 
         return result
+
+    def take_new_lemmas(self):
+        new_lemmas = self.new_lemmas
+        self.new_lemmas = dict()
+        return new_lemmas
+
+    def save(self):
+        # дописывает разобранные pymorphy2 словоформы в кэш на диске
+        new_lemmas = self.take_new_lemmas()
+        if self.disk_cache is None or len(new_lemmas) == 0:
+            return
+        self.disk_cache.close()
+        LemmaCache.write(self.disk_cache.path, new_lemmas)
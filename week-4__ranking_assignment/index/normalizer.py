@@ -13,15 +13,17 @@ logger = logging.getLogger('normalizer')
 
 
 class TextNormalizer:
+    # регулярные выражения компилируются один раз при загрузке модуля, а не при каждом вызове
+    numbers_regex = re.compile(r'([\d])[\s]+([\d])')
+    punct_regex = re.compile('[%s]' % re.escape(string.punctuation + "«" + "»"))
+
     @staticmethod
     def join_numbers(text):
-        regex = re.compile('([\d])[\s]+([\d])')
-        return regex.sub('\\1\\2', text)
+        return TextNormalizer.numbers_regex.sub('\\1\\2', text)
 
     @staticmethod
     def clean_out_punct(text):
-        regex = re.compile('[%s]' % re.escape(string.punctuation + "«" + "»"))
-        return regex.sub(' ', text)
+        return TextNormalizer.punct_regex.sub(' ', text)
 
     @staticmethod
     def lower_case(text):
@@ -30,3 +32,15 @@ class TextNormalizer:
     @staticmethod
     def split(text):
         return text.split()
+
+    @staticmethod
+    def normalize(text):
+        # join_numbers, clean_out_punct, lower_case и split за один вызов: текст -> список слов
+        text = TextNormalizer.numbers_regex.sub('\\1\\2', text)
+        return TextNormalizer.punct_regex.sub(' ', text).lower().split()
+
+    @staticmethod
+    def normalize_many(texts):
+        # ленивая нормализация последовательности текстов
+        for text in texts:
+            yield TextNormalizer.normalize(text)
@@ -0,0 +1,117 @@
+#!/usr/bin/python3.4
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+import resource
+import time
+from contextlib import contextmanager
+
+logging.basicConfig(
+    format='%(levelname)s %(asctime)s : %(message)s',
+    datefmt='%m/%d/%Y %I:%M:%S %p',
+    level=logging.DEBUG)
+logger = logging.getLogger('build_stats')
+
+
+class StageTimers:
+    # wall-время (time.perf_counter) и CPU-время процесса (time.process_time) по стадиям построения индекса
+    # плюс счетчики документов, слов и обращений к кэшу лемматизатора
+    wall = None
+    cpu = None
+    docs = 0
+    tokens = 0
+    cache_hits = 0
+    cache_misses = 0
+    cache_evictions = 0
+
+    def __init__(self):
+        self.wall = {}
+        self.cpu = {}
+
+    @contextmanager
+    def timer(self, stage):
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            self.wall[stage] = self.wall.get(stage, 0.0) + time.perf_counter() - wall_start
+            self.cpu[stage] = self.cpu.get(stage, 0.0) + time.process_time() - cpu_start
+
+    def add(self, other):
+        for stage in other.wall:
+            self.wall[stage] = self.wall.get(stage, 0.0) + other.wall[stage]
+            self.cpu[stage] = self.cpu.get(stage, 0.0) + other.cpu[stage]
+        self.docs = self.docs + other.docs
+        self.tokens = self.tokens + other.tokens
+        self.cache_hits = self.cache_hits + other.cache_hits
+        self.cache_misses = self.cache_misses + other.cache_misses
+        self.cache_evictions = self.cache_evictions + other.cache_evictions
+
+
+class BuildStats(StageTimers):
+    # статистика построения индекса целиком: стадии, пропускная способность, кэш лемматизатора, пиковая память
+    # стадии: parse (json.loads), normalize (TextNormalizer.normalize), lemmatize, invert (словари, позиционный
+    # обратный индекс и сброс прогонов при --memory-budget), save (слияние прогонов и запись файлов)
+    # по ходу построения раз в progress_interval секунд в лог пишется строка прогресса, в конце - отчет в JSON
+    progress_interval = 10.0
+
+    workers = 1
+    started = 0.0
+    last_progress = 0.0
+
+    def __init__(self, workers=1):
+        StageTimers.__init__(self)
+        self.workers = workers
+        self.started = time.perf_counter()
+        self.last_progress = self.started
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def progress(self, force=False):
+        now = time.perf_counter()
+        if not force and now - self.last_progress < self.progress_interval:
+            return
+        self.last_progress = now
+        elapsed = max(self.elapsed(), 1e-9)
+        logger.info(msg="Progress: {} doc(s), {} token(s), {:.1f} docs/sec, {:.1f} tokens/sec".format(
+            self.docs, self.tokens, self.docs / elapsed, self.tokens / elapsed))
+
+    @staticmethod
+    def peak_memory_kb():
+        # ru_maxrss в Linux - килобайты; для процессов пула - максимум по завершенным дочерним процессам
+        return {
+            "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        }
+
+    def report(self, terms=None):
+        elapsed = max(self.elapsed(), 1e-9)
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            "workers": self.workers,
+            "docs": self.docs,
+            "tokens": self.tokens,
+            "terms": terms,
+            "elapsed_sec": elapsed,
+            "docs_per_sec": self.docs / elapsed,
+            "tokens_per_sec": self.tokens / elapsed,
+            "stages": dict((stage, {"wall_sec": self.wall[stage], "cpu_sec": self.cpu[stage]})
+                           for stage in sorted(self.wall)),
+            "lemmatizer_cache": {
+                "hits": self.cache_hits,
+                "misses": self.cache_misses,
+                "evictions": self.cache_evictions,
+                "hit_rate": self.cache_hits / lookups if lookups > 0 else None
+            },
+            "peak_memory_kb": self.peak_memory_kb()
+        }
+
+    def save(self, path, terms=None):
+        report = self.report(terms)
+        with open(path, "w") as out_file:
+            json.dump(report, out_file, indent=2, sort_keys=True)
+        logger.info(msg="Save build report to '{}'. {}".format(path, json.dumps(report, sort_keys=True)))
+        return report
@@ -1,8 +1,13 @@
 #!/usr/bin/python3.4
 # -*- coding: utf-8 -*-
 
+import heapq
 import logging
+import mmap
+import os
+import tempfile
 from struct import Struct
+from urllib.parse import unquote
 from index.lemmatizer import TextLemmatizer
 
 logging.basicConfig(
@@ -30,6 +35,18 @@ class IndexPathWrapper:
     def get_raw_docs_path(self):
         return self.main_path + "/raw_docs.json"
 
+    def get_forms_dict_path(self):
+        return self.main_path + "/forms.dic"
+
+    def get_lemma_cache_path(self):
+        return self.main_path + "/lemmas.cache"
+
+    def get_deletes_path(self):
+        return self.main_path + "/deletes.bm"
+
+    def get_build_stats_path(self):
+        return self.main_path + "/build_stats.json"
+
 
 class RevertIndex:
     # в этом случае в обратном индексе хранится не только документ, в котором встречается конкретный терм
@@ -63,51 +80,256 @@ class RevertIndex:
     def extract_inverted_list(self, term_id):
         return self.m[term_id] if term_id in self.m else {}
 
-    def load_index(self, path):
-        loaded_cnt = 0
+    @classmethod
+    def read(cls, path):
+        # термы файла индекса по одному: (term_id, { doc_id : [positions] })
         with open(path, "rb") as bin_file:
-            terms_cnt = self.number_struct.unpack(bin_file.read(self.number_struct.size))[0]
+            terms_cnt = cls.number_struct.unpack(bin_file.read(cls.number_struct.size))[0]
 
             for t in range(terms_cnt):
-                term_id = self.number_struct.unpack(bin_file.read(self.number_struct.size))[0]
-                docs_cnt = self.number_struct.unpack(bin_file.read(self.number_struct.size))[0]
+                term_id = cls.number_struct.unpack(bin_file.read(cls.number_struct.size))[0]
+                docs_cnt = cls.number_struct.unpack(bin_file.read(cls.number_struct.size))[0]
 
+                docs = {}
                 for d in range(docs_cnt):
-                    doc_id = self.number_struct.unpack(bin_file.read(self.number_struct.size))[0]
-                    positions_cnt = self.number_struct.unpack(bin_file.read(self.number_struct.size))[0]
+                    doc_id = cls.number_struct.unpack(bin_file.read(cls.number_struct.size))[0]
+                    positions_cnt = cls.number_struct.unpack(bin_file.read(cls.number_struct.size))[0]
                     positions = []
                     for p in range(positions_cnt):
-                        positions.append(self.number_struct.unpack(bin_file.read(self.number_struct.size))[0])
-                    self.add_doc(term_id, doc_id, positions)
-                    loaded_cnt = loaded_cnt + 1
+                        positions.append(cls.number_struct.unpack(bin_file.read(cls.number_struct.size))[0])
+                    docs[doc_id] = positions
+                yield term_id, docs
+
+    def load_index(self, path):
+        loaded_cnt = 0
+        for term_id, docs in self.read(path):
+            for doc_id, positions in docs.items():
+                self.add_doc(term_id, doc_id, positions)
+                loaded_cnt = loaded_cnt + 1
 
         logger.info(msg="Load index from '{}'. {} element(s) loaded.".format(path, loaded_cnt))
 
-    def save_index(self, path):
+    @classmethod
+    def write(cls, path, term_docs):
+        # term_docs = [(term_id, { doc_id : [positions] }), ...], может быть генератором:
+        # количество термов записывается в начало файла, когда все списки уже записаны
         saved_cnt = 0
+        terms_cnt = 0
         with open(path, "wb") as bin_file:
-            bin_file.write(self.number_struct.pack(len(self.m)))
+            bin_file.write(cls.number_struct.pack(0))
 
-            for term in self.m:
-                bin_file.write(self.number_struct.pack(term))
-                bin_file.write(self.number_struct.pack(len(self.m[term])))
+            for term, docs in term_docs:
+                bin_file.write(cls.number_struct.pack(term))
+                bin_file.write(cls.number_struct.pack(len(docs)))
 
-                for doc in self.m[term]:
-                    bin_file.write(self.number_struct.pack(doc))
-                    bin_file.write(self.number_struct.pack(len(self.m[term][doc])))
-                    for position in self.m[term][doc]:
-                        bin_file.write(self.number_struct.pack(position))
+                for doc in docs:
+                    bin_file.write(cls.number_struct.pack(doc))
+                    bin_file.write(cls.number_struct.pack(len(docs[doc])))
+                    for position in docs[doc]:
+                        bin_file.write(cls.number_struct.pack(position))
 
                     saved_cnt = saved_cnt + 1
+                terms_cnt = terms_cnt + 1
+
+            bin_file.seek(0)
+            bin_file.write(cls.number_struct.pack(terms_cnt))
+        return saved_cnt
 
+    def save_index(self, path):
+        saved_cnt = self.write(path, self.m.items())
         logger.info(msg="Save index to '{}'. {} element(s) saved.".format(path, saved_cnt))
 
 
+class SpimiRevertIndex:
+    # позиционный обратный индекс для построения коллекций больше памяти (SPIMI, single-pass in-memory indexing)
+    # документы копятся в памяти, пока оценка занятой памяти не превысит memory_budget байт,
+    # затем блок сбрасывается на диск прогоном: отсортированным по term_id файлом в формате RevertIndex
+    # save_index сливает прогоны k-путевым слиянием по term_id; doc_id растут от прогона к прогону,
+    # поэтому документы одного терма из разных прогонов просто дописываются, и в памяти всегда один терм
+    # оценки памяти на терм, документ и позицию в блоке (объекты dict, list и int)
+    term_size = 240
+    doc_size = 120
+    position_size = 36
+
+    m = None
+    memory_budget = 0
+    memory_used = 0
+    runs_dir = None
+    runs = None
+
+    def __init__(self, memory_budget, runs_dir=None):
+        self.m = {}
+        self.memory_budget = memory_budget
+        self.runs_dir = runs_dir
+        self.runs = []
+
+    def add_doc(self, term, doc, positions):
+        if term not in self.m:
+            self.m[term] = {}
+            self.memory_used = self.memory_used + self.term_size
+        self.m[term][doc] = positions
+        self.memory_used = self.memory_used + self.doc_size + len(positions) * self.position_size
+
+        if self.memory_used >= self.memory_budget:
+            self.flush_run()
+
+    def flush_run(self):
+        if len(self.m) == 0:
+            return
+        fd, path = tempfile.mkstemp(suffix=".run", dir=self.runs_dir)
+        os.close(fd)
+        saved_cnt = RevertIndex.write(path, sorted(self.m.items()))
+        self.runs.append(path)
+        logger.info(msg="Flush run '{}'. {} term(s), {} element(s) saved.".format(path, len(self.m), saved_cnt))
+        self.m = {}
+        self.memory_used = 0
+
+    @staticmethod
+    def read_run(run, path):
+        # номер прогона в кортеже: при равных term_id кортежи сравниваются по нему, а не по словарям
+        for term, docs in RevertIndex.read(path):
+            yield term, run, docs
+
+    def merge_runs(self):
+        current = None
+        docs = None
+        runs = [self.read_run(run, path) for run, path in enumerate(self.runs)]
+        for term, run, run_docs in heapq.merge(*runs):
+            if term != current:
+                if current is not None:
+                    yield current, docs
+                current = term
+                docs = {}
+            docs.update(run_docs)
+        if current is not None:
+            yield current, docs
+
+    def save_index(self, path):
+        if len(self.runs) == 0:
+            saved_cnt = RevertIndex.write(path, sorted(self.m.items()))
+            logger.info(msg="Save index to '{}'. {} element(s) saved.".format(path, saved_cnt))
+            return
+
+        self.flush_run()
+        runs_cnt = len(self.runs)
+        try:
+            saved_cnt = RevertIndex.write(path, self.merge_runs())
+        finally:
+            for run in self.runs:
+                os.remove(run)
+            self.runs = []
+        logger.info(msg="Save index to '{}'. {} element(s) merged from {} run(s).".format(path, saved_cnt, runs_cnt))
+
+
+class SpimiForms:
+    # словоформы документов -> леммы (для forms.dic) при построении коллекций больше памяти, как в SpimiRevertIndex:
+    # пары копятся в памяти, а flush_run сбрасывает их на диск прогоном - файлом пар, отсортированных по словоформе
+    # в байтах UTF-8; когда сбрасывать, решает IndexBuilder по memory_used
+    # items() сливает прогоны и пары в памяти k-путевым слиянием; у словоформы всегда одна лемма,
+    # поэтому ее повторы в разных прогонах просто пропускаются
+    pair_struct = Struct("<II")
+    # оценка памяти на пару: две строки и запись словаря
+    pair_size = 160
+
+    m = None
+    memory_used = 0
+    runs_dir = None
+    runs = None
+
+    def __init__(self, runs_dir=None):
+        self.m = {}
+        self.runs_dir = runs_dir
+        self.runs = []
+
+    def update(self, forms):
+        for form, lemma in forms.items():
+            if form not in self.m:
+                self.m[form] = lemma
+                self.memory_used = self.memory_used + self.pair_size
+
+    def flush_run(self):
+        if len(self.m) == 0:
+            return
+        fd, path = tempfile.mkstemp(suffix=".forms", dir=self.runs_dir)
+        with os.fdopen(fd, "wb") as bin_file:
+            for form, lemma in self.sorted_pairs():
+                bin_file.write(self.pair_struct.pack(len(form), len(lemma)))
+                bin_file.write(form)
+                bin_file.write(lemma)
+        self.runs.append(path)
+        logger.info(msg="Flush forms run '{}'. {} element(s) saved.".format(path, len(self.m)))
+        self.m = {}
+        self.memory_used = 0
+
+    def sorted_pairs(self):
+        return sorted((form.encode('utf-8'), lemma.encode('utf-8')) for form, lemma in self.m.items())
+
+    @classmethod
+    def read_run(cls, path):
+        with open(path, "rb") as bin_file:
+            while True:
+                data = bin_file.read(cls.pair_struct.size)
+                if len(data) == 0:
+                    return
+                form_len, lemma_len = cls.pair_struct.unpack(data)
+                yield bin_file.read(form_len), bin_file.read(lemma_len)
+
+    def items(self):
+        # пары (словоформа, лемма) по возрастанию словоформы в байтах UTF-8, каждая словоформа один раз
+        prev = None
+        for form, lemma in heapq.merge(self.sorted_pairs(), *[self.read_run(path) for path in self.runs]):
+            if form != prev:
+                prev = form
+                yield form.decode('utf-8'), lemma.decode('utf-8')
+
+    def close(self):
+        for run in self.runs:
+            os.remove(run)
+        self.runs = []
+
+
+class TermTrie:
+    # префиксное дерево термов: узел - dict { символ : дочерний узел }, id терма лежит в узле под ключом None
+    root = None
+
+    def __init__(self):
+        self.root = {}
+
+    def add(self, term, key):
+        node = self.root
+        for ch in term:
+            if ch not in node:
+                node[ch] = {}
+            node = node[ch]
+        node[None] = key
+
+    def prefix_items(self, prefix, limit=None):
+        # пары (term, term_id) для всех термов, начинающихся с prefix, в порядке сортировки, не больше limit штук
+        # обходится только поддерево префикса
+        node = self.root
+        for ch in prefix:
+            if ch not in node:
+                return []
+            node = node[ch]
+
+        res = []
+        stack = [(prefix, node)]
+        while len(stack) > 0 and (limit is None or len(res) < limit):
+            term, node = stack.pop()
+            if None in node:
+                res.append((term, node[None]))
+            for ch in sorted((ch for ch in node if ch is not None), reverse=True):
+                stack.append((term + ch, node[ch]))
+        return res
+
+
 class Dictionary:
     d = None
     rev_d = None
     build_rev = False
     dictionary_size = 0
+    next_key = 1
+    trie = None
     was_reverted = False
     number_struct = Struct("<I")
 
@@ -118,8 +340,12 @@ class Dictionary:
     def clean_start(self):
         self.d = {}
         if self.build_rev:
+            # обратное отображение: rev_d[key] = elem, для свободных key - None
+            # занят ли key, проверяется за O(1) по индексу, а не поиском по списку
             self.rev_d = []
         self.dictionary_size = 0
+        self.next_key = 1
+        self.trie = None
 
     def load_dict(self, path, need_revert=False):
         self.clean_start()
@@ -139,44 +365,60 @@ class Dictionary:
                 bin_data = bin_file.read(self.number_struct.size)
                 key = self.number_struct.unpack(bin_data)[0]
                 if need_revert:
-                    self.add_elem(key, record)
+                    # ключом здесь становится id, а значением - строка, обратное отображение не нужно
+                    if key not in self.d:
+                        self.d[key] = record
+                        self.dictionary_size = self.dictionary_size + 1
                 else:
                     self.add_elem(record, key)
         logger.info(msg="Load dictionary from '" + path + "'. " + str(self.dictionary_size) + " element(s) loaded.")
 
     def save_dict(self, path):
+        self.write(path, self.d.items(), self.dictionary_size)
+
+    @classmethod
+    def write(cls, path, items, items_cnt):
+        # items - ровно items_cnt пар (элемент, id); пары пишутся по мере чтения, без словаря в памяти
         with open(path, "wb") as bin_file:
-            bin_file.write(self.number_struct.pack(self.dictionary_size))
+            bin_file.write(cls.number_struct.pack(items_cnt))
 
-            for k in self.d.keys():
+            for k, v in items:
                 key = k.encode('utf-8')
                 key_len = len(key)
-                bin_file.write(self.number_struct.pack(key_len))
+                bin_file.write(cls.number_struct.pack(key_len))
                 record_struct = Struct("%ds" % key_len)
                 bin_file.write(record_struct.pack(key))
-                bin_file.write(self.number_struct.pack(self.d[k]))
-        logger.info(msg="Save dictionary to '" + path + "'. " + str(self.dictionary_size) + " element(s) saved.")
+                bin_file.write(cls.number_struct.pack(v))
+        logger.info(msg="Save dictionary to '" + path + "'. " + str(items_cnt) + " element(s) saved.")
 
-    def add_elem(self, elem, key):
+    def add_elem(self, elem, key=None):
+        # если key не задан, элемент получает следующий свободный id (счетчик только растет)
         if elem in self.d:
             return self.d[elem]
 
         self.dictionary_size = self.dictionary_size + 1
+        self.trie = None
+        if key is None:
+            key = self.next_key
 
         if self.build_rev:
-            while key in self.rev_d:
+            while self.has_key(key):
                 key = key + 1
+            if key >= len(self.rev_d):
+                self.rev_d.extend([None] * (key + 1 - len(self.rev_d)))
+            self.rev_d[key] = elem
 
-            self.d[elem] = key
-            for i in range(len(self.rev_d)):
-                if self.rev_d[i] > key:
-                    self.rev_d.insert(i, key)
-                    return key
-            self.rev_d.append(key)
-            return key
-        else:
-            self.d[elem] = key
-            return key
+        self.d[elem] = key
+        if key >= self.next_key:
+            self.next_key = key + 1
+        return key
+
+    def has_key(self, key):
+        return self.rev_d is not None and key < len(self.rev_d) and self.rev_d[key] is not None
+
+    def get_elem(self, key):
+        # элемент по его id (только для словаря с build_rev)
+        return self.rev_d[key] if self.has_key(key) else None
 
     def make_reverted(self):
         self.clean_revert()
@@ -196,23 +438,182 @@ class Dictionary:
         else:
             return None
 
+    def prefix_items(self, prefix, limit=None):
+        # префиксное дерево строится при первом префиксном запросе
+        if self.trie is None:
+            self.trie = TermTrie()
+            for elem, key in self.d.items():
+                self.trie.add(elem, key)
+        return self.trie.prefix_items(prefix, limit)
+
+
+class DocsDictionary:
+    # словарь документов (doc_id -> url) на диске, отображенный в память (mmap)
+    # формат файла:
+    # * заголовок: магическая строка, версия, количество документов, максимальный doc_id
+    # * таблица смещений: для каждого doc_id от 0 до максимального - начало его строки, плюс конец последней строки
+    # * строки url подряд, в UTF-8, уже раскодированные из %-нотации
+    # url документа - срез между двумя соседними смещениями, поэтому при открытии ничего не читается,
+    # а декодируются только те url, которые действительно показываются пользователю
+    magic = b"DDIC"
+    version = 1
+    header_struct = Struct("<4sIII")
+    bounds_struct = Struct("<II")
+
+    path = None
+    mm = None
+    dictionary_size = 0
+    max_key = 0
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as bin_file:
+            self.mm = mmap.mmap(bin_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.dictionary_size, self.max_key = self.header_struct.unpack_from(self.mm, 0)
+        if magic != self.magic or version != self.version:
+            self.close()
+            raise ValueError("Unsupported dictionary format in '{}'".format(path))
+        logger.info(msg="Load dictionary from '{}'. {} element(s) mapped.".format(path, self.dictionary_size))
+
+    @classmethod
+    def has_header(cls, path):
+        with open(path, "rb") as bin_file:
+            return bin_file.read(len(cls.magic)) == cls.magic
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+
+    def get_elem(self, key):
+        if key < 0 or key > self.max_key:
+            return None
+        start, end = self.bounds_struct.unpack_from(self.mm, self.header_struct.size + key * 4)
+        if start == end:
+            return None
+        return self.mm[start:end].decode('utf-8')
+
+    @classmethod
+    def write(cls, path, d):
+        # d = { url : doc_id }
+        max_key = max(d.values()) if len(d) > 0 else 0
+        urls = [b""] * (max_key + 1)
+        for url, key in d.items():
+            urls[key] = unquote(url).encode('utf-8')
+
+        offset = cls.header_struct.size + (max_key + 2) * 4
+        offsets = []
+        for url in urls:
+            offsets.append(offset)
+            offset = offset + len(url)
+        offsets.append(offset)
+
+        with open(path, "wb") as bin_file:
+            bin_file.write(cls.header_struct.pack(cls.magic, cls.version, len(d), max_key))
+            bin_file.write(Struct("<%dI" % len(offsets)).pack(*offsets))
+            for url in urls:
+                bin_file.write(url)
+        logger.info(msg="Save dictionary to '{}'. {} element(s) saved.".format(path, len(d)))
+
+
+class Tombstones:
+    # удаленные документы: битовая карта в файле deletes.bm, бит doc_id выставлен - документ удален
+    # удаление - запись одного байта на место (O(1)), индекс при этом не перестраивается;
+    # поиск пропускает такие doc_id, а перестройка индекса физически выкидывает их из списков
+    path = None
+    bits = None
+    mtime = None
+
+    def __init__(self, path):
+        self.path = path
+        self.bits = b""
+        self.refresh()
+
+    def refresh(self):
+        # перечитать файл, если он изменился; возвращает True, если изменился
+        mtime = os.stat(self.path).st_mtime_ns if os.path.exists(self.path) else None
+        if mtime == self.mtime:
+            return False
+        self.mtime = mtime
+        if mtime is None:
+            self.bits = b""
+        else:
+            with open(self.path, "rb") as bin_file:
+                self.bits = bin_file.read()
+        return True
+
+    def __contains__(self, doc_id):
+        byte = doc_id >> 3
+        return byte < len(self.bits) and (self.bits[byte] >> (doc_id & 7)) & 1 == 1
+
+    def __len__(self):
+        return sum(bin(byte).count('1') for byte in self.bits)
+
+    def __iter__(self):
+        for i, byte in enumerate(self.bits):
+            if byte:
+                for bit in range(8):
+                    if (byte >> bit) & 1:
+                        yield (i << 3) | bit
+
+    def filter(self, docs):
+        # doc_id из docs, кроме удаленных; docs перебирается лениво
+        for doc in docs:
+            if doc not in self:
+                yield doc
+
+    @staticmethod
+    def delete(path, doc_id):
+        with open(path, "r+b" if os.path.exists(path) else "w+b") as bin_file:
+            bin_file.seek(doc_id >> 3)
+            byte = bin_file.read(1)
+            bin_file.seek(doc_id >> 3)
+            bin_file.write(bytes([(byte[0] if len(byte) > 0 else 0) | (1 << (doc_id & 7))]))
+
 
 class Wrapper:
     words_dict = None
     docs_dict = None
     index = None
     lemmatizer = None
+    deleted = None
+    # словоформы документов -> term_id (forms.dic, пишет IndexBuilder) или None для индекса без forms.dic
+    forms_dict = None
 
     def __init__(self, index_path):
         ipw = IndexPathWrapper(index_path)
 
-        self.words_dict = Dictionary()
+        # обратное отображение term_id -> терм нужно form_term
+        self.words_dict = Dictionary(True)
         self.words_dict.load_dict(ipw.get_words_dict_path())
+        if os.path.exists(ipw.get_forms_dict_path()):
+            self.forms_dict = Dictionary()
+            self.forms_dict.load_dict(ipw.get_forms_dict_path())
 
-        self.docs_dict = Dictionary(True)
-        self.docs_dict.load_dict(ipw.get_docs_dict_path(), True)
+        if DocsDictionary.has_header(ipw.get_docs_dict_path()):
+            self.docs_dict = DocsDictionary(ipw.get_docs_dict_path())
+        else:
+            self.docs_dict = Dictionary(True)
+            self.docs_dict.load_dict(ipw.get_docs_dict_path(), True)
 
         self.index = RevertIndex()
         self.index.load_index(ipw.get_index_path())
+        self.deleted = Tombstones(ipw.get_deletes_path())
+
+        # shell - единственный писатель кэша лемм в своем процессе, поэтому сбрасывает новые словоформы сам
+        self.lemmatizer = TextLemmatizer(ipw.get_lemma_cache_path(), autosave=True)
 
-        self.lemmatizer = TextLemmatizer()
+    def form_term(self, form):
+        # терм словоформы из документов индекса или None
+        if self.forms_dict is None:
+            return None
+        key = self.forms_dict.get_key(form)
+        return None if key is None else self.words_dict.get_elem(key)
+
+    def get_doc_url(self, doc_id):
+        # url документа в читаемом виде; старый docs.dic хранит url в %-нотации
+        if isinstance(self.docs_dict, DocsDictionary):
+            return self.docs_dict.get_elem(doc_id)
+        url = self.docs_dict.d.get(doc_id)
+        return None if url is None else unquote(url)
@@ -14,30 +14,117 @@ logger = logging.getLogger('qtree')
 
 # для простоты мы отказываемся от сложных конструкций со скобками или операторами
 # в этот раз мы считаем, что строка запроса состоит только из термов и все они должны быть в документе
+# дополнительно поддерживаются ограничения на позиции термов:
+# * фраза в кавычках: "красная площадь" - термы должны идти в документе подряд и в том же порядке
+# * a NEAR/k b - термы a и b должны находиться в документе на расстоянии не больше k слов (в любом порядке)
+# * кот* - любой терм словаря с префиксом "кот"
+
+
+class PhraseConstraint:
+    terms = None
+
+    def __init__(self, terms):
+        self.terms = terms
+
+    def __repr__(self):
+        return '"' + ' '.join(self.terms) + '"'
+
+    def match(self, value_map, doc):
+        # позиционное слияние: оставляем те позиции p первого терма, для которых i-й терм стоит на позиции p + i
+        # списки позиций не копируются, по ним только идут указатели
+        candidates = value_map[self.terms[0]][doc]
+        for shift in range(1, len(self.terms)):
+            positions = value_map[self.terms[shift]][doc]
+            matched = []
+            j = 0
+            for position in candidates:
+                while j < len(positions) and positions[j] < position + shift:
+                    j = j + 1
+                if j < len(positions) and positions[j] == position + shift:
+                    matched.append(position)
+            if len(matched) == 0:
+                return False
+            candidates = matched
+        return True
+
+
+class NearConstraint:
+    left = None
+    right = None
+    distance = 0
+
+    def __init__(self, left, right, distance):
+        self.left = left
+        self.right = right
+        self.distance = distance
+
+    def __repr__(self):
+        return self.left + ' NEAR/' + str(self.distance) + ' ' + self.right
+
+    def match(self, value_map, doc):
+        a = value_map[self.left][doc]
+        b = value_map[self.right][doc]
+        i = 0
+        j = 0
+        while i < len(a) and j < len(b):
+            if abs(a[i] - b[j]) <= self.distance:
+                return True
+            if a[i] < b[j]:
+                i = i + 1
+            else:
+                j = j + 1
+        return False
 
 
 class Tokenizer:
     expression = None
     tokens = None
+    constraints = None
     iterator = 0
     lemmatizer = None
+    # словоформы документов индекса (forms.dic, см. Wrapper.form_term) или None
+    forms = None
 
-    def __init__(self, exp, lemmatizer):
+    def __init__(self, exp, lemmatizer, forms=None):
         self.expression = exp
         self.lemmatizer = lemmatizer
+        self.forms = forms
 
     def _simplify_token(self, token):
+        if len(token) > 1 and token.endswith('*'):
+            # префикс "кот*" не лемматизируется, его раскрывает shell по словарю
+            return TextNormalizer.lower_case(token)
+        # словоформа из документов индекса находится одним поиском в forms.dic, лемматизатор нужен только для остальных
+        if self.forms is not None:
+            term = self.forms.form_term(TextNormalizer.lower_case(token))
+            if term is not None:
+                return term
         lemma = self.lemmatizer.lemmatize(token)
         return TextNormalizer.lower_case(lemma)
 
     def tokenize(self):
-        regexp = re.compile(r'\s+')
-        raw_tokens = regexp.split(self.expression)
-        raw_tokens = [token.strip() for token in raw_tokens if token.strip() != '']
+        regexp = re.compile(r'"[^"]*"|\S+')
+        near_regexp = re.compile(r'^NEAR/(\d+)$')
+        raw_tokens = regexp.findall(self.expression)
 
         self.tokens = []
+        self.constraints = []
+        near_distance = None
         for token in raw_tokens:
-            self.tokens.append(self._simplify_token(token))
+            near = near_regexp.match(token)
+            if near is not None and len(self.tokens) > 0:
+                near_distance = int(near.group(1))
+                continue
+
+            lemmas = [self._simplify_token(word) for word in token.strip('"').split()]
+            if len(lemmas) == 0:
+                continue
+            if token.startswith('"') and len(lemmas) > 1:
+                self.constraints.append(PhraseConstraint(lemmas))
+            if near_distance is not None:
+                self.constraints.append(NearConstraint(self.tokens[-1], lemmas[0], near_distance))
+                near_distance = None
+            self.tokens.extend(lemmas)
 
     def get_terms(self):
         return self.tokens
@@ -46,8 +133,8 @@ class Tokenizer:
 class QueryTree:
     tokenizer = None
 
-    def __init__(self, expression_string, lemmatizer):
-        self.tokenizer = Tokenizer(expression_string, lemmatizer)
+    def __init__(self, expression_string, lemmatizer, forms=None):
+        self.tokenizer = Tokenizer(expression_string, lemmatizer, forms)
         self.tokenizer.tokenize()
 
     def extract_terms(self):
@@ -61,15 +148,27 @@ class QueryTree:
             return None
         else:
             # value_map = { term : { doc : [positions] } }
-            doc_lists = []
-            for t in self.tokenizer.tokens:
-                doc_lists.append(list(value_map.get(t, {}).keys()))
-            logger.info("doc_lists={}".format(str(doc_lists)))
-            docs_all_terms = set(doc_lists[0])
-            for i in range(1, len(doc_lists)):
-                docs_all_terms = docs_all_terms.intersection(set(doc_lists[i]))
+            terms = list(set(self.tokenizer.tokens))
+            if len(terms) == 0 or any(t not in value_map for t in terms):
+                return {}
+
+            # перебираем документы самого редкого терма и отбрасываем документ, как только его нет у очередного терма
+            terms.sort(key=lambda t: len(value_map[t]))
+            docs_all_terms = []
+            for doc in value_map[terms[0]]:
+                for t in terms[1:]:
+                    if doc not in value_map[t]:
+                        break
+                else:
+                    docs_all_terms.append(doc)
             logger.info("docs_all_terms={}".format(str(docs_all_terms)))
 
+            # ограничения на позиции (фразы, NEAR) проверяем только для документов, где есть все термы
+            if len(self.tokenizer.constraints) > 0:
+                docs_all_terms = [doc for doc in docs_all_terms
+                                  if all(c.match(value_map, doc) for c in self.tokenizer.constraints)]
+                logger.info("constraints={} docs={}".format(str(self.tokenizer.constraints), str(docs_all_terms)))
+
             result_map = dict()
             # result_map = { doc : { term : [positions] } }
             for doc in docs_all_terms:
@@ -77,9 +176,4 @@ class QueryTree:
                 for t in self.tokenizer.tokens:
                     result_map[doc][t] = value_map[t][doc]
 
-            # ВАШ КОД ЗДЕСЬ!
-
-            # нужно написать код, который строит итоговый словарь только для тех документов,
-            # в которых встречаются _все_ слова из запроса
-
             return result_map
@@ -3,8 +3,10 @@
 
 import logging
 import sys
+import time
 
-from urllib.parse import unquote
+from heapq import merge
+from heapq import nlargest
 
 from index.wrapper import Wrapper
 from search_shell.qtree import QueryTree
@@ -20,6 +22,10 @@ class Shell:
     wrapper = None
     main_path = None
     tree = None
+    # сколько термов словаря подставлять вместо одного префиксного терма "кот*"
+    prefix_limit = 100
+    # сколько документов показывать в выдаче
+    top_size = 10
 
     def __init__(self, main_path):
         self.main_path = main_path
@@ -28,18 +34,45 @@ class Shell:
         res = {}
 
         for term in terms:
+            if len(term) > 1 and term.endswith('*'):
+                expansion = self.wrapper.words_dict.prefix_items(term[:-1], self.prefix_limit)
+                logger.info(msg="prefix {} -> {}".format(term, str([word for word, key in expansion])))
+                if len(expansion) > 0:
+                    res[term] = self.live_docs(self.merge_inverted_lists(
+                        [self.wrapper.index.extract_inverted_list(key) for word, key in expansion]))
+                continue
             key = self.wrapper.words_dict.get_key(term)
             if key is not None:
-                res[term] = self.wrapper.index.extract_inverted_list(key)
+                res[term] = self.live_docs(self.wrapper.index.extract_inverted_list(key))
+        return res
+
+    def live_docs(self, inverted_list):
+        # { doc : [positions] } без удаленных документов: они не участвуют ни в поиске, ни в ранжировании
+        if len(self.wrapper.deleted.bits) == 0:
+            return inverted_list
+        return dict((doc, positions) for doc, positions in inverted_list.items() if doc not in self.wrapper.deleted)
+
+    @staticmethod
+    def merge_inverted_lists(inverted_lists):
+        # { doc : [positions] } нескольких термов -> один такой же словарь, позиции в документе остаются отсортированными
+        # так префиксный терм для фраз, NEAR и ранжирования выглядит как обычный терм
+        res = {}
+        for inverted_list in inverted_lists:
+            for doc, positions in inverted_list.items():
+                if doc in res:
+                    res[doc] = list(merge(res[doc], positions))
+                else:
+                    res[doc] = positions
         return res
 
     def decipher_query_results(self, query_result):
-        doc_list = []
+        # у документов с повторяющимся url нет своего url в docs.dic: такие doc_id не попадают ни в выдачу, ни в Total
+        ranked = []
         for doc_id in query_result:
-            doc_tuple = (self.wrapper.docs_dict.d[doc_id], self.count_rank(query_result[doc_id]))
-            doc_list.append(doc_tuple)
-        doc_list.sort(key=lambda tup: -tup[1])
-        return (len(doc_list), doc_list[:10])  # top-10
+            url = self.wrapper.get_doc_url(doc_id)
+            if url is not None:
+                ranked.append((url, self.count_rank(query_result[doc_id])))
+        return (len(ranked), nlargest(self.top_size, ranked, key=lambda tup: tup[1]))
 
     def count_rank(self, doc_result_map):
         # doc_result_map = { term : [positions] }
@@ -70,10 +103,6 @@ class Shell:
 
         return 1000./min_valid_start + 100./min_valid_range
 
-    @staticmethod
-    def human_readable_url(raw_url):
-        return unquote(raw_url)
-
     def run(self):
         logger.info(msg="Start index shell")
         self.wrapper = Wrapper(self.main_path)
@@ -82,9 +111,14 @@ class Shell:
             input_str = ''.join(elem for elem in input(">> "))
 
             if input_str == "quit":
+                # словоформы запросов, которых не было в кэше лемм, пригодятся следующим запускам
+                self.wrapper.lemmatizer.save()
                 return
 
-            tree = QueryTree(input_str, self.wrapper.lemmatizer)
+            started = time.perf_counter()
+            # удаления с момента прошлого запроса видны сразу
+            self.wrapper.deleted.refresh()
+            tree = QueryTree(input_str, self.wrapper.lemmatizer, self.wrapper)
             terms = tree.extract_terms()
             res_map = self.fill_from_index(terms)
             if res_map is None:
@@ -96,7 +130,9 @@ class Shell:
                 else:
                     docs_result = self.decipher_query_results(query_result)
                     print("Total: " + str(docs_result[0]) + " doc(s) found")
-                    print('\n'.join("r = " + str(doc_rank) + " " + self.human_readable_url(doc_name) for (doc_name, doc_rank) in docs_result[1]))
+                    print('\n'.join("r = " + str(doc_rank) + " " + doc_name for (doc_name, doc_rank) in docs_result[1]))
+            logger.info(msg="Query done in {:.1f} ms. Lemma cache: {}".format(
+                (time.perf_counter() - started) * 1000, self.wrapper.lemmatizer.cache_stats()))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,73 @@
+#!/usr/bin/python3.4
+# -*- coding: utf-8 -*-
+
+import unittest
+from unittest import TestCase
+
+import json
+import os
+import shutil
+
+from index.builder import IndexBuilder
+from index.lemmatizer import LemmaCache
+from index.wrapper import Dictionary
+from index.wrapper import IndexPathWrapper
+from index.wrapper import RevertIndex
+
+
+class IndexBuilderTestCase(TestCase):
+    index_path = "./test_builder"
+    docs = [
+        ("http://a/1", "Москва - столица России, город федерального значения."),
+        ("http://a/2", "Кот и пес. Коты, псы и кошки!"),
+        ("http://a/3", "Яблоки и груши: яблоками кормят котов."),
+        ("http://a/4", "Город-герой Москва."),
+        ("http://a/5", "Груши, сливы и кошки.")
+    ]
+
+    def setUp(self):
+        os.makedirs(self.index_path)
+        with open(IndexPathWrapper(self.index_path).get_raw_docs_path(), "w") as out_file:
+            for url, content in self.docs:
+                out_file.write(json.dumps({"url": url, "content": content}) + "\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.index_path)
+
+    def read_index(self):
+        # содержимое файлов индекса: порядок записей в файле зависит от того, сбрасывались ли прогоны
+        ipw = IndexPathWrapper(self.index_path)
+        dictionaries = []
+        for path in [ipw.get_words_dict_path(), ipw.get_forms_dict_path()]:
+            dictionary = Dictionary()
+            dictionary.load_dict(path)
+            dictionaries.append(dictionary.d)
+        with open(ipw.get_docs_dict_path(), "rb") as bin_file:
+            docs = bin_file.read()
+        return dictionaries, docs, sorted(RevertIndex.read(ipw.get_index_path()))
+
+    def test_memory_budget(self):
+        ipw = IndexPathWrapper(self.index_path)
+        IndexBuilder(self.index_path).build_index()
+        reference = self.read_index()
+        with open(ipw.get_build_stats_path(), "r") as in_file:
+            report = json.load(in_file)
+        self.assertEqual(len(self.docs), report["docs"])
+        self.assertEqual(len(reference[0][0]), report["terms"])
+        self.assertEqual(["invert", "lemmatize", "normalize", "parse", "save"], sorted(report["stages"].keys()))
+        self.assertEqual(report["tokens"], report["lemmatizer_cache"]["hits"] + report["lemmatizer_cache"]["misses"])
+        words, forms = reference[0]
+        self.assertEqual([words[u"кошка"], words[u"груша"]], [forms[u"кошки"], forms[u"груши"]])
+
+        # при маленьком бюджете памяти списки, словоформы и новые словоформы кэша лемм сбрасываются на диск,
+        # а содержимое индекса остается тем же; прогоны после построения удаляются
+        for memory_budget in [1, 1000]:
+            os.remove(ipw.get_lemma_cache_path())
+            IndexBuilder(self.index_path, memory_budget).build_index()
+            self.assertEqual(reference, self.read_index(), memory_budget)
+            self.assertEqual([], [name for name in os.listdir(self.index_path) if name.endswith((".run", ".forms"))])
+            self.assertEqual("кошка", LemmaCache(ipw.get_lemma_cache_path()).get("кошки"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,6 +5,8 @@ import unittest
 from unittest import TestCase
 
 from index.wrapper import Dictionary
+from index.wrapper import DocsDictionary
+from index.wrapper import SpimiForms
 
 import os.path
 
@@ -98,6 +100,59 @@ class IndexDictionariesTestCase(TestCase):
         self.assertTrue(u"груша" in another_dictionary.d)
         self.assertTrue(u"123" in another_dictionary.d)
 
+    def test_dict_prefix(self):
+        dictionary = Dictionary()
+        for i, word in enumerate([u"яблоко", u"яблоня", u"груша", "ab", "a", "abc"]):
+            dictionary.add_elem(word, i + 1)
+
+        self.assertEqual([(u"яблоко", 1), (u"яблоня", 2)], dictionary.prefix_items(u"ябл"))
+        self.assertEqual([("a", 5), ("ab", 4), ("abc", 6)], dictionary.prefix_items("a"))
+        self.assertEqual([("a", 5)], dictionary.prefix_items("a", 1))
+        self.assertEqual([], dictionary.prefix_items("c"))
+
+    def test_spimi_forms(self):
+        forms = dict((u"форма%03d" % i, u"терм%03d" % (i % 50)) for i in range(100))
+        # словоформы приходят кусками и сбрасываются прогонами, повторы между прогонами пропускаются
+        spimi_forms = SpimiForms(".")
+        items = sorted(forms.items(), reverse=True)
+        for start in range(0, len(items), 30):
+            spimi_forms.update(dict(items[start:start + 40]))
+            self.assertEqual(len(items[start:start + 40]) * SpimiForms.pair_size, spimi_forms.memory_used)
+            spimi_forms.flush_run()
+            self.assertEqual(0, spimi_forms.memory_used)
+        spimi_forms.update({u"форма000": u"терм000", u"форма100": u"терм001"})
+        forms[u"форма100"] = u"терм001"
+        self.assertEqual(4, len(spimi_forms.runs))
+        self.assertEqual(sorted(forms.items()), list(spimi_forms.items()))
+
+        # forms.dic хранит вместо лемм term_id, здесь - номер терма
+        Dictionary.write(self.dictionary_path, ((form, int(lemma[4:])) for form, lemma in spimi_forms.items()),
+                         len(forms))
+        dictionary = Dictionary()
+        dictionary.load_dict(self.dictionary_path)
+        self.assertEqual(dict((form, int(lemma[4:])) for form, lemma in forms.items()), dictionary.d)
+
+        runs = spimi_forms.runs
+        spimi_forms.close()
+        self.assertFalse(any(os.path.exists(run) for run in runs))
+
+    def test_docs_dict(self):
+        d = {"https://ru.wikipedia.org/wiki/%D0%9C%D0%BE%D1%81%D0%BA%D0%B2%D0%B0": 1,
+             "https://ru.wikipedia.org/wiki/%D0%A0%D0%B8%D0%BC": 2,
+             "http://example.com/a%20b": 4}
+        DocsDictionary.write(self.dictionary_path, d)
+        self.assertTrue(DocsDictionary.has_header(self.dictionary_path))
+
+        docs_dictionary = DocsDictionary(self.dictionary_path)
+        self.assertEqual(3, docs_dictionary.dictionary_size)
+        self.assertEqual(u"https://ru.wikipedia.org/wiki/Москва", docs_dictionary.get_elem(1))
+        self.assertEqual(u"https://ru.wikipedia.org/wiki/Рим", docs_dictionary.get_elem(2))
+        self.assertEqual("http://example.com/a b", docs_dictionary.get_elem(4))
+        self.assertIsNone(docs_dictionary.get_elem(3))
+        self.assertIsNone(docs_dictionary.get_elem(0))
+        self.assertIsNone(docs_dictionary.get_elem(5))
+        docs_dictionary.close()
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -5,9 +5,21 @@ import unittest
 from unittest import TestCase
 
 from index.wrapper import RevertIndex
+from index.wrapper import SpimiRevertIndex
+from index.wrapper import Tombstones
+
+import os.path
 
 
 class IndexRITestCase(TestCase):
+    index_path = "./test.idx"
+    spimi_index_path = "./test_spimi.idx"
+    deletes_path = "./test_deletes.bm"
+
+    def tearDown(self):
+        for path in [self.index_path, self.spimi_index_path, self.deletes_path]:
+            if os.path.exists(path):
+                os.remove(path)
 
     def test_index_basic(self):
         doc_ids = [1, 2, 3, 4, 5, 6]
@@ -69,6 +81,34 @@ class IndexRITestCase(TestCase):
                 expected[pair[0]] = pair[1]
             self.assertEqual(expected, index.extract_inverted_list(word))
 
+    def test_spimi_index(self):
+        index = RevertIndex()
+        spimi_index = SpimiRevertIndex(2000, ".")
+        for doc_id in range(1, 100):
+            for term_id in sorted({doc_id % 7 + 1, doc_id % 13 + 20, 100 + doc_id // 50}):
+                positions = [doc_id % 5, doc_id % 5 + term_id]
+                index.add_doc(term_id, doc_id, positions)
+                spimi_index.add_doc(term_id, doc_id, positions)
+        self.assertTrue(len(spimi_index.runs) > 2)
+
+        # файл обычного индекса пишется в порядке добавления термов, поэтому сравниваем содержимое
+        index.save_index(self.index_path)
+        spimi_index.save_index(self.spimi_index_path)
+        self.assertEqual(sorted(RevertIndex.read(self.index_path)), list(RevertIndex.read(self.spimi_index_path)))
+
+        loaded = RevertIndex()
+        loaded.load_index(self.spimi_index_path)
+        self.assertEqual({7: [2, 3], 14: [4, 5]}, {doc: loaded.extract_inverted_list(1)[doc] for doc in [7, 14]})
+
+    def test_tombstones(self):
+        tombstones = Tombstones(self.deletes_path)
+        self.assertFalse(1 in tombstones)
+        Tombstones.delete(self.deletes_path, 2)
+        Tombstones.delete(self.deletes_path, 12)
+        self.assertTrue(tombstones.refresh())
+        self.assertEqual([2, 12], list(tombstones))
+        self.assertEqual([1, 3], list(tombstones.filter([1, 2, 3, 12])))
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
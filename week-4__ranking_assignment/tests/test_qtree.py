@@ -103,6 +103,68 @@ class QTreeTestCase(TestCase):
         }
         self.assertEqual(qt.left_right_root_execute(input), expected_output)
 
+    def test_phrase_tokenizer(self):
+        tkzr = Tokenizer('"apple  grapes" lemon NEAR/3 ginger', self.lemmatizer)
+        tkzr.tokenize()
+        self.assertEqual(tkzr.tokens, ['apple', 'grapes', 'lemon', 'ginger'])
+        self.assertEqual(repr(tkzr.constraints), '["apple grapes", lemon NEAR/3 ginger]')
+
+    def test_phrase_execution(self):
+        input = {
+            "apple": {1: [1, 5, 9], 2: [4], 3: [2]},
+            "grapes": {1: [3, 10], 2: [7], 3: [3]},
+            "lemon": {1: [11], 3: [4]},
+        }
+        qt = QueryTree('"apple grapes"', self.lemmatizer)
+        self.assertEqual(sorted(qt.left_right_root_execute(input).keys()), [1, 3])
+        qt = QueryTree('"apple grapes lemon"', self.lemmatizer)
+        self.assertEqual(sorted(qt.left_right_root_execute(input).keys()), [1, 3])
+        qt = QueryTree('"grapes apple"', self.lemmatizer)
+        self.assertEqual(qt.left_right_root_execute(input), {})
+        qt = QueryTree('"apple lemon"', self.lemmatizer)
+        self.assertEqual(qt.left_right_root_execute(input), {})
+
+    def test_near_execution(self):
+        input = {
+            "apple": {1: [1, 20], 2: [4], 3: [2]},
+            "grapes": {1: [10, 30], 2: [7], 3: [9]},
+        }
+        qt = QueryTree('apple NEAR/3 grapes', self.lemmatizer)
+        self.assertEqual(qt.left_right_root_execute(input), {2: {"apple": [4], "grapes": [7]}})
+        qt = QueryTree('grapes NEAR/10 apple', self.lemmatizer)
+        self.assertEqual(sorted(qt.left_right_root_execute(input).keys()), [1, 2, 3])
+
+    def test_prefix_tokenizer(self):
+        tkzr = Tokenizer('Apple* "lemon gra*"', self.lemmatizer)
+        tkzr.tokenize()
+        self.assertEqual(tkzr.tokens, ['apple*', 'lemon', 'gra*'])
+
+        input = {
+            "apple*": {1: [1, 20], 2: [4]},
+            "lemon": {1: [5], 2: [2]},
+            "gra*": {1: [6], 2: [7]},
+        }
+        qt = QueryTree('apple* "lemon gra*"', self.lemmatizer)
+        self.assertEqual(sorted(qt.left_right_root_execute(input).keys()), [1])
+
+    def test_forms_tokenizer(self):
+        class Forms:
+            def form_term(self, form):
+                return {"apples": "apple", "lemons": "lemon"}.get(form)
+
+        class NoLemmatizer:
+            def lemmatize(self, word):
+                raise AssertionError("'{}' must be found in forms".format(word))
+
+        tkzr = Tokenizer('Apples "lemons gra*"', NoLemmatizer(), Forms())
+        tkzr.tokenize()
+        self.assertEqual(tkzr.tokens, ['apple', 'lemon', 'gra*'])
+
+        # словоформы не из документов индекса лемматизируются как обычно
+        tkzr = Tokenizer('apples grapes', self.lemmatizer, Forms())
+        tkzr.tokenize()
+        self.assertEqual(tkzr.tokens, ['apple', 'grapes'])
+
 
 if __name__ == '__main__':
     unittest.main()
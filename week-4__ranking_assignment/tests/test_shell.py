@@ -1,5 +1,13 @@
 from unittest import TestCase
 
+import json
+import os
+import shutil
+
+from index.builder import IndexBuilder
+from index.wrapper import IndexPathWrapper
+from index.wrapper import Wrapper
+from search_shell.qtree import QueryTree
 from search_shell.shell import Shell
 
 
@@ -21,3 +29,44 @@ class ShellTestCase(TestCase):
         # min_interval = [44, 46]
         # 1000/45 + 100/3 = 55.55(5)
         self.assertTrue(abs(55.55556 - rank) < 0.0001)
+
+    def testMergeInvertedLists(self):
+        merged = Shell.merge_inverted_lists([{1: [2, 9], 3: [4]}, {1: [1, 5], 2: [7]}, {1: [3]}])
+        self.assertEqual({1: [1, 2, 3, 5, 9], 2: [7], 3: [4]}, merged)
+        self.assertEqual({}, Shell.merge_inverted_lists([]))
+
+
+class DuplicateUrlsTestCase(TestCase):
+    index_path = "./test_shell_index"
+
+    def setUp(self):
+        # документ 3 повторяет url документа 1, своего url в docs.dic у него нет
+        os.makedirs(self.index_path)
+        with open(IndexPathWrapper(self.index_path).get_raw_docs_path(), "w") as out_file:
+            for url, content in [("http://a/1", "apple"), ("http://a/2", "apple"),
+                                 ("http://a/1", "lemon apple"), ("http://a/4", "apple lemon")]:
+                out_file.write(json.dumps({"url": url, "content": content}) + "\n")
+        IndexBuilder(self.index_path).build_index()
+
+    def tearDown(self):
+        shutil.rmtree(self.index_path)
+
+    def test_duplicate_urls(self):
+        shell = Shell(self.index_path)
+        shell.wrapper = Wrapper(self.index_path)
+        self.assertIsNone(shell.wrapper.get_doc_url(3))
+
+        tree = QueryTree("apple", shell.wrapper.lemmatizer, shell.wrapper)
+        query_result = tree.left_right_root_execute(shell.fill_from_index(tree.extract_terms()))
+        self.assertEqual([1, 2, 3, 4], sorted(query_result))
+        total, top = shell.decipher_query_results(query_result)
+        # doc_id без url не входит ни в выдачу, ни в Total
+        self.assertEqual(3, total)
+        self.assertEqual(["http://a/1", "http://a/2", "http://a/4"], sorted(url for url, rank in top))
+
+        # у документа 3 ранг выше, но показать его нельзя: первое место занимает документ 4
+        shell.top_size = 1
+        tree = QueryTree("lemon", shell.wrapper.lemmatizer, shell.wrapper)
+        total, top = shell.decipher_query_results(
+            tree.left_right_root_execute(shell.fill_from_index(tree.extract_terms())))
+        self.assertEqual((1, ["http://a/4"]), (total, [url for url, rank in top]))
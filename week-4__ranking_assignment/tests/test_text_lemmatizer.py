@@ -1,15 +1,123 @@
 import unittest
 from unittest import TestCase
 
+import os
+
+from index.lemmatizer import LemmaCache
 from index.lemmatizer import TextLemmatizer
 
 
 class TextLemmatizerTestCase(TestCase):
+    cache_path = "./test_lemmas.cache"
+
+    def tearDown(self):
+        if os.path.exists(self.cache_path):
+            os.remove(self.cache_path)
+
     def test_basics(self):
         lemmatizer = TextLemmatizer()
         self.assertEqual("яблоко", lemmatizer.lemmatize("яблоками"))
         self.assertEqual("удивительный", lemmatizer.lemmatize("удивительнейшая"))
 
+    def test_lemma_cache(self):
+        lemmatizer = TextLemmatizer(self.cache_path)
+        self.assertEqual("яблоко", lemmatizer.lemmatize("яблоками"))
+        self.assertEqual("яблоко", lemmatizer.lemmatize("яблоками"))
+        self.assertEqual((1, 1), (lemmatizer.cache_hits, lemmatizer.cache_misses))
+        lemmatizer.save()
+        self.assertEqual(0, len(lemmatizer.new_lemmas))
+
+        # новый процесс берет лемму из файла, pymorphy2 разбирает только незнакомые словоформы
+        lemmatizer = TextLemmatizer(self.cache_path)
+        self.assertEqual("яблоко", lemmatizer.lemmatize("яблоками"))
+        self.assertEqual("груша", lemmatizer.lemmatize("груши"))
+        self.assertEqual((1, 1), (lemmatizer.cache_hits, lemmatizer.cache_misses))
+        lemmatizer.save()
+
+        # новые пары сливаются со старыми и переписывают их
+        LemmaCache.write(self.cache_path, {"яблоками": "яблоки", "apples": "apple"})
+        cache = LemmaCache(self.cache_path)
+        self.assertEqual(3, len(cache))
+        self.assertEqual("яблоки", cache.get("яблоками"))
+        self.assertEqual("груша", cache.get("груши"))
+        self.assertEqual("apple", cache.get("apples"))
+        self.assertIsNone(cache.get("грушами"))
+        self.assertEqual([b"apples", "груши".encode('utf-8'), "яблоками".encode('utf-8')],
+                         [form for form, lemma in cache.items()])
+        cache.close()
+
+    def test_lru(self):
+        lemmatizer = TextLemmatizer(cache_size=2)
+        for word in ["яблоками", "груши", "яблоками", "сливы", "груши", "яблоками"]:
+            lemmatizer.lemmatize(word)
+        # повторное обращение к "яблоками" сделало самой старой "груши": ее и вытеснили "сливы"
+        self.assertEqual(["груши", "яблоками"], list(lemmatizer.cache.keys()))
+        self.assertEqual({"size": 2, "capacity": 2, "hits": 1, "misses": 5, "evictions": 3},
+                         lemmatizer.cache_stats())
+
+    def test_lemma_cache_flush(self):
+        # без autosave новые словоформы копятся до take_new_lemmas/save, файл не пишется
+        lemmatizer = TextLemmatizer(self.cache_path, cache_size=1)
+        lemmatizer.lemmatize("яблоками")
+        lemmatizer.lemmatize("груши")
+        self.assertFalse(os.path.exists(self.cache_path))
+        self.assertEqual({"яблоками": "яблоко", "груши": "груша"}, lemmatizer.take_new_lemmas())
+
+        # порог сброса свой, не размер LRU: файл пишется каждые autosave_size новых словоформ
+        lemmatizer = TextLemmatizer(self.cache_path, autosave=True, autosave_size=2)
+        lemmatizer.lemmatize("яблоками")
+        self.assertEqual(1, len(lemmatizer.new_lemmas))
+        self.assertFalse(os.path.exists(self.cache_path))
+        lemmatizer.lemmatize("груши")
+        self.assertEqual(0, len(lemmatizer.new_lemmas))
+        self.assertEqual("яблоко", LemmaCache(self.cache_path).get("яблоками"))
+        self.assertTrue(TextLemmatizer.autosave_size < TextLemmatizer.cache_size)
+
+        umask = os.umask(0)
+        os.umask(umask)
+        self.assertEqual(0o666 & ~umask, os.stat(self.cache_path).st_mode & 0o777)
+
+    def test_lemma_cache_version(self):
+        LemmaCache.write(self.cache_path, {"груши": "груша"})
+        with open(self.cache_path, "r+b") as bin_file:
+            bin_file.seek(LemmaCache.header_struct.size)
+            bin_file.write(b"X")
+        cache = LemmaCache(self.cache_path)
+        self.assertEqual(0, len(cache))
+        self.assertIsNone(cache.get("груши"))
+
+    def test_damaged_lemma_cache(self):
+        LemmaCache.write(self.cache_path, {"груши": "груша", "яблоками": "яблоко"})
+        with open(self.cache_path, "rb") as bin_file:
+            data = bin_file.read()
+        # пустой файл, обрезанный заголовок, обрезанная таблица и обрезанные строки: кэша нет, лемматизатор работает
+        for size in [0, LemmaCache.header_struct.size - 1, len(data) - 30, len(data) - 1]:
+            with open(self.cache_path, "wb") as bin_file:
+                bin_file.write(data[:size])
+            lemmatizer = TextLemmatizer(self.cache_path)
+            self.assertEqual("груша", lemmatizer.lemmatize("груши"))
+            self.assertEqual(0, len(lemmatizer.disk_cache))
+            self.assertEqual(1, lemmatizer.cache_misses)
+            # поврежденный файл заменяется целым
+            lemmatizer.save()
+            self.assertEqual("груша", LemmaCache(self.cache_path).get("груши"))
+
+    def test_shared_analyzer(self):
+        first = TextLemmatizer()
+        second = TextLemmatizer()
+        self.assertIsNone(first.morph)
+        first.lemmatize("яблоками")
+        second.lemmatize("груши")
+        self.assertIsNotNone(first.morph)
+        self.assertIs(first.morph, second.morph)
+
+        # словоформы из кэша на диске разбирать не нужно, анализатор не берется
+        LemmaCache.write(self.cache_path, {"груши": "груша"})
+        third = TextLemmatizer(self.cache_path)
+        self.assertEqual("груша", third.lemmatize("груши"))
+        self.assertIsNone(third.morph)
+        third.disk_cache.close()
+
 
 if __name__ == '__main__':
     unittest.main()